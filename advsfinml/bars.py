@@ -1,26 +1,489 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from datetime import datetime
-
-data = pd.read_csv('C:\\tmpwork\\data\\trade_20181127.csv')
-# append few more days
-data = data.append(pd.read_csv('C:\\tmpwork\\data\\trade_20181128.csv'))
-data = data.append(pd.read_csv('C:\\tmpwork\\data\\trade_20181129.csv'))
-data = data[data.symbol == 'XBTUSD']
-# timestamp parsing, convert string to time
-data['timestamp'] = data.timestamp.map(lambda t: datetime.strptime(t[:-3], '%Y-%m-%dD%H:%M:%S.%f'))
-
-
-def compute_vwap(df):
-    q = df['foreignNotional']
-    p = df['price']
-    vwap = np.sum(p*q) / np.sum(q)
-    df['vwap'] = vwap
-
-
-data_timeidx = data.set_index('timestamp')
-data_time_grp = data_timeidx.groupby(pd.Grouper(freq='15Min'))
-num_time_bars = len(data_time_grp)
-data_time_vwap = data_time_grp.apply(compute_vwap)
\ No newline at end of file
+
+# Bar construction from trade streams (Advances in Financial Machine Learning, chapter 2)
+#
+# Every builder keeps the state of the bar being formed, so trades can be fed chunk by chunk and the
+# bars come out the same as building them from the whole day at once. The batch functions
+# (time_bars, tick_bars, ...) simply feed one chunk. Bar boundaries are found on cumulative sums
+# with searchsorted (or a vectorized scan for the signed imbalance), and the OHLCV/VWAP of all the
+# bars of a chunk are reduced together with numpy.*.reduceat. Python loops run once per bar, never
+# once per trade.
+
+BAR_COLUMNS = ['time_start', 'time', 'open', 'high', 'low', 'close', 'volume', 'dollar', 'vwap', 'ticks']
+SEARCH_SIZE = 1024  # trades scanned first when looking for the end of an imbalance bar, doubled after
+
+
+def empty_bars():
+    return pd.DataFrame({name: pd.Series(dtype='datetime64[ns]' if name.startswith('time') else 'float64')
+                         for name in BAR_COLUMNS})
+
+
+def _aggregate(time, price, volume, ends):
+    """
+    OHLCV of consecutive segments [0, ends[0]), [ends[0], ends[1]), ... as a dict of arrays
+    """
+    ends = np.asarray(ends, dtype=np.int64)
+    starts = np.concatenate(([0], ends[:-1]))
+    dollar = price * volume
+    volume_sum = np.add.reduceat(volume, starts)
+    dollar_sum = np.add.reduceat(dollar, starts)
+    return {
+        'time_start': time[starts],
+        'time': time[ends - 1],
+        'open': price[starts],
+        'high': np.maximum.reduceat(price, starts),
+        'low': np.minimum.reduceat(price, starts),
+        'close': price[ends - 1],
+        'volume': volume_sum,
+        'dollar': dollar_sum,
+        'ticks': (ends - starts).astype(np.float64),
+    }
+
+
+def _merge(partial, bars):
+    """
+    Fold the carried partial bar into the first bar of bars (both dicts of arrays/scalars)
+    """
+    if partial is None:
+        return bars
+    bars = {name: np.array(values, copy=True) for name, values in bars.items()}
+    bars['time_start'][0] = partial['time_start']
+    bars['open'][0] = partial['open']
+    bars['high'][0] = max(partial['high'], bars['high'][0])
+    bars['low'][0] = min(partial['low'], bars['low'][0])
+    for name in ('volume', 'dollar', 'ticks'):
+        bars[name][0] += partial[name]
+    return bars
+
+
+def _to_frame(bars):
+    df = pd.DataFrame({name: bars[name] for name in BAR_COLUMNS if name != 'vwap'})
+    df['vwap'] = df['dollar'] / df['volume']
+    return df[BAR_COLUMNS]
+
+
+def tick_rule(price, last_price=None, last_sign=1):
+    """
+    Aggressor side from the tick rule: the sign of the price change, or the previous sign when the
+    price does not change
+
+    Args:
+        price: The trade prices
+        last_price: The price of the trade before the first one (previous chunk)
+        last_sign: The sign of the trade before the first one
+
+    Returns:
+        An int8 array of +1/-1
+    """
+    if last_price is None:
+        last_price = price[0] if len(price) else 0.0
+    change = np.sign(np.diff(price, prepend=last_price)).astype(np.int8)
+    index = np.where(change != 0, np.arange(len(change)), -1)
+    np.maximum.accumulate(index, out=index)
+    sign = np.where(index >= 0, change[np.maximum(index, 0)], last_sign).astype(np.int8)
+    return sign
+
+
+class BarBuilder:
+    """
+    Base class of the streaming bar builders. update() consumes a chunk of trades and returns the
+    bars completed by it; the unfinished bar is carried over to the next chunk.
+    """
+
+    def __init__(self):
+        self.partial = None  # dict of the unfinished bar
+
+    def update(self, time, price, volume):
+        """
+        Args:
+            time: datetime64[ns] trade times, ordered
+            price: float trade prices
+            volume: float trade sizes
+
+        Returns:
+            A DataFrame of the completed bars
+        """
+        time = np.asarray(time, dtype='datetime64[ns]')
+        price = np.asarray(price, dtype=np.float64)
+        volume = np.asarray(volume, dtype=np.float64)
+        if not len(time):
+            return empty_bars()
+
+        ends = self.find_ends(time, price, volume)
+        n = len(time)
+        count = len(ends)
+        tail = not count or ends[-1] < n  # trades left for the unfinished bar
+        segments = np.append(ends, n) if tail else ends
+        bars = _merge(self.partial, _aggregate(time, price, volume, segments))
+
+        self.partial = {name: values[-1] for name, values in bars.items()} if tail else None
+        if not count:
+            return empty_bars()
+        return _to_frame({name: values[:count] for name, values in bars.items()})
+
+    def flush(self):
+        """
+        Return the unfinished bar as a one-row DataFrame and reset it
+        """
+        if self.partial is None:
+            return empty_bars()
+        bars = {name: np.array([value]) for name, value in self.partial.items()}
+        self.partial = None
+        return _to_frame(bars)
+
+    def find_ends(self, time, price, volume):
+        """
+        Return the (exclusive) end index of every bar completed in the chunk
+        """
+        raise NotImplementedError
+
+
+class TimeBarBuilder(BarBuilder):
+    """
+    Bars of a fixed time interval (pandas frequency string such as '15Min'). A bar is complete when a
+    trade of a later interval arrives; intervals without trades produce no bar.
+    """
+
+    def __init__(self, freq='15Min'):
+        super().__init__()
+        self.freq = pd.Timedelta(freq).value
+        self.last_period = None
+
+    def update(self, time, price, volume):
+        time = np.asarray(time, dtype='datetime64[ns]')
+        if not len(time):
+            return empty_bars()
+        period = time.view(np.int64) // self.freq
+        closed = None
+        if self.partial is not None and period[0] != self.last_period:
+            # the carried bar is closed by the first trade of a later interval
+            closed = self.flush()
+        self.last_period = period[-1]
+        bars = super().update(time, price, volume)
+        if closed is None:
+            return bars
+        return pd.concat([closed, bars], ignore_index=True) if len(bars) else closed
+
+    def find_ends(self, time, price, volume):
+        period = time.view(np.int64) // self.freq
+        return np.flatnonzero(np.diff(period)) + 1
+
+
+class ThresholdBarBuilder(BarBuilder):
+    """
+    Tick, volume and dollar bars: a bar closes on the trade that brings its tick count, volume or
+    dollar value to the threshold. The overshoot is not carried into the next bar.
+    """
+
+    def __init__(self, threshold, measure='volume'):
+        """
+        Args:
+            threshold: The ticks/volume/dollar value of a bar
+            measure: 'tick', 'volume' or 'dollar'
+        """
+        super().__init__()
+        self.threshold = threshold
+        self.measure = measure
+        self.accumulated = 0.0  # measure of the unfinished bar
+
+    def find_ends(self, time, price, volume):
+        if self.measure == 'tick':
+            measure = np.ones(len(time))
+        elif self.measure == 'volume':
+            measure = volume
+        else:
+            measure = price * volume
+        cumulative = np.cumsum(measure)
+
+        ends = []
+        base = -self.accumulated
+        target = self.threshold
+        n = len(cumulative)
+        while True:
+            index = np.searchsorted(cumulative, base + target, 'left')
+            if index >= n:
+                break
+            ends.append(index + 1)
+            base = cumulative[index]
+        self.accumulated = cumulative[-1] - base if n else self.accumulated
+        return np.array(ends, dtype=np.int64)
+
+
+def _first_index(condition, start, end):
+    """
+    First index in [start, end) where condition(lo, hi) is true, scanning blocks of doubling size
+    """
+    lo = start
+    size = SEARCH_SIZE
+    while lo < end:
+        hi = min(end, lo + size)
+        hits = np.flatnonzero(condition(lo, hi))
+        if len(hits):
+            return lo + int(hits[0])
+        lo = hi
+        size *= 2
+    return end
+
+
+def _clip(value, lower, upper):
+    if lower is not None and value < lower:
+        return float(lower)
+    if upper is not None and value > upper:
+        return float(upper)
+    return value
+
+
+class ExpectationBarBuilder(BarBuilder):
+    """
+    Base class of the imbalance and run builders. Their initial expectations, when not given, are
+    estimated from the first expected_ticks trades; the trades are buffered until that many have
+    arrived, so the estimate and the bars do not depend on how the trades are chunked.
+    """
+
+    def __init__(self, expected_ticks):
+        super().__init__()
+        self.expected_ticks = float(expected_ticks)
+        self.pending = []  # (time, price, volume) chunks waiting for the estimate
+
+    def estimated(self):
+        """
+        Whether the initial expectations are known
+        """
+        raise NotImplementedError
+
+    def update(self, time, price, volume):
+        if self.estimated():
+            return super().update(time, price, volume)
+        self.pending.append((np.asarray(time, dtype='datetime64[ns]'), np.asarray(price, dtype=np.float64),
+                             np.asarray(volume, dtype=np.float64)))
+        if sum(len(chunk[0]) for chunk in self.pending) < int(self.expected_ticks):
+            return empty_bars()
+        return self.release()
+
+    def release(self):
+        """
+        Process the buffered trades as one chunk
+        """
+        time, price, volume = (np.concatenate(columns) for columns in zip(*self.pending))
+        self.pending = []
+        return super().update(time, price, volume)
+
+    def flush(self):
+        """
+        Return the bars of the buffered trades, when fewer than expected_ticks arrived, and the
+        unfinished bar
+        """
+        if not self.pending:
+            return super().flush()
+        bars = self.release()
+        rest = super().flush()
+        if not len(bars):
+            return rest
+        return pd.concat([bars, rest], ignore_index=True) if len(rest) else bars
+
+
+class ImbalanceBarBuilder(ExpectationBarBuilder):
+    """
+    Tick or volume imbalance bars. The signed flow theta = sum(b * v) of the bar is compared with
+    E[T] * |E[b * v]|, both expectations being exponentially weighted over the previous bars.
+    """
+
+    def __init__(self, expected_ticks=1000, expected_imbalance=None, alpha=0.1, measure='volume',
+                 min_ticks=None, max_ticks=None):
+        """
+        Args:
+            expected_ticks: The initial E[T]
+            expected_imbalance: The initial E[b * v] per trade, estimated from the first
+                expected_ticks trades when None
+            alpha: The weight of the last bar in the expectations
+            measure: 'tick' (v = 1) or 'volume'
+            min_ticks, max_ticks: Bounds of E[T]; without them E[T] tends to collapse or explode
+        """
+        super().__init__(expected_ticks)
+        self.min_ticks = min_ticks
+        self.max_ticks = max_ticks
+        self.expected_imbalance = expected_imbalance
+        self.alpha = alpha
+        self.measure = measure
+        self.theta = 0.0  # signed flow of the unfinished bar
+        self.ticks = 0  # trades in the unfinished bar
+        self.last_price = None
+        self.last_sign = 1
+
+    def estimated(self):
+        return self.expected_imbalance is not None
+
+    def signed_flow(self, price, volume):
+        sign = tick_rule(price, self.last_price, self.last_sign)
+        self.last_price = price[-1]
+        self.last_sign = int(sign[-1])
+        if self.measure == 'tick':
+            return sign.astype(np.float64)
+        return sign * volume
+
+    def find_ends(self, time, price, volume):
+        flow = self.signed_flow(price, volume)
+        if self.expected_imbalance is None:
+            self.expected_imbalance = float(flow[:int(self.expected_ticks)].mean())
+        cumulative = np.cumsum(flow)
+
+        ends = []
+        start = 0
+        base = -self.theta
+        n = len(flow)
+        while start < n:
+            threshold = self.expected_ticks * abs(self.expected_imbalance)
+            index = _first_index(lambda lo, hi: np.abs(cumulative[lo:hi] - base) >= threshold, start, n)
+            if index >= n:
+                break
+            ticks = self.ticks + index + 1 - start
+            theta = cumulative[index] - base
+            ends.append(index + 1)
+
+            self.expected_ticks = _clip(self.expected_ticks + self.alpha * (ticks - self.expected_ticks),
+                                        self.min_ticks, self.max_ticks)
+            self.expected_imbalance += self.alpha * (theta / ticks - self.expected_imbalance)
+            self.ticks = 0
+            base = cumulative[index]
+            start = index + 1
+
+        self.theta = cumulative[-1] - base
+        self.ticks += n - start
+        return np.array(ends, dtype=np.int64)
+
+
+class RunBarBuilder(ExpectationBarBuilder):
+    """
+    Tick or volume run bars. theta = max(buy flow, sell flow) of the bar is compared with
+    E[T] * max(P[b=1] * E[v | b=1], (1 - P[b=1]) * E[v | b=-1]), exponentially weighted over the
+    previous bars. Both flows only grow, so the end of a bar is a searchsorted on each cumulative sum.
+    """
+
+    def __init__(self, expected_ticks=1000, buy_probability=0.5, expected_buy=None, expected_sell=None,
+                 alpha=0.1, measure='volume', min_ticks=None, max_ticks=None):
+        """
+        Args:
+            expected_ticks: The initial E[T]
+            buy_probability: The initial P[b=1]
+            expected_buy, expected_sell: The initial E[v | b=1] and E[v | b=-1], estimated from the
+                first expected_ticks trades when None
+            alpha: The weight of the last bar in the expectations
+            measure: 'tick' (v = 1) or 'volume'
+            min_ticks, max_ticks: Bounds of E[T]
+        """
+        super().__init__(expected_ticks)
+        self.min_ticks = min_ticks
+        self.max_ticks = max_ticks
+        self.buy_probability = buy_probability
+        self.expected_buy = expected_buy  # E[v | b=1]
+        self.expected_sell = expected_sell  # E[v | b=-1]
+        self.alpha = alpha
+        self.measure = measure
+        self.buy = 0.0  # flows of the unfinished bar
+        self.sell = 0.0
+        self.buy_ticks = 0
+        self.ticks = 0
+        self.last_price = None
+        self.last_sign = 1
+
+    def estimated(self):
+        return self.expected_buy is not None and self.expected_sell is not None
+
+    def find_ends(self, time, price, volume):
+        sign = tick_rule(price, self.last_price, self.last_sign)
+        self.last_price = price[-1]
+        self.last_sign = int(sign[-1])
+        size = np.ones(len(price)) if self.measure == 'tick' else volume
+        buy_flow = np.cumsum(np.where(sign > 0, size, 0.0))
+        sell_flow = np.cumsum(np.where(sign < 0, size, 0.0))
+        buy_count = np.cumsum(sign > 0)
+        if not self.estimated():
+            head = size[:int(self.expected_ticks)]
+            head_sign = sign[:int(self.expected_ticks)]
+            if self.expected_buy is None:
+                self.expected_buy = float(head[head_sign > 0].mean()) if (head_sign > 0).any() else 1.0
+            if self.expected_sell is None:
+                self.expected_sell = float(head[head_sign < 0].mean()) if (head_sign < 0).any() else 1.0
+
+        ends = []
+        start = 0
+        buy_base = -self.buy
+        sell_base = -self.sell
+        count_base = -self.buy_ticks
+        n = len(price)
+        while start < n:
+            threshold = self.expected_ticks * max(self.buy_probability * self.expected_buy,
+                                                  (1 - self.buy_probability) * self.expected_sell)
+            buy_index = np.searchsorted(buy_flow, buy_base + threshold, 'left')
+            sell_index = np.searchsorted(sell_flow, sell_base + threshold, 'left')
+            index = min(buy_index, sell_index, n)
+            if index >= n:
+                break
+            ticks = self.ticks + index + 1 - start
+            buys = int(buy_count[index] - count_base)
+            buy = buy_flow[index] - buy_base
+            sell = sell_flow[index] - sell_base
+            ends.append(index + 1)
+
+            alpha = self.alpha
+            self.expected_ticks = _clip(self.expected_ticks + alpha * (ticks - self.expected_ticks),
+                                        self.min_ticks, self.max_ticks)
+            self.buy_probability += alpha * (buys / ticks - self.buy_probability)
+            if buys:
+                self.expected_buy += alpha * (buy / buys - self.expected_buy)
+            if ticks - buys:
+                self.expected_sell += alpha * (sell / (ticks - buys) - self.expected_sell)
+            self.ticks = 0
+            buy_base = buy_flow[index]
+            sell_base = sell_flow[index]
+            count_base = buy_count[index]
+            start = index + 1
+
+        self.buy = buy_flow[-1] - buy_base
+        self.sell = sell_flow[-1] - sell_base
+        self.buy_ticks = int(buy_count[-1] - count_base)
+        self.ticks += n - start
+        return np.array(ends, dtype=np.int64)
+
+
+def _build(builder, data, price_col, volume_col):
+    return builder.update(data['timestamp'].values, data[price_col].values, data[volume_col].values)
+
+
+def time_bars(data, freq='15Min', price_col='price', volume_col='foreignNotional'):
+    """
+    Time bars with VWAP from a trade DataFrame (timestamp, price, volume columns)
+    """
+    builder = TimeBarBuilder(freq)
+    bars = _build(builder, data, price_col, volume_col)
+    return pd.concat([bars, builder.flush()], ignore_index=True)
+
+
+def tick_bars(data, threshold, price_col='price', volume_col='foreignNotional'):
+    return _build(ThresholdBarBuilder(threshold, 'tick'), data, price_col, volume_col)
+
+
+def volume_bars(data, threshold, price_col='price', volume_col='foreignNotional'):
+    return _build(ThresholdBarBuilder(threshold, 'volume'), data, price_col, volume_col)
+
+
+def dollar_bars(data, threshold, price_col='price', volume_col='foreignNotional'):
+    return _build(ThresholdBarBuilder(threshold, 'dollar'), data, price_col, volume_col)
+
+
+def imbalance_bars(data, measure='volume', price_col='price', volume_col='foreignNotional', **kwargs):
+    return _build(ImbalanceBarBuilder(measure=measure, **kwargs), data, price_col, volume_col)
+
+
+def run_bars(data, measure='volume', price_col='price', volume_col='foreignNotional', **kwargs):
+    return _build(RunBarBuilder(measure=measure, **kwargs), data, price_col, volume_col)
+
+
+if __name__ == "__main__":
+    from advsfinml.trades import trade_files, build_bars
+
+    # 2018-11-27 to 2018-11-29, read in chunks
+    file_names = trade_files('C:\\tmpwork\\data', 20181127, 20181129)
+    data_time_vwap = build_bars(file_names, TimeBarBuilder('15Min'), symbol='XBTUSD')
+    num_time_bars = len(data_time_vwap)
@@ -0,0 +1,99 @@
+import glob
+import os
+
+import pandas as pd
+
+from advsfinml.bars import empty_bars
+
+# Chunked reader of the BitMEX daily trade dumps (trade_YYYYMMDD.csv[.gz])
+#
+# Files are read in fixed-size chunks with only the needed columns, the rows of other symbols are
+# dropped before anything else is done, and timestamps are parsed by pandas with an explicit format
+# instead of one strptime call per row. Chunks go straight into the streaming bar builders of
+# advsfinml.bars, whose unfinished bar carries across chunk and file boundaries, so the memory used
+# does not depend on how many days are read.
+
+CHUNK_SIZE = 1_000_000
+TIME_FORMAT = '%Y-%m-%dD%H:%M:%S.%f'  # 2018-11-27D00:00:05.123456000
+COLUMNS = ['timestamp', 'symbol', 'price', 'size', 'foreignNotional']
+
+
+def trade_files(data_path, start=None, end=None):
+    """
+    Sorted trade dump files of data_path, optionally limited to the dates [start, end] (YYYYMMDD)
+    """
+    file_names = sorted(glob.glob(os.path.join(data_path, 'trade_*.csv*')))
+    selected = []
+    for file_name in file_names:
+        date = os.path.basename(file_name)[6:14]
+        if start is not None and date < str(start):
+            continue
+        if end is not None and date > str(end):
+            continue
+        selected.append(file_name)
+    return selected
+
+
+def parse_timestamp(values):
+    """
+    Vectorized parse of the dump timestamps into datetime64[ns]
+    """
+    return pd.to_datetime(values, format=TIME_FORMAT)
+
+
+def iter_trades(file_names, symbol=None, chunksize=CHUNK_SIZE, columns=None):
+    """
+    Iterate over the trades of the files as DataFrames of at most chunksize rows
+
+    Args:
+        file_names: Trade dump files, in time order
+        symbol: Keep only this symbol (e.g. 'XBTUSD')
+        chunksize: Rows read at a time
+        columns: Columns to read, COLUMNS by default
+
+    Yields:
+        DataFrames with a parsed timestamp column
+    """
+    columns = columns or COLUMNS
+    if isinstance(file_names, str):
+        file_names = [file_names]
+    for file_name in file_names:
+        reader = pd.read_csv(file_name, usecols=columns, chunksize=chunksize,
+                             dtype={'symbol': 'category'})
+        for chunk in reader:
+            if symbol is not None:
+                chunk = chunk[chunk['symbol'] == symbol]
+            if not len(chunk):
+                continue
+            chunk = chunk.reset_index(drop=True)
+            chunk['timestamp'] = parse_timestamp(chunk['timestamp'])
+            yield chunk
+
+
+def build_bars(file_names, builder, symbol=None, price_col='price', volume_col='foreignNotional',
+               chunksize=CHUNK_SIZE, flush=True):
+    """
+    Feed the trades of the files to a streaming bar builder
+
+    Args:
+        file_names: Trade dump files, in time order
+        builder: A builder of advsfinml.bars (TimeBarBuilder, ThresholdBarBuilder, ...)
+        symbol: Keep only this symbol
+        flush: Append the unfinished last bar
+
+    Returns:
+        A DataFrame of the bars
+    """
+    columns = list(dict.fromkeys(['timestamp', 'symbol', price_col, volume_col]))
+    bar_list = []
+    for chunk in iter_trades(file_names, symbol, chunksize, columns):
+        bars = builder.update(chunk['timestamp'].values, chunk[price_col].values, chunk[volume_col].values)
+        if len(bars):
+            bar_list.append(bars)
+    if flush:
+        bars = builder.flush()
+        if len(bars):
+            bar_list.append(bars)
+    if not bar_list:
+        return empty_bars()
+    return pd.concat(bar_list, ignore_index=True)
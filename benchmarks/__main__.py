@@ -0,0 +1,51 @@
+import argparse
+import sys
+
+from benchmarks.runner import run_suite, load_baseline, save_baseline, compare, report
+from benchmarks.runner import BASELINE, REPEAT, MIN_TIME, PROCESSES, THRESHOLD
+from benchmarks.suite import BENCHMARKS
+
+# python -m benchmarks [name ...] [--scale 0.1] [--repeat 5] [--min-time 1] [--processes 3] [--save]
+#                      [--baseline path] [--threshold 0.2]
+#
+# Runs the benchmarks, compares them with the baseline and exits with 1 when one of them regressed
+# beyond both the threshold and the noise of its runs.
+# --save records the results as the new baseline. Results are compared only with a baseline of the same
+# size: keep the baseline of a scaled run in its own file with --baseline.
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Time the hot paths')
+    parser.add_argument('names', nargs='*', metavar='name', help='benchmarks to run: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies the size of every benchmark')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='minimum timed runs of each benchmark per process')
+    parser.add_argument('--min-time', type=float, default=MIN_TIME,
+                        help='seconds of timed runs each benchmark is repeated for per process')
+    parser.add_argument('--processes', type=int, default=PROCESSES,
+                        help='fresh interpreters each benchmark is timed in, 1 to time in this process')
+    parser.add_argument('--baseline', default=BASELINE, help='the JSON baseline file')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='relative slowdown per item reported as a regression')
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmark: {}'.format(', '.join(unknown)))
+
+    results = run_suite(args.names or None, args.scale, args.repeat, args.min_time, args.processes)
+    rows = compare(results, load_baseline(args.baseline), args.threshold)
+    print(report(results, rows))
+
+    if args.save:
+        save_baseline(results, args.baseline)
+        print('baseline saved to {}'.format(args.baseline))
+        return 0
+    regressions = [row["name"] for row in rows if row["regression"]]
+    if regressions:
+        print('regressions beyond {:.0%}: {}'.format(args.threshold, ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from benchmarks.suite import BENCHMARKS
+
+# Timing, JSON baselines and regression checks
+#
+# A benchmark is compared on its median time per item, which stays comparable between commits of
+# the same size. It is timed in PROCESSES fresh interpreters one after the other, as pyperf does: the
+# hash seed and memory layout of a process shift a whole series of runs, which repeats inside one
+# process do not show. In each process short benchmarks are repeated until they have run for
+# MIN_TIME, with the garbage collector off while a run is timed, as in timeit.
+#
+# The spread of a result is the larger of the median absolute deviation of all its runs and half the
+# range of the per-process medians, relative to the median. A change is a regression only when it
+# exceeds both the threshold and NOISE_FACTOR times the larger spread of the baseline and the current
+# result, so a benchmark that is noisy on a machine does not fail the gate on its own.
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+REPEAT = 5  # minimum runs per process
+MAX_REPEAT = 50
+MIN_TIME = 1.0  # seconds of timed runs per process
+PROCESSES = 3
+THRESHOLD = 0.2  # 20% slower than the baseline
+NOISE_FACTOR = 2
+
+
+def time_runs(benchmark, size, repeat=REPEAT, min_time=MIN_TIME):
+    """
+    Time a benchmark in this process at least repeat times, and until min_time seconds have been
+    timed (at most MAX_REPEAT runs), each on a fresh setup
+
+    Returns:
+        (timings, count): the seconds of every run and the number of items of one run
+    """
+    timings = []
+    count = 0
+    while len(timings) < repeat or (sum(timings) < min_time and len(timings) < MAX_REPEAT):
+        run, count = benchmark(size)
+        gc.collect()
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        finally:
+            if gc_enabled:
+                gc.enable()
+    return timings, count
+
+
+def time_benchmark(benchmark, size, repeat=REPEAT, min_time=MIN_TIME, processes=PROCESSES):
+    """
+    Time a benchmark in processes fresh interpreters, or in this process when processes is 1
+
+    Returns:
+        A dict of the size, the number of items, the number of runs, the best and median seconds, the
+        median time per item and the spread of the runs
+    """
+    if processes > 1:
+        context = multiprocessing.get_context('spawn')
+        series = []
+        for _ in range(processes):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                timings, count = executor.submit(time_runs, benchmark, size, repeat, min_time).result()
+            series.append(timings)
+    else:
+        timings, count = time_runs(benchmark, size, repeat, min_time)
+        series = [timings]
+
+    timings = [timing for timings in series for timing in timings]
+    median = statistics.median(timings)
+    medians = [statistics.median(timings) for timings in series]
+    deviation = statistics.median(abs(timing - median) for timing in timings)
+    spread = max(deviation, (max(medians) - min(medians)) / 2) / median if median else 0
+    return {"size": size, "count": count, "processes": len(series), "runs": len(timings),
+            "best": min(timings), "median": median, "spread": spread,
+            "per_item_ns": median / count * 1e9 if count else 0, "items_per_s": count / median if median else 0}
+
+
+def run_suite(names=None, scale=1.0, repeat=REPEAT, min_time=MIN_TIME, processes=PROCESSES):
+    """
+    Run the benchmarks
+
+    Args:
+        names: The benchmarks to run [default=all]
+        scale: Multiplies the default size of every benchmark
+        repeat: The minimum number of timed runs of each benchmark in each process
+        min_time: The seconds of timed runs each benchmark is repeated for in each process
+        processes: The number of fresh interpreters each benchmark is timed in
+
+    Returns:
+        A dict of benchmark name to its timing, or to {"skipped": reason} when a dependency is missing
+    """
+    results = {}
+    for name in names or BENCHMARKS:
+        benchmark, size = BENCHMARKS[name]
+        try:
+            results[name] = time_benchmark(benchmark, max(int(size * scale), 1), repeat, min_time, processes)
+        except ImportError as e:
+            results[name] = {"skipped": str(e)}
+    return results
+
+
+def environment():
+    return {"created": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "node": platform.node()}
+
+
+def save_baseline(results, path=BASELINE):
+    """
+    Write the results as the JSON baseline, keeping the benchmarks of the old baseline that were not run
+    """
+    baseline = load_baseline(path) or {"results": {}}
+    baseline.update(environment())
+    baseline["results"].update({name: result for name, result in results.items() if "skipped" not in result})
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def load_baseline(path=BASELINE):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=THRESHOLD, noise_factor=NOISE_FACTOR):
+    """
+    Compare results with a baseline
+
+    Returns:
+        A list of dicts (name, baseline_ns, current_ns, change, noise, regression), change being the
+        relative difference of the time per item (positive is slower) and noise the change explained by
+        the spread of the runs. A result is compared only with a baseline of the same size, since the
+        time per item of a smaller run carries more fixed costs.
+    """
+    rows = []
+    old_results = baseline.get("results", {}) if baseline else {}
+    for name, result in results.items():
+        old = old_results.get(name)
+        if "skipped" in result or old is None or old["size"] != result["size"]:
+            rows.append({"name": name, "baseline_ns": old and old["per_item_ns"],
+                         "current_ns": result.get("per_item_ns"), "change": None, "noise": None,
+                         "regression": False})
+            continue
+        change = result["per_item_ns"] / old["per_item_ns"] - 1 if old["per_item_ns"] else 0
+        noise = noise_factor * max(old.get("spread", 0), result["spread"])
+        rows.append({"name": name, "baseline_ns": old["per_item_ns"], "current_ns": result["per_item_ns"],
+                     "change": change, "noise": noise, "regression": change > max(threshold, noise)})
+    return rows
+
+
+def report(results, rows):
+    """
+    Format the results and the comparison as a text table
+    """
+    lines = ['{:<20} {:>10} {:>6} {:>12} {:>14} {:>12} {:>8} {:>9}'.format(
+        'benchmark', 'items', 'runs', 'median (s)', 'items/s', 'ns/item', 'spread', 'change')]
+    for row in rows:
+        result = results[row["name"]]
+        if "skipped" in result:
+            lines.append('{:<20} skipped: {}'.format(row["name"], result["skipped"]))
+            continue
+        if row["change"] is not None:
+            change = '{:+.1%}'.format(row["change"])
+        elif row["baseline_ns"] is not None:
+            change = 'size'  # the baseline was recorded at another size
+        else:
+            change = ''
+        if row["regression"]:
+            change += ' !'
+        lines.append('{:<20} {:>10} {:>6} {:>12.4f} {:>14,.0f} {:>12.1f} {:>8.1%} {:>9}'.format(
+            row["name"], result["count"], result["runs"], result["median"], result["items_per_s"],
+            result["per_item_ns"], result["spread"], change))
+    return '\n'.join(lines)
@@ -0,0 +1,210 @@
+import json
+from collections import OrderedDict
+from datetime import timedelta
+
+from benchmarks import synthetic
+
+# The benchmarked hot paths
+#
+# Every benchmark takes the number of items to process and returns (run, count): run() is timed,
+# count is the number of items it processes. Building the inputs and the strategy objects happens
+# before run() and is not timed; a fresh setup is made for every repeat, so state carried by the
+# strategies does not leak from one repeat into the next.
+
+TURTLE_SYMBOLS = 4
+
+
+class OrderRecorder:
+    """
+    Minimal engine counting the orders sent by the strategies, so their cost stays out of the timing
+    """
+
+    def __init__(self):
+        self.order_count = 0
+
+    def send_order(self, *args):
+        # turtle: (vt_symbol, direction, offset, price, volume); vnpy cta: (strategy, direction, ...)
+        self.order_count += 1
+        return ['standin.{}'.format(self.order_count)]
+
+    def cancel_order(self, strategy, vt_orderid):
+        pass
+
+    def cancel_all(self, strategy):
+        pass
+
+    def put_strategy_event(self, strategy):
+        pass
+
+    def write_log(self, msg, strategy=None):
+        pass
+
+
+def turtle_portfolio(symbols):
+    from ta.turtle.strategy import TurtlePortfolio
+    portfolio = TurtlePortfolio(OrderRecorder())
+    portfolio.init(1000000, symbols, {symbol: 10 for symbol in symbols})
+    return portfolio
+
+
+def turtle_on_bar(size):
+    """
+    TurtlePortfolio.on_bar, which runs TurtleSignal.on_bar of both signals and their orders
+    """
+    symbols = ['S{}.LOCAL'.format(n) for n in range(TURTLE_SYMBOLS)]
+    bars = []
+    for n, symbol in enumerate(symbols):
+        bars.extend(synthetic.bars(symbol, size // TURTLE_SYMBOLS, price=100.0 * (n + 1), seed=n))
+    bars.sort(key=lambda bar: bar.datetime)
+    portfolio = turtle_portfolio(symbols)
+
+    def run():
+        on_bar = portfolio.on_bar
+        for bar in bars:
+            on_bar(bar)
+
+    return run, len(bars)
+
+
+def turtle_new_signal(size):
+    """
+    TurtlePortfolio.new_signal, alternating opens and closes through the exposure checks
+    """
+    from vnpy.trader.constant import Direction, Offset
+    symbols = ['S{}.LOCAL'.format(n) for n in range(TURTLE_SYMBOLS)]
+    portfolio = turtle_portfolio(symbols)
+    signals = [portfolio.signal_dict[symbol][1] for symbol in symbols]  # no profit check
+    for signal in signals:
+        signal.atr_volatility = 1.0
+    calls = []
+    for n in range(size // 2):
+        signal = signals[n % len(signals)]
+        calls.append((signal, Direction.LONG, Offset.OPEN, 100.0, 1))
+        calls.append((signal, Direction.SHORT, Offset.CLOSE, 99.0, 1))
+
+    def run():
+        new_signal = portfolio.new_signal
+        for call in calls:
+            new_signal(*call)
+
+    return run, len(calls)
+
+
+def turtle_backtest(size):
+    """
+    BackTestingEngine.run_backtesting on one contract, with the capital to trade it, so the orders,
+    fills and daily results are timed along with the bar replay
+    """
+    from ta.turtle.engine import BackTestingEngine
+    engine = BackTestingEngine()
+    engine.portfolio_value = 10_000_000
+    engine.add_contract('S0.LOCAL', 10, 0.01)
+    engine.data_dict['S0.LOCAL'] = synthetic.bar_file('S0.LOCAL', size)
+
+    def run():
+        engine.run_backtesting()
+
+    return run, size
+
+
+def bollinger_five_bar(size):
+    """
+    BollingerBotStrategy.onFiveBar on 5 minute bars
+    """
+    from demo.bollinger_bot_strategy import BollingerBotStrategy
+    bars = synthetic.bars('CN50_USD.LOCAL', size, interval=timedelta(minutes=5))
+    strategy = BollingerBotStrategy(OrderRecorder(), 'benchmark', 'CN50_USD.LOCAL', {})
+    strategy.inited = True
+    strategy.trading = True
+
+    def run():
+        on_five_bar = strategy.onFiveBar
+        for bar in bars:
+            on_five_bar(bar)
+
+    return run, len(bars)
+
+
+def tick_to_bar(size):
+    """
+    Ticks aggregated to 1 minute and then 5 minute bars, wired as in BollingerBotStrategy
+    """
+    from data.resample import BarAggregator
+    ticks = synthetic.ticks('CN50_USD.LOCAL', size)
+    five_bars = []
+    five = BarAggregator(timedelta(minutes=5), five_bars.append, input_interval=timedelta(minutes=1))
+    minute = BarAggregator(timedelta(minutes=1), five.update_bar)
+
+    def run():
+        update_tick = minute.update_tick
+        for tick in ticks:
+            update_tick(tick)
+
+    return run, len(ticks)
+
+
+def dollar_bars(size):
+    """
+    advsfinml dollar bars (OHLCV and VWAP) from one frame of trades
+    """
+    from advsfinml.bars import dollar_bars as build
+    trades = synthetic.trades(size)
+    threshold = trades['foreignNotional'].sum() / max(size // 500, 1)
+
+    def run():
+        build(trades, threshold)
+
+    return run, size
+
+
+def dollar_bars_stream(size, chunk_size=10000):
+    """
+    advsfinml ThresholdBarBuilder fed chunk by chunk
+    """
+    from advsfinml.bars import ThresholdBarBuilder
+    trades = synthetic.trades(size)
+    threshold = trades['foreignNotional'].sum() / max(size // 500, 1)
+    time = trades['timestamp'].values
+    price = trades['price'].values
+    volume = trades['foreignNotional'].values
+    builder = ThresholdBarBuilder(threshold, 'dollar')
+
+    def run():
+        for start in range(0, size, chunk_size):
+            stop = start + chunk_size
+            builder.update(time[start:stop], price[start:stop], volume[start:stop])
+        builder.flush()
+
+    return run, size
+
+
+def candle_decode(size, page=5000):
+    """
+    The decoding half of load_candle: the JSON body into v20 Candlesticks and those into a DataFrame
+    """
+    import v20
+    from v20.instrument import Candlestick
+    from data.oanda.history_data import decode_candles
+    body = synthetic.candle_response(min(size, page))
+    pages = max(size // page, 1)
+    ctx = v20.Context('localhost')
+
+    def run():
+        for _ in range(pages):
+            candles = [Candlestick.from_dict(candle, ctx) for candle in json.loads(body)['candles']]
+            decode_candles(candles)
+
+    return run, pages * min(size, page)
+
+
+# name -> (benchmark, default size)
+BENCHMARKS = OrderedDict([
+    ('turtle_on_bar', (turtle_on_bar, 200000)),
+    ('turtle_new_signal', (turtle_new_signal, 200000)),
+    ('turtle_backtest', (turtle_backtest, 200000)),
+    ('bollinger_five_bar', (bollinger_five_bar, 50000)),
+    ('tick_to_bar', (tick_to_bar, 200000)),
+    ('dollar_bars', (dollar_bars, 1000000)),
+    ('dollar_bars_stream', (dollar_bars_stream, 1000000)),
+    ('candle_decode', (candle_decode, 20000)),
+])
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from data.bar_file import BAR_DTYPE, BarFile
+
+# Synthetic inputs of the benchmarks
+#
+# Prices are geometric random walks from a seeded generator, so every run of a benchmark sees the
+# same data and timings of different commits can be compared.
+
+START = datetime(2019, 1, 2)
+
+
+def random_walk(size, start=100.0, volatility=0.001, seed=0):
+    """
+    A geometric random walk of size prices
+    """
+    rng = np.random.default_rng(seed)
+    return start * np.exp(np.cumsum(rng.normal(0, volatility, size)))
+
+
+def bar_records(size, start=START, interval=timedelta(minutes=1), price=100.0, seed=0):
+    """
+    size consecutive bars as a BAR_DTYPE array
+    """
+    rng = np.random.default_rng(seed + 1)
+    close = random_walk(size, price, seed=seed)
+    open_ = np.concatenate(([price], close[:-1]))
+    spread = np.abs(close - open_) + close * 0.0005
+    records = np.empty(size, dtype=BAR_DTYPE)
+    records['time'] = (np.datetime64(start, 'ns') + np.arange(size) * np.timedelta64(interval)).view('<i8')
+    records['open'] = open_
+    records['high'] = np.maximum(open_, close) + spread * rng.random(size)
+    records['low'] = np.minimum(open_, close) - spread * rng.random(size)
+    records['close'] = close
+    records['volume'] = rng.integers(1, 1000, size)
+    return records
+
+
+def bar_file(symbol, size, start=START, interval=timedelta(minutes=1), price=100.0, seed=0):
+    """
+    An in-memory BarFile of synthetic bars
+    """
+    return BarFile(None, bar_records(size, start, interval, price, seed), symbol)
+
+
+def bars(symbol, size, start=START, interval=timedelta(minutes=1), price=100.0, seed=0):
+    """
+    A list of BarRecord
+    """
+    return list(bar_file(symbol, size, start, interval, price, seed).iter_bars(symbol))
+
+
+class Tick:
+    """
+    The TickData fields read by BarAggregator.update_tick
+    """
+    __slots__ = ('vt_symbol', 'datetime', 'last_price', 'volume')
+
+    def __init__(self, vt_symbol, datetime, last_price, volume):
+        self.vt_symbol = vt_symbol
+        self.datetime = datetime
+        self.last_price = last_price
+        self.volume = volume
+
+
+def ticks(vt_symbol, size, start=START, interval=timedelta(milliseconds=500), price=100.0, seed=0):
+    """
+    size ticks with a cumulative volume, as vnpy pushes them
+    """
+    rng = np.random.default_rng(seed + 2)
+    prices = random_walk(size, price, 0.0002, seed).tolist()
+    volumes = np.cumsum(rng.integers(0, 10, size)).tolist()
+    return [Tick(vt_symbol, start + i * interval, p, v) for i, (p, v) in enumerate(zip(prices, volumes))]
+
+
+def trades(size, start=START, price=4000.0, seed=0):
+    """
+    A DataFrame of size trades with the columns of the BitMEX trade files read by advsfinml
+    """
+    rng = np.random.default_rng(seed + 3)
+    gaps = rng.exponential(0.2, size)
+    time = np.datetime64(start, 'ns') + (np.cumsum(gaps) * 1e9).astype('timedelta64[ns]')
+    prices = np.round(random_walk(size, price, 0.0001, seed) * 2) / 2
+    size_ = rng.integers(1, 5000, size)
+    return pd.DataFrame({'timestamp': time, 'symbol': 'XBTUSD', 'price': prices, 'size': size_,
+                         'foreignNotional': size_.astype(np.float64)})
+
+
+def candle_response(size, instrument='EUR_USD', granularity='M1', start=START):
+    """
+    The JSON body of a v20 candles response holding size candles
+    """
+    from data.oanda.standin import StandinServer
+    first = pd.Timestamp(start)
+    server = StandinServer(first=first, last=first + pd.Timedelta(days=size // 1000 + 7), instruments=[instrument])
+    query = {'granularity': granularity, 'count': str(size), 'from': first.isoformat()}
+    return server.candles(instrument, query, 'RFC3339')
@@ -0,0 +1,229 @@
+import hashlib
+import os
+
+import numpy as np
+
+# Fixed-record binary bar file
+#
+#   header (64 bytes): magic b'ALGOBAR1' + symbol (utf-8, zero padded to 56 bytes)
+#   records (48 bytes each, little endian): time (int64 ns since epoch, UTC), open, high, low,
+#                                           close (float64), volume (int64)
+#
+# The records are never parsed: BarFile maps them with numpy.memmap and every column is a view into
+# the page cache, so backtests running in parallel share one copy of the history and the resident
+# memory does not grow with the number of years loaded.
+
+MAGIC = b'ALGOBAR1'
+HEADER_SIZE = 64
+BAR_DTYPE = np.dtype([('time', '<i8'),
+                      ('open', '<f8'),
+                      ('high', '<f8'),
+                      ('low', '<f8'),
+                      ('close', '<f8'),
+                      ('volume', '<i8')])
+CHUNK_SIZE = 65536  # records converted at once when iterating bar objects
+EXTENSION = '.bar'
+
+
+def bar_file_path(data_path, symbol):
+    """
+    The location of a symbol's bar file in a data folder
+    """
+    return os.path.join(data_path, symbol + EXTENSION)
+
+
+class BarRecord:
+    """
+    A single bar handed to the strategies. The vnpy style *_price aliases let it go through
+    ArrayManager.update_bar as well.
+    """
+    __slots__ = ('vt_symbol', 'datetime', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, vt_symbol, datetime, open, high, low, close, volume):
+        self.vt_symbol = vt_symbol
+        self.datetime = datetime
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    @property
+    def open_price(self):
+        return self.open
+
+    @property
+    def high_price(self):
+        return self.high
+
+    @property
+    def low_price(self):
+        return self.low
+
+    @property
+    def close_price(self):
+        return self.close
+
+    @property
+    def turnover(self):
+        return 0
+
+    @property
+    def open_interest(self):
+        return 0
+
+    def __repr__(self):
+        return 'BarRecord({}, {}, o={}, h={}, l={}, c={}, v={})'.format(
+            self.vt_symbol, self.datetime, self.open, self.high, self.low, self.close, self.volume)
+
+
+def _header(symbol):
+    name = symbol.encode('utf-8')[:HEADER_SIZE - len(MAGIC)]
+    return MAGIC + name.ljust(HEADER_SIZE - len(MAGIC), b'\0')
+
+
+def _records(time, open, high, low, close, volume):
+    records = np.empty(len(time), dtype=BAR_DTYPE)
+    records['time'] = np.asarray(time, dtype='datetime64[ns]').view('<i8')
+    records['open'] = open
+    records['high'] = high
+    records['low'] = low
+    records['close'] = close
+    records['volume'] = volume
+    return records
+
+
+def write_bar_file(path, symbol, df):
+    """
+    Write a bar file from a DataFrame with the Time/Open/High/Low/Close/Volume columns
+    of the candle store, replacing any existing file
+    """
+    records = _records(df['Time'].values, df['Open'].values, df['High'].values,
+                       df['Low'].values, df['Close'].values, df['Volume'].values)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_header(symbol))
+        f.write(records.tobytes())
+    os.replace(tmp_path, path)
+
+
+def append_bar_file(path, symbol, df):
+    """
+    Append bars newer than the last record of a bar file, creating it when missing
+
+    Returns:
+        The number of bars appended
+    """
+    if not os.path.exists(path):
+        write_bar_file(path, symbol, df)
+        return len(df)
+    bar_file = BarFile(path)
+    times = df['Time'].values.astype('datetime64[ns]')
+    if len(bar_file):
+        df = df[times > bar_file.time[-1]]
+    records = _records(df['Time'].values, df['Open'].values, df['High'].values,
+                       df['Low'].values, df['Close'].values, df['Volume'].values)
+    with open(path, 'ab') as f:
+        f.write(records.tobytes())
+    return len(records)
+
+
+def export_store(store, instrument, path, start=None, end=None):
+    """
+    Write the candles of a CandleStore instrument into a bar file
+    """
+    df = store.read(instrument, start, end)
+    write_bar_file(path, instrument, df)
+    return len(df)
+
+
+class BarFile:
+    """
+    Read-only memory-mapped view of a bar file. time/open/high/low/close/volume are numpy views
+    into the mapping, no data is copied when they are sliced or iterated.
+    """
+
+    def __init__(self, path, records=None, symbol=None):
+        """
+        Args:
+            path: The location of the bar file
+        """
+        self.path = path
+        if records is None:
+            with open(path, 'rb') as f:
+                header = f.read(HEADER_SIZE)
+            if header[:len(MAGIC)] != MAGIC:
+                raise ValueError("'{}' is not a bar file".format(path))
+            symbol = header[len(MAGIC):].rstrip(b'\0').decode('utf-8')
+            count = (os.path.getsize(path) - HEADER_SIZE) // BAR_DTYPE.itemsize
+            if count:
+                records = np.memmap(path, dtype=BAR_DTYPE, mode='r', offset=HEADER_SIZE,
+                                    shape=(count,))
+            else:
+                records = np.empty(0, dtype=BAR_DTYPE)
+        self.symbol = symbol
+        self.records = records
+        self._fingerprint = None
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def time(self):
+        return self.records['time'].view('datetime64[ns]')
+
+    @property
+    def open(self):
+        return self.records['open']
+
+    @property
+    def high(self):
+        return self.records['high']
+
+    @property
+    def low(self):
+        return self.records['low']
+
+    @property
+    def close(self):
+        return self.records['close']
+
+    @property
+    def volume(self):
+        return self.records['volume']
+
+    def fingerprint(self):
+        """
+        A digest of the records, identifying the data that derived series (indicators) were computed on
+        """
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(np.ascontiguousarray(self.records).view(np.uint8))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def slice(self, start=None, end=None):
+        """
+        A BarFile view of the bars in [start, end), found by binary search on time
+        """
+        time = self.time
+        i = 0 if start is None else np.searchsorted(time, np.datetime64(start, 'ns'), 'left')
+        j = len(time) if end is None else np.searchsorted(time, np.datetime64(end, 'ns'), 'left')
+        return BarFile(self.path, self.records[i:j], self.symbol)
+
+    def iter_bars(self, vt_symbol=None):
+        """
+        Yield a BarRecord per bar. Records are converted a chunk at a time, so the memory used
+        stays constant whatever the length of the file.
+        """
+        vt_symbol = vt_symbol or self.symbol
+        for start in range(0, len(self.records), CHUNK_SIZE):
+            chunk = self.records[start:start + CHUNK_SIZE]
+            times = chunk['time'].view('datetime64[ns]').astype('datetime64[us]').tolist()
+            columns = zip(times, chunk['open'].tolist(), chunk['high'].tolist(),
+                          chunk['low'].tolist(), chunk['close'].tolist(), chunk['volume'].tolist())
+            for dt, o, h, l, c, v in columns:
+                yield BarRecord(vt_symbol, dt, o, h, l, c, v)
+
+    def __iter__(self):
+        return self.iter_bars()
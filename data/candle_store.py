@@ -0,0 +1,219 @@
+import json
+import os
+
+import pandas as pd
+
+# Columnar candle store
+#
+# One folder per instrument and granularity holding one compressed parquet file per month:
+#
+#   root/CN50_USD/M1/2019-01.parquet
+#   root/CN50_USD/M1/2019-02.parquet
+#   root/CN50_USD/M1/_meta.json
+#
+# _meta.json records the time range and row count of every partition. It is rewritten last, so a
+# crash in the middle of a write leaves the previous state readable; partitions are merged on
+# Time, which makes a repeated write harmless.
+
+META_FILE = '_meta.json'
+PARTITION_FORMAT = '%Y-%m'
+COLUMNS = ["Time", "Open", "High", "Low", "Close", "Volume"]
+
+
+def to_utc(value):
+    """
+    Convert a timestamp (RFC3339 string, Timestamp, datetime64) into a naive UTC Timestamp
+    """
+    ts = pd.Timestamp(value)
+    if ts.tz is not None:
+        ts = ts.tz_convert('UTC').tz_localize(None)
+    return ts
+
+
+def _atomic_write(path, write):
+    """
+    Call write(tmp_path) and move the result over path in one step
+    """
+    tmp_path = path + '.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class CandleStore:
+    """
+    Date-partitioned parquet storage of candle history, one folder per instrument and granularity
+    """
+
+    def __init__(self, root, granularity='M1', compression='zstd'):
+        """
+        Args:
+            root: The folder holding the store
+            granularity: The granularity of the stored candles
+            compression: The parquet compression codec
+        """
+        self.root = root
+        self.granularity = granularity
+        self.compression = compression
+        self._meta = {}
+
+    def path(self, instrument):
+        return os.path.join(self.root, instrument, self.granularity)
+
+    def instruments(self):
+        """
+        The instruments that have candles in the store
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, self.granularity, META_FILE)))
+
+    def meta(self, instrument):
+        """
+        The metadata of an instrument: {"rows": n, "first": str, "last": str, "partitions": {...}}
+        """
+        meta = self._meta.get(instrument)
+        if meta is None:
+            file_name = os.path.join(self.path(instrument), META_FILE)
+            if os.path.exists(file_name):
+                with open(file_name) as f:
+                    meta = json.load(f)
+            else:
+                meta = {"rows": 0, "first": None, "last": None, "partitions": {}}
+            self._meta[instrument] = meta
+        return meta
+
+    def last_time(self, instrument):
+        """
+        The time of the last stored candle, read from the metadata, or None for an empty instrument
+        """
+        last = self.meta(instrument)["last"]
+        return None if last is None else pd.Timestamp(last)
+
+    def first_time(self, instrument):
+        first = self.meta(instrument)["first"]
+        return None if first is None else pd.Timestamp(first)
+
+    def append(self, instrument, df):
+        """
+        Append candles newer than the last stored one
+
+        Returns:
+            The number of candles added
+        """
+        last = self.last_time(instrument)
+        if last is not None:
+            times = pd.to_datetime(df['Time'], utc=True).dt.tz_localize(None)
+            df = df[(times > last).values]
+        return self.merge(instrument, df)
+
+    def merge(self, instrument, df):
+        """
+        Insert or replace candles keyed by Time. Only the partitions touched by df are rewritten.
+
+        Returns:
+            The number of candles added
+        """
+        if len(df) == 0:
+            return 0
+        df = df.copy()
+        df['Time'] = pd.to_datetime(df['Time'], utc=True).dt.tz_localize(None).astype('datetime64[ns]')
+        folder = self.path(instrument)
+        os.makedirs(folder, exist_ok=True)
+        meta = self.meta(instrument)
+        partitions = meta["partitions"]
+
+        added = 0
+        for key, part in df.groupby(df['Time'].dt.strftime(PARTITION_FORMAT), sort=True):
+            file_name = os.path.join(folder, key + '.parquet')
+            old_rows = 0
+            if key in partitions:
+                old = pd.read_parquet(file_name)
+                old_rows = len(old)
+                part = pd.concat([old, part], ignore_index=True)
+            part = part.drop_duplicates(subset='Time', keep='last').sort_values('Time')
+            part = part.reset_index(drop=True)
+            _atomic_write(file_name, lambda p: part.to_parquet(p, index=False,
+                                                               compression=self.compression))
+            partitions[key] = {"rows": len(part),
+                               "first": part['Time'].iloc[0].isoformat(),
+                               "last": part['Time'].iloc[-1].isoformat()}
+            added += len(part) - old_rows
+
+        keys = sorted(partitions)
+        meta["partitions"] = {key: partitions[key] for key in keys}
+        meta["rows"] = sum(p["rows"] for p in partitions.values())
+        meta["first"] = partitions[keys[0]]["first"]
+        meta["last"] = partitions[keys[-1]]["last"]
+        _atomic_write(os.path.join(folder, META_FILE), lambda p: self._dump_meta(p, meta))
+        return added
+
+    @staticmethod
+    def _dump_meta(path, meta):
+        with open(path, 'w') as f:
+            json.dump(meta, f, indent=1)
+
+    def read(self, instrument, start=None, end=None, columns=None):
+        """
+        Read the candles of [start, end), opening only the partitions overlapping the range
+
+        Args:
+            instrument: Name of the Instrument
+            start: The first time to return [default=all]
+            end: The time to stop before [default=all]
+            columns: The columns besides Time to read [default=all]
+
+        Returns:
+            A DataFrame ordered by Time
+        """
+        start = None if start is None else to_utc(start)
+        end = None if end is None else to_utc(end)
+        if columns is not None:
+            columns = ['Time'] + [c for c in columns if c != 'Time']
+        filters = []
+        if start is not None:
+            filters.append(('Time', '>=', start))
+        if end is not None:
+            filters.append(('Time', '<', end))
+
+        frames = []
+        for key, part in self.meta(instrument)["partitions"].items():
+            if start is not None and pd.Timestamp(part["last"]) < start:
+                continue
+            if end is not None and pd.Timestamp(part["first"]) >= end:
+                continue
+            file_name = os.path.join(self.path(instrument), key + '.parquet')
+            frames.append(pd.read_parquet(file_name, columns=columns, filters=filters or None))
+        if not frames:
+            return pd.DataFrame(columns=columns or COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+
+def import_csv(store, instrument, file_name, chunksize=1000000):
+    """
+    Load one of the csv files written by update_candle_data into the store
+
+    Returns:
+        The number of candles added
+    """
+    added = 0
+    for chunk in pd.read_csv(file_name, chunksize=chunksize):
+        added += store.merge(instrument, chunk)
+    return added
+
+
+def import_csv_folder(store, data_path):
+    """
+    One-shot import of every INSTRUMENT.csv file of a folder into the store
+
+    Returns:
+        A dict of instrument name to the number of candles added
+    """
+    result = {}
+    for file_name in sorted(os.listdir(data_path)):
+        instrument, ext = os.path.splitext(file_name)
+        if ext != '.csv':
+            continue
+        result[instrument] = import_csv(store, instrument, os.path.join(data_path, file_name))
+        print('{} --> {} candles imported'.format(instrument, result[instrument]))
+    return result
@@ -0,0 +1,238 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import data.oanda.config as oanda_cfg
+from data.oanda.coverage import CoverageIndex, complete_until
+from data.oanda.history_data import load_candle, format_time, COUNT, GRANULARITY, GRANULARITY_SECONDS, INIT_TIME
+
+# default length of the independent time windows each instrument's history is split into.
+# 90 days of M1 candles is roughly 25 pages of 5000 candles.
+WINDOW = pd.Timedelta(days=90)
+MAX_WORKERS = 16  # concurrent page requests shared by all instruments
+MAX_INSTRUMENTS = 4  # instruments stitched and written at the same time
+RATE = 20  # requests per second allowed against one host
+
+
+class RateLimiter:
+    """
+    Token bucket limiting how many requests per second are sent to one host.
+    It is shared by all the worker threads fetching from that host.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate: The number of requests allowed per second
+            burst: The number of requests that may be sent back to back
+                [default=rate]
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a request may be sent
+        """
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """
+        Take a token if one is available
+
+        Returns:
+            0 when the request may be sent, otherwise the seconds until the next token
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(host, rate=RATE):
+    """
+    Return the process-wide RateLimiter of a host, creating it on first use
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = RateLimiter(rate)
+            _limiters[host] = limiter
+        return limiter
+
+
+def split_windows(start, end, window=WINDOW):
+    """
+    Split [start, end) into consecutive (start, end) pairs of at most window length
+    """
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    windows = []
+    while start < end:
+        stop = min(start + window, end)
+        windows.append((start, stop))
+        start = stop
+    return windows
+
+
+def fetch_window(instrument, start, end, limiter, granularity=GRANULARITY):
+    """
+    Fetch all the complete candles of [start, end) page by page
+
+    Args:
+        instrument: Name of the Instrument
+        start: The first timestamp of the window
+        end: The timestamp the window stops before
+        limiter: The RateLimiter of the host
+        granularity: The granularity of the candlesticks
+
+    Returns:
+        A DataFrame of the window's candles, ordered by time without duplicates
+    """
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    page_span = pd.Timedelta(seconds=GRANULARITY_SECONDS[granularity] * COUNT)
+    kwargs = dict()
+    kwargs["granularity"] = granularity
+    kwargs["count"] = COUNT
+    pages = []
+    from_time = start
+    while True:
+        kwargs["fromTime"] = format_time(from_time)
+        if end - from_time <= page_span:
+            # the rest of the window fits in one page: ask for exactly that range
+            kwargs.pop("count", None)
+            kwargs["toTime"] = format_time(end)
+        limiter.acquire()
+        df = load_candle(instrument, complete_only=True, **kwargs)
+        if len(df) == 0:
+            break
+        pages.append(df)
+        last_time = df['Time'].iloc[-1].tz_localize(start.tz)
+        if len(df) < COUNT or last_time >= end or last_time <= from_time:
+            break
+        from_time = last_time
+
+    if not pages:
+        return empty_candle_frame()
+    df = pd.concat(pages, ignore_index=True)
+    df = df.drop_duplicates(subset='Time', keep='first')
+    times = df['Time'].dt.tz_localize(start.tz)
+    return df[(times >= start) & (times < end)].reset_index(drop=True)
+
+
+def empty_candle_frame():
+    """
+    An empty DataFrame with the columns returned by load_candle
+    """
+    return pd.DataFrame({"Time": pd.Series(dtype='datetime64[ns]'),
+                         "Open": pd.Series(dtype='float64'),
+                         "High": pd.Series(dtype='float64'),
+                         "Low": pd.Series(dtype='float64'),
+                         "Close": pd.Series(dtype='float64'),
+                         "Volume": pd.Series(dtype='int64')})
+
+
+def first_candle_time(instrument, limiter, granularity=GRANULARITY, start=INIT_TIME):
+    """
+    The time of the first candle the server has for an instrument, found with one count=1 request
+
+    Returns:
+        A UTC Timestamp, or None when the server has no candles after start
+    """
+    limiter.acquire()
+    df = load_candle(instrument, complete_only=True, granularity=granularity, count=1,
+                     fromTime=format_time(start))
+    if len(df) == 0:
+        return None
+    return df['Time'].iloc[0].tz_localize('UTC')
+
+
+def resume_time(store, instrument):
+    """
+    The timestamp right after the last candle of the store, or INIT_TIME for a new instrument
+    """
+    last = store.last_time(instrument)
+    if last is None:
+        return pd.Timestamp(INIT_TIME)
+    return last.tz_localize('UTC') + pd.Timedelta(microseconds=1)
+
+
+def backfill_instrument(instrument, store, executor, limiter, end=None, window=WINDOW, index=None):
+    """
+    Bring one instrument of the candle store up to date. The missing history is split into windows
+    which are fetched in parallel on the executor; finished windows are appended in time order and
+    recorded in the coverage index when one is given, up to the candle in progress. A new instrument starts at its first candle
+    rather than INIT_TIME, so no page is requested for the years before it was listed.
+
+    Returns:
+        The number of candles appended
+    """
+    start = resume_time(store, instrument)
+    until = complete_until(store.granularity)
+    if end is None:
+        end = pd.Timestamp.now(tz='UTC')
+    if store.last_time(instrument) is None:
+        first = first_candle_time(instrument, limiter, store.granularity, start)
+        if first is None or first >= end:
+            print('{} --> no candles on the server'.format(instrument))
+            return 0
+        if index is not None:
+            index.mark(instrument, start, first)
+        start = first
+    windows = split_windows(start, end, window)
+    futures = [executor.submit(fetch_window, instrument, s, e, limiter, store.granularity)
+               for s, e in windows]
+
+    appended = 0
+    for (s, e), future in zip(windows, futures):
+        appended += store.append(instrument, future.result())
+        if index is not None:
+            index.mark(instrument, s, min(e, until))
+    print('{} --> {} candles appended'.format(instrument, appended))
+    return appended
+
+
+def backfill(instruments, store, max_workers=MAX_WORKERS, max_instruments=MAX_INSTRUMENTS,
+             rate=RATE, window=WINDOW):
+    """
+    Update many instruments of a candle store concurrently
+
+    Args:
+        instruments: The names of the instruments
+        store: The CandleStore receiving the candles
+        max_workers: The number of page requests in flight at the same time
+        max_instruments: The number of instruments being stitched at the same time
+        rate: The requests per second allowed against the API host
+        window: The length of the time windows fetched independently
+
+    Returns:
+        A dict of instrument name to the number of candles appended
+    """
+    config = oanda_cfg.get_config()
+    limiter = get_rate_limiter(config.hostname, rate)
+    index = CoverageIndex(store)
+    end = pd.Timestamp.now(tz='UTC')
+    with ThreadPoolExecutor(max_workers=max_workers) as fetcher, \
+            ThreadPoolExecutor(max_workers=max_instruments) as stitcher:
+        futures = {instrument: stitcher.submit(backfill_instrument, instrument, store, fetcher,
+                                               limiter, end, window, index)
+                   for instrument in instruments}
+        return {instrument: future.result() for instrument, future in futures.items()}
@@ -1,5 +1,6 @@
 import yaml
 import os
+import threading
 import v20
 import importlib.resources as pkg_resources
 
@@ -191,3 +192,74 @@ def make_config_instance(path=''):
         config.load_default_config()
     config.validate()
     return config
+
+
+# process-wide pool: the config is parsed once and every thread keeps its own keep-alive
+# v20.Context (a requests session), so pages reuse the open TLS connection.
+_config = None
+_config_lock = threading.Lock()
+_generation = 0
+_local = threading.local()
+
+
+def get_config(path=''):
+    """
+    Return the process-wide Config instance, loading and validating it on
+    first use.
+
+    Args:
+        path: The location of the configuration file, only used by the
+            first call
+    """
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = make_config_instance(path)
+    return _config
+
+
+def set_config(config):
+    """
+    Replace the process-wide Config instance. Contexts created from the
+    previous one are dropped by every thread on their next use.
+
+    Args:
+        config: A validated Config instance
+    """
+    global _config, _generation
+    with _config_lock:
+        _config = config
+        _generation += 1
+
+
+def get_context(streaming=False):
+    """
+    Return the calling thread's pooled API context, creating it from the
+    process-wide Config when needed
+
+    Args:
+        streaming: Return the streaming context instead of the REST one
+    """
+    name = "streaming_ctx" if streaming else "ctx"
+    if getattr(_local, "generation", None) != _generation:
+        _local.__dict__.clear()
+        _local.generation = _generation
+    ctx = getattr(_local, name, None)
+    if ctx is None:
+        config = get_config()
+        if streaming:
+            ctx = config.create_streaming_context()
+        else:
+            ctx = config.create_context()
+        setattr(_local, name, ctx)
+    return ctx
+
+
+def reset_context(streaming=False):
+    """
+    Drop the calling thread's pooled context, e.g. after a connection error,
+    so the next get_context() opens a fresh connection
+    """
+    name = "streaming_ctx" if streaming else "ctx"
+    _local.__dict__.pop(name, None)
@@ -0,0 +1,332 @@
+import bisect
+import json
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from data.candle_store import to_utc, _atomic_write
+from data.oanda.history_data import GRANULARITY_SECONDS, INIT_TIME
+
+# Coverage index of the candle store
+#
+# For every instrument and granularity the store folder holds _coverage.json, the sorted time ranges
+# that have been fetched from the server:
+#
+#   root/CN50_USD/M1/_coverage.json   {"intervals": [["2005-01-02T21:00:00", "2019-06-30T00:00:00"], ...]}
+#
+# A range is covered once a fetch of it succeeded, whether or not the server had candles in it, so
+# quiet hours and holidays are not fetched again. A store without the file is indexed from its
+# candles: consecutive candles less than TOLERANCE_STEPS candles of trading time apart are one range.
+#
+# Gaps are the trading hours of a period that are not covered. repair() fetches only those, split
+# into windows fetched in parallel, merges them into the store keyed by Time (a repeated merge
+# changes nothing) and marks each window covered as soon as it is stored.
+#
+# The candle in progress is never stored, and a fetch is marked covered only up to one candle length
+# before the time it was made (complete_until): later candles may still change or not exist yet, so
+# they stay a gap until a fetch finds them complete.
+
+COVERAGE_FILE = '_coverage.json'
+DAY_NS = 86400 * 10 ** 9
+WEEK_NS = 7 * DAY_NS
+MONDAY_OFFSET = 3 * DAY_NS  # 1970-01-01 was a Thursday, 3 days after the start of its week
+WEEK_CLOSE = (4 * 24 + 21) * 3600  # Friday 21:00 UTC, seconds into the week (Monday 00:00)
+WEEK_OPEN = (6 * 24 + 21) * 3600  # Sunday 21:00 UTC
+TOLERANCE_STEPS = 30  # trading time between two candles, in candles, still considered continuous
+MAX_WORKERS = 16
+WINDOW = pd.Timedelta(days=30)
+
+
+class TradingCalendar:
+    """
+    Weekly trading hours, given as the closed periods of the week
+    """
+
+    def __init__(self, closed=((WEEK_CLOSE, WEEK_OPEN),)):
+        """
+        Args:
+            closed: (start, end) pairs of seconds since Monday 00:00 UTC when the market is closed
+        """
+        self.closed = sorted((start * 10 ** 9, end * 10 ** 9) for start, end in closed)
+        self.open_per_week = WEEK_NS - sum(end - start for start, end in self.closed)
+
+    def open_mask(self, times):
+        """
+        Mask of the nanosecond timestamps falling inside the trading hours
+        """
+        offset = (np.asarray(times, dtype=np.int64) + MONDAY_OFFSET) % WEEK_NS
+        mask = np.ones(offset.shape, dtype=bool)
+        for start, end in self.closed:
+            mask &= (offset < start) | (offset >= end)
+        return mask
+
+    def open_time(self, times):
+        """
+        The trading time (ns) elapsed between the epoch and the nanosecond timestamps
+        """
+        shifted = np.asarray(times, dtype=np.int64) + MONDAY_OFFSET
+        offset = shifted % WEEK_NS
+        elapsed = shifted // WEEK_NS * self.open_per_week + offset
+        for start, end in self.closed:
+            elapsed -= np.clip(offset, start, end) - start
+        return elapsed
+
+    def open_duration(self, start, end):
+        """
+        The trading time (ns) inside [start, end)
+        """
+        return self.open_time(end) - self.open_time(start)
+
+
+DEFAULT_CALENDAR = TradingCalendar()
+
+
+def complete_until(granularity, now=None):
+    """
+    The time before which every candle of the granularity had closed at now [default=now]
+    """
+    now = pd.Timestamp.now(tz='UTC') if now is None else pd.Timestamp(now)
+    return now - pd.Timedelta(seconds=GRANULARITY_SECONDS[granularity])
+
+
+def to_ns(value):
+    return to_utc(value).value
+
+
+def from_ns(value):
+    return pd.Timestamp(int(value))
+
+
+class Coverage:
+    """
+    A set of time ranges, kept as sorted disjoint [start, end) nanosecond pairs
+    """
+
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.ends = []
+        for start, end in intervals:
+            self.add(start, end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+    def add(self, start, end):
+        """
+        Cover [start, end), merging it with the ranges it overlaps or touches
+        """
+        if end <= start:
+            return
+        i = bisect.bisect_left(self.ends, start)
+        j = bisect.bisect_right(self.starts, end)
+        if i < j:
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j - 1])
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+
+    def covers(self, start, end):
+        i = bisect.bisect_right(self.starts, start) - 1
+        return i >= 0 and self.ends[i] >= end
+
+    def missing(self, start, end):
+        """
+        The parts of [start, end) not covered, as (start, end) pairs
+        """
+        pieces = []
+        i = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        position = start
+        while position < end:
+            if i < len(self.starts) and self.starts[i] <= position:
+                position = max(position, self.ends[i])
+                i += 1
+                continue
+            stop = min(self.starts[i], end) if i < len(self.starts) else end
+            pieces.append((position, stop))
+            position = stop
+        return pieces
+
+    def to_list(self):
+        return [[from_ns(start).isoformat(), from_ns(end).isoformat()] for start, end in self]
+
+    @classmethod
+    def from_list(cls, items):
+        return cls((to_ns(start), to_ns(end)) for start, end in items)
+
+
+def candle_coverage(times, step, calendar=DEFAULT_CALENDAR, tolerance=TOLERANCE_STEPS):
+    """
+    The ranges spanned by candles, splitting wherever more than tolerance candles of trading time
+    separate two consecutive candles
+
+    Args:
+        times: The candle times, ordered
+        step: The candle length in seconds
+    """
+    times = np.asarray(times, dtype='datetime64[ns]').view(np.int64)
+    if not len(times):
+        return Coverage()
+    step_ns = step * 10 ** 9
+    elapsed = calendar.open_time(times)
+    breaks = np.flatnonzero(np.diff(elapsed) > tolerance * step_ns)
+    starts = np.concatenate(([times[0]], times[breaks + 1]))
+    ends = np.concatenate((times[breaks], [times[-1]])) + step_ns
+    coverage = Coverage()
+    coverage.starts = starts.tolist()
+    coverage.ends = ends.tolist()
+    return coverage
+
+
+class CoverageIndex:
+    """
+    The covered time ranges of every instrument of a CandleStore, saved next to its partitions
+    """
+
+    def __init__(self, store, calendar=DEFAULT_CALENDAR, tolerance=TOLERANCE_STEPS):
+        """
+        Args:
+            store: The CandleStore
+            calendar: The trading hours gaps are measured against
+            tolerance: Candles of trading time between two stored candles still considered continuous
+                when indexing a store without a coverage file
+        """
+        self.store = store
+        self.calendar = calendar
+        self.tolerance = tolerance
+        self.step = GRANULARITY_SECONDS[store.granularity]
+        self._coverage = {}
+        self.lock = threading.Lock()
+
+    def path(self, instrument):
+        return os.path.join(self.store.path(instrument), COVERAGE_FILE)
+
+    def coverage(self, instrument):
+        """
+        The Coverage of an instrument, loaded from its file or indexed from its candles
+        """
+        with self.lock:
+            coverage = self._coverage.get(instrument)
+            if coverage is None:
+                file_name = self.path(instrument)
+                if os.path.exists(file_name):
+                    with open(file_name) as f:
+                        coverage = Coverage.from_list(json.load(f)["intervals"])
+                else:
+                    times = self.store.read(instrument, columns=[])['Time'].values
+                    coverage = candle_coverage(times, self.step, self.calendar, self.tolerance)
+                self._coverage[instrument] = coverage
+            return coverage
+
+    def mark(self, instrument, start, end, save=True):
+        """
+        Record that [start, end) has been fetched
+        """
+        coverage = self.coverage(instrument)
+        coverage.add(to_ns(start), to_ns(end))
+        if save:
+            self.save(instrument)
+
+    def save(self, instrument):
+        folder = self.store.path(instrument)
+        os.makedirs(folder, exist_ok=True)
+        items = self.coverage(instrument).to_list()
+        _atomic_write(self.path(instrument), lambda p: _dump(p, {"intervals": items}))
+
+    def gaps(self, instrument, start=None, end=None, min_gap=None):
+        """
+        The trading hours of [start, end) that are not covered
+
+        Args:
+            instrument: Name of the Instrument
+            start: The beginning of the period [default=the first covered time, or INIT_TIME]
+            end: The end of the period [default=now]
+            min_gap: The trading time (Timedelta) a gap must last to be reported [default=one candle]
+
+        Returns:
+            A list of (start, end) naive UTC Timestamps
+        """
+        coverage = self.coverage(instrument)
+        if start is None:
+            start = coverage.starts[0] if len(coverage) else to_ns(INIT_TIME)
+        else:
+            start = to_ns(start)
+        end = to_ns(pd.Timestamp.now(tz='UTC') if end is None else end)
+        min_gap = self.step * 10 ** 9 if min_gap is None else pd.Timedelta(min_gap).value
+
+        pieces = coverage.missing(start, end)
+        if not pieces:
+            return []
+        starts = np.array([piece[0] for piece in pieces], dtype=np.int64)
+        ends = np.array([piece[1] for piece in pieces], dtype=np.int64)
+        keep = self.calendar.open_duration(starts, ends) >= min_gap
+        return [(from_ns(s), from_ns(e)) for s, e in zip(starts[keep].tolist(), ends[keep].tolist())]
+
+    def report(self, instruments=None, start=None, end=None, min_gap=None):
+        """
+        A DataFrame of the gaps of many instruments with their trading time
+        """
+        rows = []
+        for instrument in instruments or self.store.instruments():
+            for gap_start, gap_end in self.gaps(instrument, start, end, min_gap):
+                trading = self.calendar.open_duration(np.array([gap_start.value]), np.array([gap_end.value]))[0]
+                rows.append({"instrument": instrument, "start": gap_start, "end": gap_end,
+                             "trading_time": pd.Timedelta(int(trading))})
+        return pd.DataFrame(rows, columns=["instrument", "start", "end", "trading_time"])
+
+
+def _dump(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=1)
+
+
+def repair(store, instruments=None, start=None, end=None, max_workers=MAX_WORKERS, rate=None,
+           window=WINDOW, min_gap=None, index=None):
+    """
+    Fetch the gaps of many instruments in parallel and merge them into the store
+
+    Args:
+        store: The CandleStore
+        instruments: The instruments to repair [default=all the instruments of the store]
+        start, end, min_gap: The period and the smallest gap, see CoverageIndex.gaps
+        max_workers: The number of page requests in flight at the same time
+        rate: The requests per second allowed against the API host [default=backfill.RATE]
+        window: Gaps longer than this are split into windows fetched independently
+        index: The CoverageIndex of the store [default=a new one]
+
+    Returns:
+        A dict of instrument name to the number of candles added
+    """
+    import data.oanda.config as oanda_cfg
+    from data.oanda.backfill import fetch_window, get_rate_limiter, split_windows, RATE
+
+    index = index or CoverageIndex(store)
+    limiter = get_rate_limiter(oanda_cfg.get_config().hostname, rate or RATE)
+    until = complete_until(store.granularity)
+    end = pd.Timestamp.now(tz='UTC') if end is None else end
+    added = defaultdict(int)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for instrument in instruments or store.instruments():
+            added[instrument] += 0
+            for gap_start, gap_end in index.gaps(instrument, start, end, min_gap):
+                for s, e in split_windows(gap_start.tz_localize('UTC'), gap_end.tz_localize('UTC'), window):
+                    future = executor.submit(fetch_window, instrument, s, e, limiter, store.granularity)
+                    futures[future] = (instrument, s, e)
+
+        # merges and index updates stay on this thread, each window is recorded once it is stored
+        for future in as_completed(futures):
+            instrument, s, e = futures[future]
+            added[instrument] += store.merge(instrument, future.result())
+            index.mark(instrument, s, min(e, until))
+
+    for instrument, count in added.items():
+        print('{} --> {} candles repaired'.format(instrument, count))
+    return dict(added)
@@ -1,6 +1,8 @@
 from datetime import datetime
+import numpy as np
 import pandas as pd
 import os
+import random
 import time
 
 # load history data from Oanda api
@@ -8,9 +10,9 @@ import data.oanda.config as oanda_cfg
 
 
 def load_available_instrument():
-    config = oanda_cfg.make_config_instance()
+    config = oanda_cfg.get_config()
     account_id = config.active_account
-    api = config.create_context()
+    api = oanda_cfg.get_context()
     response = api.account.instruments(account_id)
     instruments = response.get("instruments", "200")
     instruments.sort(key=lambda i: i.name)
@@ -18,7 +20,7 @@ def load_available_instrument():
     # ???没必要吧？？？先期也就是找几个可以入围的品种就行了。
 
 
-def load_candle(instrument, **kwargs):
+def load_candle(instrument, components=None, complete_only=False, **kwargs):
     # instrument - Name of the Instrument [required]
     #
     # **kwargs includes:
@@ -60,45 +62,117 @@ def load_candle(instrument, **kwargs):
     #
     # price -       The Price component(s) to get candlestick data for. Can contain any combination of the
     #               characters “M” (midpoint candles) “B” (bid candles) and “A” (ask candles). [default=M]
-    #               NOTE: for this function, only single character is allowed!!!
+    #               NOTE: without components, only the first present component is kept (see decode_candles)
+    #
+    # components -  Optional list of price components (e.g. ["bid", "ask"]) to return together. The price
+    #               parameter is derived from it when not given explicitly.
+    #
+    # complete_only - Drop the candle still in progress (complete: false), whose prices will change.
     #
     # for more detailed description: http://developer.oanda.com/rest-live-v20/instrument-ep/
-    config = oanda_cfg.make_config_instance()
-    # Fetch the candles
-    for _ in range(100):
+    if components is not None and "price" not in kwargs:
+        kwargs["price"] = "".join(PRICE_CODES[c] for c in components)
+    # Fetch the candles, reusing this thread's pooled connection
+    for attempt in range(MAX_RETRIES):
         try:
-            api = config.create_context()
+            api = oanda_cfg.get_context()
             response = api.instrument.candles(instrument, **kwargs)
-            break  # get connection successfully
-        except:
+            if response.status != 429 and response.status < 500:
+                break  # get connection successfully
+            print('the server is busy (status {}) !!!'.format(response.status))
+        except Exception:
             print('ERROR in getting the https connection !!!')
-            time.sleep(10)  # wait 10 seconds
+            oanda_cfg.reset_context()
+            if attempt == MAX_RETRIES - 1:
+                raise
+        if attempt < MAX_RETRIES - 1:
+            time.sleep(backoff_delay(attempt))
 
     if response.status != 200:
         print('the response status is NOT 200')
         raise Exception(response.body)
 
-    header = ["Time", "Open", "High", "Low", "Close", "Volume"]
-    df = pd.DataFrame(columns=header)
     candles = response.get("candles", 200)
-    for candle in candles:
-        rec = list()
-        # time
-        rec.append(candle.time)
-        for price in ["mid", "bid", "ask"]:
-            c = getattr(candle, price, None)
-            if c is None:
-                continue
-            rec.append(c.o)
-            rec.append(c.h)
-            rec.append(c.l)
-            rec.append(c.c)
-            break
-        # volume
-        rec.append(candle.volume)
-        # add the record into dataframe
-        df.loc[len(df)] = rec
-    return df
+    if complete_only:
+        candles = [candle for candle in candles if candle.complete]
+    return decode_candles(candles, components)
+
+
+def backoff_delay(attempt):
+    """
+    Exponential backoff with full jitter: a random delay up to
+    BACKOFF_BASE * 2 ** attempt seconds, capped at BACKOFF_CAP
+    """
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+MAX_RETRIES = 10  # attempts for one page before giving up
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_CAP = 60  # seconds
+GRANULARITY_SECONDS = {'S5': 5, 'S10': 10, 'S15': 15, 'S30': 30, 'M1': 60, 'M2': 120, 'M4': 240,
+                       'M5': 300, 'M10': 600, 'M15': 900, 'M30': 1800, 'H1': 3600, 'H2': 7200,
+                       'H3': 10800, 'H4': 14400, 'H6': 21600, 'H8': 28800, 'H12': 43200, 'D': 86400}
+PRICE_COMPONENTS = ["mid", "bid", "ask"]
+PRICE_CODES = {"mid": "M", "bid": "B", "ask": "A"}
+HEADER = ["Time", "Open", "High", "Low", "Close", "Volume"]
+# the RFC3339 layout returned by the server, used when writing the csv files
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f000Z'
+
+
+def decode_candles(candles, components=None):
+    """
+    Decode v20 candlesticks into a DataFrame built once from column arrays
+
+    Args:
+        candles: The list of v20 Candlestick objects
+        components: None to keep the first present price component (mid, bid,
+            ask) in the Open/High/Low/Close columns, or a list of components
+            (e.g. ["bid", "ask"]) to return all of them with prefixed columns
+            (Bid_Open, ..., Ask_Close). Missing prices are NaN.
+
+    Returns:
+        A DataFrame with Time as datetime64, prices as float64 and Volume as
+        int64
+    """
+    n = len(candles)
+    times = np.empty(n, dtype='datetime64[ns]')
+    volumes = np.empty(n, dtype=np.int64)
+    if components is None:
+        ohlc = np.full((n, 4), np.nan)
+        for i, candle in enumerate(candles):
+            times[i] = candle.time.rstrip('Z')
+            volumes[i] = candle.volume
+            for price in PRICE_COMPONENTS:
+                c = getattr(candle, price, None)
+                if c is None:
+                    continue
+                ohlc[i] = (c.o, c.h, c.l, c.c)
+                break
+        columns = {"Time": times}
+        for j, name in enumerate(HEADER[1:5]):
+            columns[name] = ohlc[:, j]
+    else:
+        ohlc = {price: np.full((n, 4), np.nan) for price in components}
+        for i, candle in enumerate(candles):
+            times[i] = candle.time.rstrip('Z')
+            volumes[i] = candle.volume
+            for price, values in ohlc.items():
+                c = getattr(candle, price, None)
+                if c is not None:
+                    values[i] = (c.o, c.h, c.l, c.c)
+        columns = {"Time": times}
+        for price, values in ohlc.items():
+            for j, name in enumerate(HEADER[1:5]):
+                columns[price.capitalize() + '_' + name] = values[:, j]
+    columns["Volume"] = volumes
+    return pd.DataFrame(columns)
+
+
+def format_time(value):
+    """
+    Format a csv or DataFrame timestamp as the RFC3339 string used by the server
+    """
+    return pd.Timestamp(value).strftime(TIME_FORMAT)
 
 
 COUNT = 5000  # the max candle can be returned
@@ -106,6 +180,12 @@ GRANULARITY = 'M1'  # 1 min
 INIT_TIME = '2005-01-01T00:00:00.000000000Z'
 # INIT_TIME = '2011-08-29T10:07:00.000000000Z'
 
+INSTRUMENTS = ['AU200_AUD', 'BCO_USD', 'CORN_USD', 'DE10YB_EUR', 'DE30_EUR', 'EU50_EUR', 'FR40_EUR'
+               , 'HK33_HKD', 'IN50_USD', 'JP225_USD', 'NAS100_USD', 'NATGAS_USD', 'NL25_EUR',
+               'SG30_SGD', 'SOYBN_USD', 'SPX500_USD', 'SUGAR_USD', 'TWIX_USD', 'UK100_GBP', 'UK10YB_GBP',
+               'US2000_USD', 'US30_USD', 'USB02Y_USD', 'USB05Y_USD', 'USB10Y_USD', 'USB30Y_USD', 'WHEAT_USD',
+               'WTICO_USD', 'XAG_USD', 'XAU_USD', 'XCU_USD', 'XPD_USD', 'XPT_USD', 'CN50_USD']
+
 
 def update_candle_data(instrument, data_path):
     file_name = '.'.join([instrument, 'csv'])
@@ -120,26 +200,27 @@ def update_candle_data(instrument, data_path):
         # it is the first time to load the data
         # is_first_run = True
         kwargs["fromTime"] = INIT_TIME
-        df = load_candle(instrument, **kwargs)
-        df.to_csv(file_name, index=False)
+        df = load_candle(instrument, complete_only=True, **kwargs)
+        df.to_csv(file_name, index=False, date_format=TIME_FORMAT)
     # get the timestamp from the last record. It will be the fromTime for the next run.
-    last_rec = df.iloc[len(df)-1]
-    last_timestamp = last_rec['Time']
+    last_time = pd.Timestamp(df['Time'].iloc[-1])
+    last_timestamp = format_time(last_time)
     # round_ = 0
     while True:
         print(instrument + '--> start loading from time ' + last_timestamp)
         kwargs["fromTime"] = last_timestamp
-        df_buffer = load_candle(instrument, **kwargs)
-        if len(df_buffer) <= 1:
+        page = load_candle(instrument, complete_only=True, **kwargs)
+        # keep only the candles after the last stored one, whether or not the server repeated it
+        df_buffer = page[page['Time'] > last_time.tz_localize(None)]
+        if len(df_buffer) == 0:
             print("No more data from server.")
             break
-        df_buffer = df_buffer.iloc[1:len(df_buffer)]  # remove the first record, since it's duplicated
-        df_buffer.to_csv(file_name, mode='a', header=False, index=False)
-        if len(df_buffer) < COUNT - 1:
+        df_buffer.to_csv(file_name, mode='a', header=False, index=False, date_format=TIME_FORMAT)
+        if len(page) < COUNT:
             print('No more data from server.')
             break
-        last_rec = df_buffer.iloc[len(df_buffer) - 1]
-        last_timestamp = last_rec['Time']
+        last_time = df_buffer['Time'].iloc[-1]
+        last_timestamp = format_time(last_time)
         # for testing purpose only
         # if round_ >= 100:
         #     break
@@ -166,10 +247,10 @@ if __name__ == "__main__":
     # to_full_filename = os.path.join(to_path, to_filename)
     # df.to_csv(to_full_filename, index=False)
 
-    instruments = ['AU200_AUD', 'BCO_USD', 'CORN_USD', 'DE10YB_EUR', 'DE30_EUR', 'EU50_EUR', 'FR40_EUR'
-                   , 'HK33_HKD', 'IN50_USD', 'JP225_USD', 'NAS100_USD', 'NATGAS_USD', 'NL25_EUR',
-                   'SG30_SGD', 'SOYBN_USD', 'SPX500_USD', 'SUGAR_USD', 'TWIX_USD', 'UK100_GBP', 'UK10YB_GBP',
-                   'US2000_USD', 'US30_USD', 'USB02Y_USD', 'USB05Y_USD', 'USB10Y_USD', 'USB30Y_USD', 'WHEAT_USD',
-                   'WTICO_USD', 'XAG_USD', 'XAU_USD', 'XCU_USD', 'XPD_USD', 'XPT_USD', 'CN50_USD']
-    for instrument in instruments:
-        update_candle_data(instrument, to_path)
+    # the instruments are updated concurrently, each one split into time windows fetched in parallel
+    from data.oanda.backfill import backfill
+    from data.candle_store import CandleStore, import_csv_folder
+    store = CandleStore(os.path.join(to_path, 'store'), GRANULARITY)
+    # one-shot import of the csv files written by update_candle_data
+    # import_csv_folder(store, to_path)
+    backfill(INSTRUMENTS, store)
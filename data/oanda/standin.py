@@ -0,0 +1,726 @@
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pandas as pd
+
+import data.oanda.config as oanda_cfg
+from data.oanda.backfill import RateLimiter
+from data.oanda.coverage import DEFAULT_CALENDAR
+from data.oanda.history_data import COUNT, GRANULARITY, GRANULARITY_SECONDS
+
+# Local stand-in for the v20 REST and streaming API
+#
+# StandinServer answers the requests the history loader and the pricing stream send, so their
+# throughput can be measured without the live API:
+#
+#   GET /v3/instruments/{instrument}/candles        candles, recorded (a CandleStore) or synthetic
+#   GET /v3/accounts/{account}/instruments          the instrument list
+#   GET /v3/accounts/{account}/pricing/stream       chunked prices and heartbeats, recorded or synthetic
+#
+# Latency, random 5xx errors and a requests-per-second limit answered with 429 are configurable.
+# Synthetic candles are a deterministic function of instrument and time on a weekly trading calendar
+# (closed from Friday 21:00 to Sunday 21:00 UTC), so repeated and overlapping requests agree.
+#
+# Candles are rendered to JSON a week at a time and cached, so answering a page is a lookup and a
+# join; warm() renders a history up front. With process=True the server runs in `workers` forked
+# processes sharing the listening socket, the counters and the 429 token bucket, so it stays faster
+# than the concurrent clients it measures.
+#
+#   with StandinServer(latency=0.05, rate_limit=100):   # points get_config() at the stand-in
+#       df = load_candle('EUR_USD', granularity='M1', count=5000, fromTime='2019-01-02T00:00:00Z')
+#
+# The benchmark_* functions below run the history loader against a stand-in and report candles/s,
+# requests/s and end-to-end time, e.g. run_benchmarks('/tmp/standin').
+
+DEFAULT_COUNT = 500  # candles returned when neither count nor both ends are given
+DAY_NS = 86400 * 10 ** 9
+BLOCK_NS = 7 * DAY_NS  # candles are rendered and cached a week at a time
+MAX_BLOCKS = 1024  # cached weeks of (instrument, granularity, price, datetime format)
+HISTORY_DAYS = 30  # default length of the synthetic history, ending now
+ACCOUNT_ID = '101-001-0000000-001'
+HEARTBEAT_INTERVAL = 5  # seconds
+
+CANDLES_PATH = re.compile(r'^/v3/instruments/([^/]+)/candles$')
+INSTRUMENTS_PATH = re.compile(r'^/v3/accounts/([^/]+)/instruments$')
+STREAM_PATH = re.compile(r'^/v3/accounts/([^/]+)/pricing/stream$')
+
+CANDLE_LAYOUT = '{{"complete":true,"volume":{},"time":"{}"{}}}'
+COMPONENT_NAMES = {'M': 'mid', 'B': 'bid', 'A': 'ask'}
+STATS = ('requests', 'candles', 'errors', 'throttled', 'prices', 'heartbeats')
+
+
+def _mix(values, seed):
+    """
+    Hash integers to uniform floats in [0, 1)
+    """
+    x = values.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15) + np.uint64(seed)
+    x ^= x >> np.uint64(33)
+    x *= np.uint64(0xFF51AFD7ED58CCD5)
+    x ^= x >> np.uint64(33)
+    return (x >> np.uint64(11)).astype(np.float64) / 2.0 ** 53
+
+
+def _seed(instrument):
+    return zlib.crc32(instrument.encode('ascii'))
+
+
+def synthetic_price(instrument, times):
+    """
+    The synthetic mid price of an instrument at nanosecond timestamps
+    """
+    seed = _seed(instrument)
+    base = 10.0 ** (seed % 4) * (1 + seed % 97 / 97)
+    seconds = np.asarray(times, dtype=np.int64) // 10 ** 9
+    t = seconds.astype(np.float64)
+    phase = seed % 360 * np.pi / 180
+    noise = _mix(seconds, seed) - 0.5
+    return base * (1 + 0.05 * np.sin(2 * np.pi * t / (90 * 86400) + phase)
+                   + 0.01 * np.sin(2 * np.pi * t / 86400) + 0.002 * noise)
+
+
+def synthetic_candles(instrument, times, step):
+    """
+    Synthetic candles starting at the nanosecond timestamps, step seconds long
+
+    Returns:
+        (open, high, low, close, volume) arrays
+    """
+    times = np.asarray(times, dtype=np.int64)
+    seed = _seed(instrument)
+    close = synthetic_price(instrument, times + (step - 1) * 10 ** 9)
+    open_ = synthetic_price(instrument, times - 10 ** 9)
+    spread = np.abs(close - open_) + close * 0.0002
+    high = np.maximum(open_, close) + spread * _mix(times, seed + 1)
+    low = np.minimum(open_, close) - spread * _mix(times, seed + 2)
+    volume = 1 + (_mix(times, seed + 3) * 200).astype(np.int64)
+    return open_, high, low, close, volume
+
+
+def parse_time(value):
+    """
+    A query time (RFC3339 or UNIX seconds) as nanoseconds since the epoch
+    """
+    if re.match(r'^\d+(\.\d*)?$', value):
+        return int(round(float(value) * 10 ** 9))
+    ts = pd.Timestamp(value)
+    if ts.tz is not None:
+        ts = ts.tz_convert('UTC').tz_localize(None)
+    return ts.value
+
+
+def format_times(times, datetime_format):
+    times = np.asarray(times, dtype=np.int64)
+    if datetime_format == 'UNIX':
+        return ['{}.{:09d}'.format(t // 10 ** 9, t % 10 ** 9) for t in times.tolist()]
+    return [s + 'Z' for s in np.datetime_as_string(times.astype('datetime64[ns]'), unit='ns')]
+
+
+def render_candles(times, o, h, l, c, v, components, datetime_format):
+    """
+    The JSON strings of candles, one per candle, with the price components (e.g. 'MBA') requested
+    """
+    half_spread = c * 0.0001
+    columns = []
+    for code in components:
+        shift = {'M': 0, 'B': -1, 'A': 1}[code] * half_spread
+        prices = [np.char.mod('%.5f', values + shift) for values in (o, h, l, c)]
+        columns.append((COMPONENT_NAMES[code], prices))
+    items = []
+    for i, (volume, time_string) in enumerate(zip(v.tolist(), format_times(times, datetime_format))):
+        prices = ''.join(',"{}":{{"o":"{}","h":"{}","l":"{}","c":"{}"}}'.format(
+            name, p[0][i], p[1][i], p[2][i], p[3][i]) for name, p in columns)
+        items.append(CANDLE_LAYOUT.format(volume, time_string, prices))
+    return items
+
+
+class StandinServer:
+    """
+    Threaded HTTP server answering v20 candle, instrument and pricing stream requests
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None,
+                 first=None, last=None, store=None, instruments=None, stream_rate=10, stream_limit=None,
+                 stream_file=None, heartbeat_interval=HEARTBEAT_INTERVAL, account_id=ACCOUNT_ID, seed=0,
+                 process=False, workers=1, incomplete=False):
+        """
+        Args:
+            host: The interface to listen on
+            port: The port to listen on [default=any free port]
+            latency: Seconds added to every response
+            jitter: Random seconds (up to) added on top of latency
+            error_rate: Fraction of requests answered with 503
+            rate_limit: Requests per second allowed before answering 429 [default=unlimited]
+            first: The first synthetic candle [default=HISTORY_DAYS before last]
+            last: The time synthetic candles stop before [default=now]
+            store: A CandleStore serving recorded candles instead of synthetic ones
+            instruments: The instruments listed by the instruments endpoint [default=history_data.INSTRUMENTS]
+            stream_rate: Prices per second sent by the pricing stream [None=as fast as possible]
+            stream_limit: Prices sent before the stream ends [default=until the client disconnects]
+            stream_file: A file of recorded pricing stream lines replayed instead of synthetic prices
+            heartbeat_interval: Seconds between stream heartbeats
+            account_id: The account of the generated Config
+            seed: Seed of the error and jitter draws
+            process: Serve from forked child processes, so the server does not compete with the
+                client under test for the GIL (POSIX only)
+            workers: The number of child processes serving when process is set
+            incomplete: Also serve the synthetic candle in progress at last, with complete false, as v20
+                serves the current candle
+        """
+        from data.oanda.history_data import INSTRUMENTS
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.limiter = SharedRateLimiter(rate_limit) if rate_limit else None
+        self.last = parse_time(str(last)) if last is not None else pd.Timestamp.now('UTC').tz_localize(None).value
+        self.first = parse_time(str(first)) if first is not None else self.last - HISTORY_DAYS * DAY_NS
+        self.store = store
+        self.instruments = list(instruments or INSTRUMENTS)
+        self.stream_rate = stream_rate
+        self.stream_limit = stream_limit
+        self.stream_file = stream_file
+        self.heartbeat_interval = heartbeat_interval
+        self.account_id = account_id
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.process = process
+        self.workers = workers
+        self.incomplete = incomplete
+        self.blocks = OrderedDict()  # (instrument, granularity, price, datetime format, week) -> (times, json)
+
+        self.httpd = None
+        self.thread = None
+        self.children = []
+        self.stopping = multiprocessing.Event()
+        self.lock = threading.Lock()
+        self.counters = multiprocessing.Array('q', len(STATS))  # shared with a child process
+        self._previous_config = None
+
+    @property
+    def stats(self):
+        with self.counters.get_lock():
+            return dict(zip(STATS, self.counters[:]))
+
+    def reset_stats(self):
+        with self.counters.get_lock():
+            self.counters[:] = [0] * len(STATS)
+
+    def count(self, name, n=1):
+        with self.counters.get_lock():
+            self.counters[STATS.index(name)] += n
+
+    def bind(self):
+        self.httpd = StandinHTTPServer((self.host, self.port), StandinHandler)
+        self.httpd.standin = self
+        self.port = self.httpd.server_address[1]
+
+    def start(self):
+        """
+        Start serving on a background thread or a child process
+        """
+        self.stopping.clear()
+        self.bind()
+        if self.process:
+            # the children inherit the listening socket and the rendered candles, the parent only keeps the port
+            context = multiprocessing.get_context('fork')
+            self.children = [context.Process(target=self.serve, args=(worker,), daemon=True)
+                             for worker in range(self.workers)]
+            for child in self.children:
+                child.start()
+            self.httpd.server_close()
+            self.httpd = None
+        else:
+            self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+            self.thread.start()
+        return self
+
+    def serve(self, worker):
+        """
+        Serve in a child process, with its own error and jitter draws
+        """
+        self.random = random.Random(self.seed * 1000 + worker)
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.stopping.set()
+        for child in self.children:
+            child.terminate()
+        for child in self.children:
+            child.join()
+        self.children = []
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def make_config(self):
+        """
+        A Config pointing both the REST and the streaming context at the stand-in
+        """
+        config = oanda_cfg.Config()
+        config.hostname = self.host
+        config.streaming_hostname = self.host
+        config.port = self.port
+        config.ssl = False
+        config.token = 'standin'
+        config.username = 'standin'
+        config.accounts = [self.account_id]
+        config.active_account = self.account_id
+        return config
+
+    def __enter__(self):
+        """
+        Start the server and make it the process-wide Config until exit
+        """
+        self.start()
+        self._previous_config = oanda_cfg._config
+        oanda_cfg.set_config(self.make_config())
+        return self
+
+    def __exit__(self, *args):
+        oanda_cfg.set_config(self._previous_config)
+        self.stop()
+
+    def admit(self):
+        """
+        Apply latency, errors and the rate limit to one request
+
+        Returns:
+            None to answer normally, or (status, message)
+        """
+        self.count('requests')
+        with self.lock:
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            failed = self.error_rate and self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if self.limiter is not None and self.limiter.try_acquire():
+            self.count('throttled')
+            return 429, 'Too many requests'
+        if failed:
+            self.count('errors')
+            return 503, 'Service unavailable'
+        return None
+
+    def select(self, instrument, granularity, components, datetime_format, start=None, end=None, count=None):
+        """
+        The rendered candles answering a request, following the v20 rules for from, to and count
+
+        Returns:
+            A list of the candles' JSON strings
+        """
+        step_ns = GRANULARITY_SECONDS[granularity] * 10 ** 9
+        first = -(-self.first // step_ns) * step_ns
+        stop = self.last - step_ns + 1  # only complete candles
+        key = (instrument, granularity, components, datetime_format)
+        in_progress = self.in_progress(key, start, end)
+        if start is not None:
+            if end is not None:
+                count = COUNT
+                stop = min(end, stop)
+            count = count or DEFAULT_COUNT
+            start = max(start, first)
+            items = []
+            block = start // BLOCK_NS
+            while len(items) < count and block * BLOCK_NS < stop:
+                times, rendered = self.block(key, block)
+                i = np.searchsorted(times, start)
+                j = np.searchsorted(times, stop)
+                items.extend(rendered[i:min(j, i + count - len(items))])
+                block += 1
+            if in_progress is not None and len(items) < count:
+                items.append(in_progress)
+            return items
+
+        count = count or DEFAULT_COUNT
+        end = min(end if end is not None else stop, stop)
+        chunks = []
+        found = 0
+        block = (end - 1) // BLOCK_NS
+        while found < count and (block + 1) * BLOCK_NS > first:
+            times, rendered = self.block(key, block)
+            j = np.searchsorted(times, end)
+            chunk = rendered[max(j - count + found, 0):j]
+            chunks.insert(0, chunk)
+            found += len(chunk)
+            block -= 1
+        items = [item for chunk in chunks for item in chunk]
+        if in_progress is not None:
+            items = (items + [in_progress])[-count:]
+        return items
+
+    def in_progress(self, key, start, end):
+        """
+        The rendered candle in progress at last when it is served and falls inside [start, end), else None
+        """
+        instrument, granularity, components, datetime_format = key
+        step = GRANULARITY_SECONDS[granularity]
+        time_ns = self.last // (step * 10 ** 9) * step * 10 ** 9
+        if (not self.incomplete or self.store is not None or (start is not None and time_ns < start)
+                or (end is not None and time_ns >= end) or not DEFAULT_CALENDAR.open_mask([time_ns])[0]):
+            return None
+        times = np.array([time_ns], dtype=np.int64)
+        item = render_candles(times, *synthetic_candles(instrument, times, step), components, datetime_format)[0]
+        return item.replace('"complete":true', '"complete":false', 1)
+
+    def block(self, key, block):
+        """
+        The times and rendered JSON strings of the candles of one BLOCK_NS long block, cached
+        """
+        with self.lock:
+            cached = self.blocks.get(key + (block,))
+            if cached is not None:
+                self.blocks.move_to_end(key + (block,))
+                return cached
+        instrument, granularity, components, datetime_format = key
+        step = GRANULARITY_SECONDS[granularity]
+        begin, end = block * BLOCK_NS, (block + 1) * BLOCK_NS
+        if self.store is None:
+            step_ns = step * 10 ** 9
+            times = self._grid(max(begin, self.first), min(end, self.last - step_ns + 1), step_ns)
+            o, h, l, c, v = synthetic_candles(instrument, times, step)
+        else:
+            times, o, h, l, c, v = self.recorded_candles(instrument, begin, end)
+        cached = times, render_candles(times, o, h, l, c, v, components, datetime_format)
+        with self.lock:
+            self.blocks[key + (block,)] = cached
+            while len(self.blocks) > MAX_BLOCKS:
+                self.blocks.popitem(last=False)
+        return cached
+
+    def warm(self, instruments, granularity=GRANULARITY, components='M', datetime_format='RFC3339'):
+        """
+        Render the whole history of the instruments ahead of the requests, so the time the server
+        spends on a request is a lookup and a join. Call before start() to share the cache with
+        the worker processes.
+        """
+        for instrument in instruments:
+            key = (instrument, granularity, components, datetime_format)
+            for block in range(self.first // BLOCK_NS, (self.last - 1) // BLOCK_NS + 1):
+                self.block(key, block)
+
+    @staticmethod
+    def _grid(start, end, step_ns):
+        start = -(-start // step_ns) * step_ns
+        if start >= end:
+            return np.empty(0, np.int64)
+        times = np.arange(start, end, step_ns, dtype=np.int64)
+        return times[DEFAULT_CALENDAR.open_mask(times)]
+
+    def candles(self, instrument, query, datetime_format):
+        """
+        The JSON body answering a candles request
+        """
+        granularity = query.get('granularity', 'S5')
+        if granularity not in GRANULARITY_SECONDS:
+            raise ValueError('granularity {}'.format(granularity))
+        start = parse_time(query['from']) if 'from' in query else None
+        end = parse_time(query['to']) if 'to' in query else None
+        count = int(query['count']) if 'count' in query else None
+        components = query.get('price', 'M')
+
+        items = self.select(instrument, granularity, components, datetime_format, start, end, count)
+        self.count('candles', len(items))
+        return '{{"instrument":"{}","granularity":"{}","candles":[{}]}}'.format(
+            instrument, granularity, ','.join(items))
+
+    def recorded_candles(self, instrument, start, end):
+        """
+        The candles of [start, end) read from the CandleStore
+        """
+        df = self.store.read(instrument, pd.Timestamp(start), pd.Timestamp(end))
+        times = pd.to_datetime(df['Time']).values.astype('datetime64[ns]').view(np.int64)
+        return (times, df['Open'].values.astype(np.float64), df['High'].values.astype(np.float64),
+                df['Low'].values.astype(np.float64), df['Close'].values.astype(np.float64),
+                df['Volume'].values.astype(np.int64))
+
+    def instrument_list(self):
+        items = [{"name": name, "type": "CFD", "displayName": name.replace('_', '/'), "pipLocation": -4,
+                  "displayPrecision": 5, "tradeUnitsPrecision": 0, "minimumTradeSize": "1",
+                  "maximumTrailingStopDistance": "1.00000", "minimumTrailingStopDistance": "0.00050",
+                  "maximumPositionSize": "0", "maximumOrderUnits": "100000000", "marginRate": "0.05"}
+                 for name in self.instruments]
+        return json.dumps({"instruments": items, "lastTransactionID": "1"})
+
+    def stream_lines(self, instruments):
+        """
+        Yield the pricing stream messages (bytes), None when it is time for a heartbeat check
+        """
+        if self.stream_file is not None:
+            with open(self.stream_file, 'rb') as f:
+                recorded = [line.strip() for line in f if line.strip()]
+            wanted = [i.encode('ascii') for i in instruments]
+            recorded = [line for line in recorded
+                        if b'HEARTBEAT' not in line and any(i in line for i in wanted)]
+            while recorded:
+                for line in recorded:
+                    yield line
+            return
+
+        n = 0
+        while True:
+            now = pd.Timestamp.now('UTC').tz_localize(None).value
+            instrument = instruments[n % len(instruments)]
+            mid = float(synthetic_price(instrument, np.array([now]))[0])
+            half_spread = mid * 0.0001
+            time_string = format_times([now], 'RFC3339')[0]
+            yield ('{{"type":"PRICE","time":"{}","bids":[{{"price":"{:.5f}","liquidity":1000000}}],'
+                   '"asks":[{{"price":"{:.5f}","liquidity":1000000}}],"closeoutBid":"{:.5f}",'
+                   '"closeoutAsk":"{:.5f}","status":"tradeable","tradeable":true,"instrument":"{}"}}').format(
+                time_string, mid - half_spread, mid + half_spread, mid - half_spread, mid + half_spread,
+                instrument).encode('ascii')
+            n += 1
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter keeping its bucket in shared memory, so forked worker processes draw from one bucket
+    """
+
+    def __init__(self, rate, burst=None):
+        super().__init__(rate, burst)
+        self.bucket = multiprocessing.Array('d', [self.tokens, self.timestamp])
+
+    def try_acquire(self):
+        with self.bucket.get_lock():
+            tokens, timestamp = self.bucket[:]
+            now = time.monotonic()
+            tokens = min(self.burst, tokens + (now - timestamp) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            self.bucket[:] = [tokens - 1 if tokens >= 1 else tokens, now]
+            return wait
+
+
+class StandinHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # connections of all the fetch workers may arrive at once
+
+    def handle_error(self, request, client_address):
+        # clients giving up on a slow response are expected under load
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_message(self, status, message):
+        self.send_body(status, json.dumps({"errorMessage": message}))
+
+    def do_GET(self):
+        standin = self.server.standin
+        url = urlsplit(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        datetime_format = self.headers.get('Accept-Datetime-Format', 'RFC3339')
+
+        failure = standin.admit()
+        if failure is not None:
+            self.send_error_message(*failure)
+            return
+
+        match = CANDLES_PATH.match(url.path)
+        if match:
+            try:
+                body = standin.candles(match.group(1), query, datetime_format)
+            except (KeyError, ValueError) as e:
+                self.send_error_message(400, 'Invalid request: {}'.format(e))
+                return
+            self.send_body(200, body)
+            return
+        if INSTRUMENTS_PATH.match(url.path):
+            self.send_body(200, standin.instrument_list())
+            return
+        if STREAM_PATH.match(url.path):
+            instruments = [i for i in query.get('instruments', '').split(',') if i]
+            if not instruments:
+                self.send_error_message(400, 'Invalid value specified for instruments')
+                return
+            self.stream(standin, instruments)
+            return
+        self.send_error_message(404, 'The requested resource does not exist')
+
+    def write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data) + 1, data + b'\n'))
+        self.wfile.flush()
+
+    def stream(self, standin, instruments):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.close_connection = True
+
+        interval = 1 / standin.stream_rate if standin.stream_rate else 0
+        next_heartbeat = time.monotonic() + standin.heartbeat_interval
+        sent = 0
+        try:
+            for line in standin.stream_lines(instruments):
+                if standin.stopping.is_set() or (standin.stream_limit is not None and sent >= standin.stream_limit):
+                    break
+                self.write_chunk(line)
+                sent += 1
+                standin.count('prices')
+                now = time.monotonic()
+                if now >= next_heartbeat:
+                    heartbeat = '{{"type":"HEARTBEAT","time":"{}"}}'.format(
+                        format_times([pd.Timestamp.now('UTC').tz_localize(None).value], 'RFC3339')[0])
+                    self.write_chunk(heartbeat.encode('ascii'))
+                    standin.count('heartbeats')
+                    next_heartbeat = now + standin.heartbeat_interval
+                if interval:
+                    time.sleep(interval)
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def measure(server, name, run):
+    """
+    Time run() against the stand-in
+
+    Args:
+        server: The StandinServer the code under test talks to
+        name: The name of the benchmark
+        run: Called without arguments, returns the number of candles received
+
+    Returns:
+        A dict of the timing and the server counters
+    """
+    server.reset_stats()
+    start = time.perf_counter()
+    candles = run()
+    elapsed = time.perf_counter() - start
+    stats = server.stats
+    return {"name": name, "elapsed": elapsed, "candles": candles, "requests": stats['requests'],
+            "errors": stats['errors'], "throttled": stats['throttled'],
+            "candles_per_s": candles / elapsed if elapsed else 0,
+            "requests_per_s": stats['requests'] / elapsed if elapsed else 0}
+
+
+def benchmark_load_candle(server, instruments, granularity=GRANULARITY):
+    """
+    Sequential load_candle pages of COUNT candles walking forward through the history of each instrument
+    """
+    from data.oanda.history_data import load_candle, format_time
+
+    def run():
+        total = 0
+        for instrument in instruments:
+            from_time = pd.Timestamp(server.first)
+            while True:
+                df = load_candle(instrument, granularity=granularity, count=COUNT, fromTime=format_time(from_time))
+                total += len(df)
+                if len(df) < COUNT:
+                    break
+                from_time = df['Time'].iloc[-1] + pd.Timedelta(seconds=1)
+        return total
+
+    return measure(server, 'load_candle', run)
+
+
+def benchmark_update_candle_data(server, instruments, data_path):
+    """
+    End-to-end update_candle_data of the instruments one after the other into fresh csv files
+    """
+    from data.oanda.history_data import update_candle_data
+    for instrument in instruments:
+        file_name = os.path.join(data_path, instrument + '.csv')
+        if os.path.exists(file_name):
+            os.remove(file_name)
+
+    def run():
+        total = 0
+        for instrument in instruments:
+            update_candle_data(instrument, data_path)
+            with open(os.path.join(data_path, instrument + '.csv')) as f:
+                total += sum(1 for _ in f) - 1
+        return total
+
+    return measure(server, 'update_candle_data', run)
+
+
+def benchmark_backfill(server, instruments, store_path, max_workers=None, rate=None, name='backfill'):
+    """
+    End-to-end backfill of many instruments into a fresh CandleStore
+    """
+    import shutil
+    from data.candle_store import CandleStore
+    from data.oanda import backfill as oanda_backfill
+    if os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    store = CandleStore(store_path, GRANULARITY)
+    kwargs = {}
+    if max_workers is not None:
+        kwargs['max_workers'] = max_workers
+    if rate is not None:
+        kwargs['rate'] = rate
+        oanda_backfill._limiters.pop(server.host, None)
+
+    def run():
+        return sum(oanda_backfill.backfill(instruments, store, **kwargs).values())
+
+    return measure(server, name, run)
+
+
+def run_benchmarks(data_path, instruments=('EUR_USD', 'USD_JPY', 'XAU_USD', 'SPX500_USD'), days=HISTORY_DAYS,
+                   latency=0.02, error_rate=0.0, rate_limit=None, rate=1000, workers=2):
+    """
+    Run the history loaders against a fresh stand-in, all on the same instruments and history: the
+    serial load_candle pages and update_candle_data, then backfill with one and with MAX_WORKERS
+    fetch workers. The history is rendered before the server starts.
+
+    Args:
+        data_path: A scratch folder for the csv files and the candle store
+        instruments: The instruments loaded
+        days: The length of the served history
+        latency: Seconds added to every response, roughly a round trip to the API
+        error_rate: Fraction of requests answered with 503
+        rate_limit: Requests per second the stand-in allows before answering 429
+        rate: The requests per second backfill allows itself, high so the fetch workers are not held back
+        workers: The number of server processes
+
+    Returns:
+        A DataFrame with one row per benchmark
+    """
+    from data.oanda.backfill import MAX_WORKERS
+    os.makedirs(data_path, exist_ok=True)
+    instruments = list(instruments)
+    last = pd.Timestamp.now('UTC').tz_localize(None).floor('min')
+    server = StandinServer(latency=latency, error_rate=error_rate, rate_limit=rate_limit,
+                           first=last - pd.Timedelta(days=days), last=last, process=True, workers=workers)
+    server.warm(instruments)
+    with server:
+        rows = [benchmark_load_candle(server, instruments),
+                benchmark_update_candle_data(server, instruments, data_path),
+                benchmark_backfill(server, instruments, os.path.join(data_path, 'store'), 1, rate, 'backfill_1'),
+                benchmark_backfill(server, instruments, os.path.join(data_path, 'store'), MAX_WORKERS, rate,
+                                   'backfill_{}'.format(MAX_WORKERS))]
+    return pd.DataFrame(rows).set_index('name')
+
+
+if __name__ == "__main__":
+    pd.set_option('display.width', 200)
+    print(run_benchmarks(os.path.join('/tmp', 'oanda_standin')))
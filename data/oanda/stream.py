@@ -0,0 +1,359 @@
+import asyncio
+import json
+import ssl as ssl_module
+from collections import OrderedDict, deque
+from datetime import datetime
+from urllib.parse import quote
+
+import data.oanda.config as oanda_cfg
+from data.oanda.history_data import backoff_delay
+
+# asyncio client of the v20 pricing stream
+#
+# The v20 library's streaming context is built on blocking requests, so this client talks to the
+# same endpoint (the streaming host, port, TLS setting and token of the Config that
+# create_streaming_context uses) directly over an asyncio connection. All instruments share one
+# connection. Heartbeats are recognised without decoding the JSON, prices are decoded once into a
+# small __slots__ object that is handed to every subscriber.
+#
+# Each subscriber reads from its own bounded queue so a slow strategy never blocks the connection or
+# the other subscribers. When a queue is full the policy decides what is lost:
+#   drop_oldest      the oldest queued price is discarded
+#   coalesce_latest  only the latest price of every instrument is kept, older ones are replaced
+#
+# set_config() with a Config pointing at a local server runs the client against a replay server.
+
+DROP_OLDEST = 'drop_oldest'
+COALESCE_LATEST = 'coalesce_latest'
+QUEUE_SIZE = 1000
+HEARTBEAT_TIMEOUT = 20  # seconds without any message before reconnecting (heartbeats come every 5s)
+HEARTBEAT = b'"type":"HEARTBEAT"'
+
+
+class StreamError(Exception):
+    """
+    Exception that indicates the pricing stream returned a non 200 response
+    """
+
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    def __str__(self):
+        return "Pricing stream returned {}: {}".format(self.status, self.body[:200])
+
+
+class Price:
+    """
+    One price of the stream. It has the attributes BarAggregator.update_tick reads from a vnpy
+    TickData (vt_symbol, datetime, last_price, volume), so strategies' on_tick can take it directly.
+    """
+    __slots__ = ('instrument', 'time', 'bid', 'ask', 'bid_liquidity', 'ask_liquidity', 'tradeable',
+                 '_datetime')
+
+    volume = 0  # the stream has no traded volume
+
+    def __init__(self, instrument, time, bid, ask, bid_liquidity, ask_liquidity, tradeable):
+        self.instrument = instrument
+        self.time = time  # RFC3339 string, parsed on first use of datetime
+        self.bid = bid
+        self.ask = ask
+        self.bid_liquidity = bid_liquidity
+        self.ask_liquidity = ask_liquidity
+        self.tradeable = tradeable
+        self._datetime = None
+
+    @property
+    def vt_symbol(self):
+        return self.instrument
+
+    @property
+    def last_price(self):
+        return (self.bid + self.ask) / 2
+
+    @property
+    def datetime(self):
+        if self._datetime is None:
+            # 2019-01-02T03:04:05.123456789Z, microseconds only
+            self._datetime = datetime.strptime(self.time[:26], '%Y-%m-%dT%H:%M:%S.%f')
+        return self._datetime
+
+    def __repr__(self):
+        return 'Price({}, {}, bid={}, ask={})'.format(self.instrument, self.time, self.bid, self.ask)
+
+
+def decode_price(line):
+    """
+    Decode a PRICE line of the stream, None for heartbeats and other messages
+    """
+    if HEARTBEAT in line:
+        return None
+    message = json.loads(line)
+    if message.get('type') != 'PRICE':
+        return None
+    bids = message.get('bids') or ()
+    asks = message.get('asks') or ()
+    bid = float(bids[0]['price']) if bids else float(message.get('closeoutBid', 'nan'))
+    ask = float(asks[0]['price']) if asks else float(message.get('closeoutAsk', 'nan'))
+    return Price(message['instrument'], message['time'], bid, ask,
+                 bids[0].get('liquidity', 0) if bids else 0,
+                 asks[0].get('liquidity', 0) if asks else 0,
+                 message.get('tradeable', True))
+
+
+class PriceQueue:
+    """
+    Bounded queue of one subscriber
+    """
+
+    def __init__(self, maxsize=QUEUE_SIZE, policy=DROP_OLDEST):
+        """
+        Args:
+            maxsize: The number of prices kept (drop_oldest)
+            policy: DROP_OLDEST or COALESCE_LATEST
+        """
+        if policy not in (DROP_OLDEST, COALESCE_LATEST):
+            raise ValueError("unknown policy '{}'".format(policy))
+        self.maxsize = maxsize
+        self.policy = policy
+        self.items = deque() if policy == DROP_OLDEST else OrderedDict()
+        self.event = asyncio.Event()
+        self.dropped = 0  # prices discarded or replaced
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, price):
+        items = self.items
+        if self.policy == DROP_OLDEST:
+            if len(items) >= self.maxsize:
+                items.popleft()
+                self.dropped += 1
+            items.append(price)
+        else:
+            if price.instrument in items:
+                del items[price.instrument]
+                self.dropped += 1
+            items[price.instrument] = price
+        self.event.set()
+
+    def get_nowait(self):
+        """
+        The next price, None when the queue is empty
+        """
+        items = self.items
+        if not items:
+            return None
+        if self.policy == DROP_OLDEST:
+            return items.popleft()
+        return items.popitem(last=False)[1]
+
+    async def get(self):
+        while not self.items:
+            self.event.clear()
+            await self.event.wait()
+        return self.get_nowait()
+
+
+class PricingStream:
+    """
+    One pricing stream connection fanned out to many subscribers
+    """
+
+    def __init__(self, instruments, account_id=None, config=None, snapshot=True,
+                 heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        """
+        Args:
+            instruments: The instruments streamed over the connection
+            account_id: The account of the stream [default=config.active_account]
+            config: The Config [default=the process-wide one]
+            snapshot: Ask for the current prices when connecting
+            heartbeat_timeout: Seconds of silence before reconnecting
+        """
+        self.instruments = list(instruments)
+        self.config = config
+        self.account_id = account_id
+        self.snapshot = snapshot
+        self.heartbeat_timeout = heartbeat_timeout
+
+        self.subscriber_dict = {instrument: [] for instrument in self.instruments}
+        self.running = False
+        self.writer = None
+        self.price_count = 0
+        self.heartbeat_count = 0
+        self.last_message = 0  # loop time of the last message, watched by watchdog()
+
+    def subscribe(self, instruments=None, maxsize=QUEUE_SIZE, policy=DROP_OLDEST):
+        """
+        Create a subscriber queue for some or all of the streamed instruments
+        """
+        queue = PriceQueue(maxsize, policy)
+        for instrument in instruments or self.instruments:
+            self.subscriber_dict[instrument].append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        for queue_list in self.subscriber_dict.values():
+            if queue in queue_list:
+                queue_list.remove(queue)
+
+    def request(self, config):
+        account_id = self.account_id or config.active_account
+        path = '/v3/accounts/{}/pricing/stream?instruments={}&snapshot={}'.format(
+            account_id, quote(','.join(self.instruments)), str(self.snapshot).lower())
+        lines = ['GET {} HTTP/1.1'.format(path),
+                 'Host: {}'.format(config.streaming_hostname),
+                 'Authorization: Bearer {}'.format(config.token),
+                 'Accept-Datetime-Format: {}'.format(config.datetime_format),
+                 'Connection: keep-alive']
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('ascii')
+
+    async def connect(self):
+        """
+        Open the connection and read the response header
+
+        Returns:
+            (reader, chunked)
+        """
+        config = self.config or oanda_cfg.get_config()
+        context = ssl_module.create_default_context() if config.ssl else None
+        reader, writer = await asyncio.open_connection(config.streaming_hostname, config.port, ssl=context)
+        self.writer = writer
+        writer.write(self.request(config))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        chunked = headers.get('transfer-encoding', '').lower() == 'chunked'
+
+        if status != 200:
+            length = int(headers.get('content-length', 0) or 0)
+            body = await reader.read(length) if length else b''
+            self.close()
+            raise StreamError(status, body.decode('utf-8', 'replace'))
+        return reader, chunked
+
+    async def lines(self, reader, chunked):
+        """
+        Yield the message lines of the response body
+        """
+        if not chunked:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                if line.strip():
+                    yield line
+            return
+
+        buffer = b''
+        while True:
+            size_line = await reader.readline()
+            if not size_line:
+                return
+            size = int(size_line.split(b';')[0], 16)
+            if size == 0:
+                return
+            buffer += await reader.readexactly(size + 2)
+            buffer = buffer[:-2]
+            *complete, buffer = buffer.split(b'\n')
+            for line in complete:
+                if line.strip():
+                    yield line
+
+    def dispatch(self, price):
+        for queue in self.subscriber_dict.get(price.instrument, ()):
+            queue.put(price)
+
+    async def watchdog(self):
+        """
+        Drop the connection when nothing arrived for heartbeat_timeout seconds. One timer for the
+        whole stream instead of a timeout around every read.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.heartbeat_timeout / 4)
+            if self.writer is not None and loop.time() - self.last_message > self.heartbeat_timeout:
+                print('no message for {} seconds, reconnecting'.format(self.heartbeat_timeout))
+                self.close()
+
+    async def run(self, max_retries=None):
+        """
+        Stream until stop() is called, reconnecting with backoff after errors, silence or the server
+        ending the stream. A connection counts as failed until its first message arrives.
+
+        Args:
+            max_retries: Consecutive failed connections before giving up [default=never]
+        """
+        loop = asyncio.get_running_loop()
+        self.running = True
+        attempt = 0
+        watchdog = asyncio.ensure_future(self.watchdog())
+        try:
+            while self.running:
+                try:
+                    self.last_message = loop.time()
+                    reader, chunked = await self.connect()
+                    async for line in self.lines(reader, chunked):
+                        self.last_message = loop.time()
+                        attempt = 0
+                        price = decode_price(line)
+                        if price is None:
+                            self.heartbeat_count += 1
+                            continue
+                        self.price_count += 1
+                        self.dispatch(price)
+                        if not self.running:
+                            break
+                    if not self.running:
+                        break
+                    raise ConnectionError('the server ended the stream')
+                except (OSError, asyncio.IncompleteReadError, StreamError, ValueError) as e:
+                    if not self.running:
+                        break
+                    attempt += 1
+                    if max_retries is not None and attempt > max_retries:
+                        self.running = False
+                        raise
+                    print('pricing stream error, reconnecting: {}'.format(e))
+                    await asyncio.sleep(backoff_delay(attempt))
+                finally:
+                    self.close()
+        finally:
+            watchdog.cancel()
+
+    def stop(self):
+        self.running = False
+        self.close()
+
+    def close(self):
+        writer = self.writer
+        self.writer = None
+        if writer is not None:
+            writer.close()
+
+
+async def drive(queue, on_tick, batch=False):
+    """
+    Feed a subscriber queue to a strategy until cancelled
+
+    Args:
+        queue: A PriceQueue
+        on_tick: Called with every Price (e.g. BollingerBotStrategy.on_tick)
+        batch: Drain everything queued before waiting again
+    """
+    while True:
+        price = await queue.get()
+        on_tick(price)
+        if batch:
+            price = queue.get_nowait()
+            while price is not None:
+                on_tick(price)
+                price = queue.get_nowait()
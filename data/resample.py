@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from data.bar_file import BAR_DTYPE, BarFile, BarRecord
+
+# N-minute / N-hour bars from ticks or shorter bars
+#
+# A bar covers the window [k * interval, (k + 1) * interval) counted from 1970-01-01 in the wall
+# clock time of the input, and is stamped with the window start. Windows are found from the
+# timestamps, not by counting inputs, so missing minutes (gaps, weekends) never shift the
+# boundaries and windows without input produce no bar.
+#
+# resample() does the whole series at once for backtests; BarAggregator does the same bar by bar for
+# live trading and produces identical bars.
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_interval(interval):
+    """
+    A timedelta from a timedelta or a pandas frequency string ('5min', '4h')
+    """
+    if isinstance(interval, timedelta):
+        return interval
+    return pd.Timedelta(interval).to_pytimedelta()
+
+
+def resample(time, open, high, low, close, volume, interval):
+    """
+    Resample bars (or ticks, with open = high = low = close = price) into longer bars
+
+    Args:
+        time: datetime64 times, ordered
+        open, high, low, close, volume: The input columns
+        interval: The bar length, a timedelta or a pandas frequency string
+
+    Returns:
+        Records of BAR_DTYPE, time being the window start
+    """
+    interval_ns = to_interval(interval) // timedelta(microseconds=1) * 1000
+    time = np.asarray(time, dtype='datetime64[ns]').view(np.int64)
+    if not len(time):
+        return np.empty(0, dtype=BAR_DTYPE)
+    window = time // interval_ns
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(window)) + 1))
+    ends = np.concatenate((starts[1:], [len(time)]))
+
+    records = np.empty(len(starts), dtype=BAR_DTYPE)
+    records['time'] = window[starts] * interval_ns
+    records['open'] = np.asarray(open)[starts]
+    records['high'] = np.maximum.reduceat(np.asarray(high, dtype=np.float64), starts)
+    records['low'] = np.minimum.reduceat(np.asarray(low, dtype=np.float64), starts)
+    records['close'] = np.asarray(close)[ends - 1]
+    records['volume'] = np.add.reduceat(np.asarray(volume), starts)
+    return records
+
+
+def resample_ticks(time, price, volume, interval):
+    """
+    Bars from tick prices and traded volumes
+    """
+    return resample(time, price, price, price, price, volume, interval)
+
+
+def resample_bar_file(bar_file, interval):
+    """
+    An in-memory BarFile of longer bars from a BarFile
+    """
+    records = resample(bar_file.time, bar_file.open, bar_file.high, bar_file.low, bar_file.close,
+                       bar_file.volume, interval)
+    return BarFile(bar_file.path, records, bar_file.symbol)
+
+
+class BarAggregator:
+    """
+    Streaming version of resample(). Completed bars are passed to on_bar as BarRecord.
+
+    A bar is complete when an input of a later window arrives, or, when input_interval is given
+    (bars as input), as soon as the input covering the end of the window arrives: with 1 minute input
+    bars stamped with their start, the 5 minute bar goes out with the 09:04 bar instead of waiting
+    for the 09:05 one.
+    """
+
+    def __init__(self, interval, on_bar, input_interval=None, vt_symbol=None):
+        """
+        Args:
+            interval: The bar length, a timedelta or a pandas frequency string
+            on_bar: Callback receiving each completed BarRecord
+            input_interval: The length of the input bars, None for ticks
+            vt_symbol: The symbol of the bars, taken from the input by default
+        """
+        self.interval = to_interval(interval)
+        self.on_bar = on_bar
+        self.input_interval = to_interval(input_interval) if input_interval is not None else None
+        self.vt_symbol = vt_symbol
+
+        self.bar = None  # the bar being formed
+        self.window = None  # its window number
+        self.last_volume = None  # cumulative volume of the last tick
+
+    def update(self, dt, open, high, low, close, volume=0, vt_symbol=None):
+        """
+        Add one input (a tick is open = high = low = close)
+        """
+        window = (dt.replace(tzinfo=None) - EPOCH) // self.interval
+        bar = self.bar
+        if bar is not None and window != self.window:
+            self.flush()
+            bar = None
+
+        if bar is None:
+            start = EPOCH + window * self.interval
+            if dt.tzinfo is not None:
+                start = start.replace(tzinfo=dt.tzinfo)
+            self.bar = bar = BarRecord(self.vt_symbol or vt_symbol, start, open, high, low, close, volume)
+            self.window = window
+        else:
+            if high > bar.high:
+                bar.high = high
+            if low < bar.low:
+                bar.low = low
+            bar.close = close
+            bar.volume += volume
+
+        input_interval = self.input_interval
+        if input_interval is not None:
+            if (dt.replace(tzinfo=None) + input_interval - EPOCH) // self.interval != window:
+                self.flush()
+
+    def update_tick(self, tick):
+        """
+        Add a vnpy TickData; its volume is the cumulative volume of the day
+        """
+        last_volume = self.last_volume
+        self.last_volume = tick.volume
+        volume = max(tick.volume - last_volume, 0) if last_volume is not None else 0
+        price = tick.last_price
+        self.update(tick.datetime, price, price, price, price, volume, tick.vt_symbol)
+
+    def update_bar(self, bar):
+        """
+        Add a bar (vnpy BarData or BarRecord)
+        """
+        self.update(bar.datetime, bar.open_price, bar.high_price, bar.low_price, bar.close_price,
+                    bar.volume, bar.vt_symbol)
+
+    def flush(self):
+        """
+        Send out the bar being formed, if any
+        """
+        bar = self.bar
+        if bar is None:
+            return
+        self.bar = None
+        self.window = None
+        self.on_bar(bar)
@@ -1,12 +1,14 @@
-import talib
-import numpy as np
-from vnpy.trader.object import BarData
+from datetime import timedelta
 
 from vnpy.app.cta_strategy import (
     CtaTemplate,
     TickData
 )
 
+from data.resample import BarAggregator, resample_bar_file
+from ta.cache import bar_indicator, BarCursor, SeriesCursor, StdCursor
+from ta.indicator import RollingMean, RollingStd
+
 
 class BollingerBotStrategy(CtaTemplate):
     """基于布林通道的交易策略"""
@@ -23,15 +25,8 @@ class BollingerBotStrategy(CtaTemplate):
     fixedSize = 1  # 每次交易的数量
 
     # 策略变量
-    bar = None  # 1分钟K线对象
-    barMinute = ""  # K线当前的分钟
-    fiveBar = None  # 1分钟K线对象
-
-    bufferSize = 40  # 需要缓存的数据的大小
-    bufferCount = 0  # 目前已经缓存了的数据的计数
-    highArray = np.zeros(bufferSize)  # K线最高价的数组
-    lowArray = np.zeros(bufferSize)  # K线最低价的数组
-    closeArray = np.zeros(bufferSize)  # K线收盘价的数组
+    bufferSize = 40  # 开始计算指标前需要的K线数
+    bufferCount = 0  # 目前已经收到的K线的计数
 
     bollMid = 0  # 布林带中轨
     bollStd = 0  # 布林带宽度
@@ -72,6 +67,28 @@ class BollingerBotStrategy(CtaTemplate):
         """Constructor"""
         super().__init__(cta_engine, strategy_name, vt_symbol, setting)
 
+        # 每个实例独立的环形缓冲区，滚动更新布林带和过滤均线
+        self.bollWindow = RollingStd(self.bollLength)
+        self.maMean = RollingMean(self.maLength)
+        self.cached = False  # 是否改为读取指标缓存
+        self.orderList = []
+
+        # Tick聚合为1分钟K线，1分钟K线聚合为5分钟K线；按时间戳划分窗口，缺失的分钟不影响边界
+        self.minuteAggregator = BarAggregator(timedelta(minutes=1), self.on_bar)
+        self.fiveAggregator = BarAggregator(timedelta(minutes=5), self.onFiveBar,
+                                            input_interval=timedelta(minutes=1))
+
+    # ----------------------------------------------------------------------
+    def use_indicator_cache(self, cache, bar_file):
+        """改为按K线时间读取指标缓存中的布林带和均线序列（cache为None时一次性计算）。
+        bar_file为1分钟K线，随后推送的K线必须是其中的K线"""
+        fiveFile = resample_bar_file(bar_file, timedelta(minutes=5))
+        time = BarCursor(fiveFile.time)
+        self.bollWindow = StdCursor(time, bar_indicator(cache, fiveFile, 'mean', self.bollLength, timeframe='5m'),
+                                    bar_indicator(cache, fiveFile, 'std', self.bollLength, timeframe='5m'))
+        self.maMean = SeriesCursor(time, bar_indicator(cache, fiveFile, 'mean', self.maLength, timeframe='5m'))
+        self.cached = True
+
     # ----------------------------------------------------------------------
     def on_init(self):
         """初始化策略（必须由用户继承实现）"""
@@ -99,87 +116,14 @@ class BollingerBotStrategy(CtaTemplate):
     # ----------------------------------------------------------------------
     def on_tick(self, tick: TickData):
         """收到行情TICK推送（必须由用户继承实现）"""
-        # 聚合为1分钟K线
-        tickMinute = tick.datetime.minute
-
-        if tickMinute != self.barMinute:
-            if self.bar:
-                self.on_bar(self.bar)
-
-            bar = BarData(datetime=tick.datetime,
-                          exchange=tick.exchange,
-                          gateway_name=tick.gateway_name,
-                          symbol=tick.symbol)
-
-            # bar.vt_symbol = tick.vt_symbol
-            # bar.symbol = tick.symbol
-            # bar.exchange = tick.exchange
-
-            bar.open_price = tick.last_price
-            bar.high_price = tick.last_price
-            bar.low_price = tick.last_price
-            bar.close_price = tick.last_price
-
-            # bar.date = tick.date
-            # bar.time = tick.time
-            bar.datetime = tick.datetime  # K线的时间设为第一个Tick的时间
-
-            self.bar = bar  # 这种写法为了减少一层访问，加快速度
-            self.barMinute = tickMinute  # 更新当前的分钟
-        else:  # 否则继续累加新的K线
-            bar = self.bar  # 写法同样为了加快速度
-
-            bar.high_price = max(bar.high_price, tick.last_price)
-            bar.low_price = min(bar.low_price, tick.last_price)
-            bar.close_price = tick.last_price
+        # 聚合为1分钟K线，下一分钟的第一个Tick到达时推送
+        self.minuteAggregator.update_tick(tick)
 
     # ----------------------------------------------------------------------
-    def on_bar(self, bar: BarData):
+    def on_bar(self, bar):
         """收到Bar推送（必须由用户继承实现）"""
-        # 如果当前是一个5分钟走完
-        # ZL: 通过改变 +1 可以实现非标时间bar
-        if (bar.datetime.minute + 1) % 5 == 0:
-            # 如果已经有聚合5分钟K线
-            if self.fiveBar:
-                # 将最新分钟的数据更新到目前5分钟线中
-                fiveBar = self.fiveBar
-                fiveBar.high_price = max(fiveBar.high_price, bar.high_price)
-                fiveBar.low_price = min(fiveBar.low_price, bar.low_price)
-                fiveBar.close_price = bar.close_price
-
-                # 推送5分钟线数据
-                self.onFiveBar(fiveBar)
-
-                # 清空5分钟线数据缓存
-                self.fiveBar = None
-        else:
-            # 如果没有缓存则新建
-            if not self.fiveBar:
-                # fiveBar = BarData()
-                fiveBar = BarData(datetime=bar.datetime,
-                                  exchange=bar.exchange,
-                                  gateway_name=bar.gateway_name,
-                                  symbol=bar.symbol)
-
-                # fiveBar.vtSymbol = bar.vtSymbol
-                # fiveBar.symbol = bar.symbol
-                # fiveBar.exchange = bar.exchange
-
-                fiveBar.open_price = bar.open_price
-                fiveBar.high_price = bar.high_price
-                fiveBar.low_price = bar.low_price
-                fiveBar.close_price = bar.close_price
-
-                # fiveBar.date = bar.datetime
-                # fiveBar.time = bar.time
-                fiveBar.datetime = bar.datetime
-
-                self.fiveBar = fiveBar
-            else:
-                fiveBar = self.fiveBar
-                fiveBar.high_price = max(fiveBar.high_price, bar.high_price)
-                fiveBar.low_price = min(fiveBar.low_price, bar.low_price)
-                fiveBar.close_price = bar.close_price
+        # 聚合为5分钟K线，收到窗口内最后一分钟的K线时立即推送
+        self.fiveAggregator.update_bar(bar)
 
     # ----------------------------------------------------------------------
     def onFiveBar(self, bar):
@@ -189,29 +133,28 @@ class BollingerBotStrategy(CtaTemplate):
             self.cancel_order(orderID)
         self.orderList = []
 
-        # 保存K线数据
-        self.closeArray[0:self.bufferSize - 1] = self.closeArray[1:self.bufferSize]
-        self.highArray[0:self.bufferSize - 1] = self.highArray[1:self.bufferSize]
-        self.lowArray[0:self.bufferSize - 1] = self.lowArray[1:self.bufferSize]
-
-        self.closeArray[-1] = bar.close_price
-        self.highArray[-1] = bar.high_price
-        self.lowArray[-1] = bar.low_price
+        # 更新指标，O(1)
+        maFilter1 = self.maMean.value
+        if self.cached:
+            bollMid, bollStd = self.bollWindow.seek(bar.datetime)
+            maFilter = self.maMean.seek(bar.datetime)
+        else:
+            bollMid, bollStd = self.bollWindow.update(bar.close_price)
+            maFilter = self.maMean.update(bar.close_price)
 
         self.bufferCount += 1
         if self.bufferCount < self.bufferSize:
             return
 
         # 计算指标数值
-        self.bollMid = talib.MA(self.closeArray, self.bollLength)[-1]
-        self.bollStd = talib.STDDEV(self.closeArray, self.bollLength)[-1]
+        self.bollMid = bollMid
+        self.bollStd = bollStd
         self.entryUp = self.bollMid + self.bollStd * self.entryDev
         self.exitUp = self.bollMid + self.bollStd * self.exitDev
 
         # ZL: 快速均线
-        maArray = talib.MA(self.closeArray, self.maLength)
-        self.maFilter = maArray[-1]
-        self.maFilter1 = maArray[-2]
+        self.maFilter = maFilter
+        self.maFilter1 = maFilter1
 
         # 判断是否要进行交易
 
@@ -9,6 +9,8 @@ from vnpy.app.cta_strategy import (
     ArrayManager
 )
 
+from ta.cache import bar_indicator, BarCursor, SeriesCursor
+
 
 class DemoStrategy(CtaTemplate):
     """演示用的简单双均线"""
@@ -33,6 +35,16 @@ class DemoStrategy(CtaTemplate):
         self.bg = BarGenerator(self.on_bar)
         # 时间序列容器：计算技术指标用
         self.am = ArrayManager()
+        # 从指标缓存读取的均线序列，调用use_indicator_cache后使用
+        self.fast_ma = None
+        self.slow_ma = None
+        self.bar_count = 0
+
+    def use_indicator_cache(self, cache, bar_file):
+        """ 改为按K线时间读取指标缓存中的均线序列（cache为None时一次性计算），随后推送的K线必须是bar_file中的K线 """
+        time = BarCursor(bar_file.time)
+        self.fast_ma = SeriesCursor(time, bar_indicator(cache, bar_file, 'mean', self.fast_window))
+        self.slow_ma = SeriesCursor(time, bar_indicator(cache, bar_file, 'mean', self.slow_window))
 
     def on_init(self):
         """ 当策略被初始化时调用该函数。"""
@@ -60,20 +72,28 @@ class DemoStrategy(CtaTemplate):
 
     def on_bar(self, bar: BarData):
         """ 通过该函数收到新的1分钟K线推送。 """
-        am = self.am  # just for saving typing self.
-        # 更新K线到时间序列容器中
-        am.update_bar(bar)
-        # 若缓存的K线数量尚不够计算技术指标，则直接返回
-        if not am.inited:
-            return
-        # 计算快速均线
-        fast_ma = am.sma(self.fast_window, array=True)
-        self.fast_ma_t = fast_ma[-1]  # T时刻数值
-        self.fast_ma_t_minus_1 = fast_ma[-2]  # T-1时刻数值
-        # 计算慢速均线
-        slow_ma = am.sma(self.slow_window, array=True)
-        self.slow_ma_t = slow_ma[-1]
-        self.slow_ma_t_minus_1 = slow_ma[-2]
+        if self.fast_ma is not None:
+            # 从缓存的序列读取均线，与ArrayManager相同，收到am.size根K线后开始判断
+            self.bar_count += 1
+            self.fast_ma_t_minus_1, self.fast_ma_t = self.fast_ma_t, self.fast_ma.seek(bar.datetime)
+            self.slow_ma_t_minus_1, self.slow_ma_t = self.slow_ma_t, self.slow_ma.seek(bar.datetime)
+            if self.bar_count < self.am.size:
+                return
+        else:
+            am = self.am  # just for saving typing self.
+            # 更新K线到时间序列容器中
+            am.update_bar(bar)
+            # 若缓存的K线数量尚不够计算技术指标，则直接返回
+            if not am.inited:
+                return
+            # 计算快速均线
+            fast_ma = am.sma(self.fast_window, array=True)
+            self.fast_ma_t = fast_ma[-1]  # T时刻数值
+            self.fast_ma_t_minus_1 = fast_ma[-2]  # T-1时刻数值
+            # 计算慢速均线
+            slow_ma = am.sma(self.slow_window, array=True)
+            self.slow_ma_t = slow_ma[-1]
+            self.slow_ma_t_minus_1 = slow_ma[-2]
         # 判断是否金叉
         cross_over = (self.fast_ma_t > self.slow_ma_t and
                       self.fast_ma_t_minus_1 < self.slow_ma_t_minus_1)
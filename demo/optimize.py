@@ -0,0 +1,245 @@
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+
+from demo.bollinger_bot_strategy import BollingerBotStrategy
+from ta.statistics import calculate_statistics, mark_to_market
+from ta.turtle.ledger import FillLedger, LONG, SHORT, OPEN, CLOSE
+from ta.walk_forward import walk_forward
+
+# BollingerBotStrategy参数优化
+#
+# 7个参数的完整网格太大，这里提供两种只评估部分组合的方法：
+# - 逐级减半（successive halving）：随机抽取一批参数，先在较短的历史上回测，每一级保留最好的一部分，
+#   同时加长回测区间，最后只有少数参数跑完整段历史。
+# - 遗传算法：锦标赛选择、均匀交叉和随机变异，保留每代最优的个体。
+# 两种方法都按(参数, 回测区间)缓存适应度，同一组合不会重复回测；回测在进程池中并行执行，
+# 进程池在优化器的整个生命周期内只创建一次，各级/各代复用同一批工作进程。
+
+# 默认的参数取值范围
+PARAMETER_SPACE = {
+    'bollLength': [18, 20, 24, 28, 32, 36, 40],
+    'entryDev': [2.0, 2.4, 2.8, 3.2, 3.6],
+    'exitDev': [0.8, 1.0, 1.2, 1.4, 1.6],
+    'trailingPrcnt': [0.2, 0.3, 0.4, 0.5, 0.6, 0.8],
+    'maLength': [5, 10, 15, 20],
+}
+
+# 回测设置，与bollinger_bot_strategy.py中的示例相同
+BACKTEST_SETTING = {
+    'vt_symbol': "CN50_USD.HUOBI",
+    'interval': "1m",
+    'start': datetime(2019, 1, 1),
+    'end': datetime(2019, 4, 30),
+    'rate': 0.3 / 10000,
+    'slippage': 0.2,
+    'size': 300,
+    'pricetick': 0.2,
+    'capital': 1_000_000,
+}
+
+
+def _backtest(setting, start, end, backtest_setting):
+    from vnpy.app.cta_strategy.backtesting import BacktestingEngine
+
+    engine = BacktestingEngine()
+    engine.set_parameters(**dict(backtest_setting, start=start, end=end))
+    engine.add_strategy(BollingerBotStrategy, setting)
+    engine.load_data()
+    engine.run_backtesting()
+    return engine
+
+
+def run_backtest(setting, start, end, target, backtest_setting=BACKTEST_SETTING):
+    """ 回测一组参数，返回目标统计指标的数值（在工作进程中执行） """
+    statistics = vnpy_statistics(_backtest(setting, start, end, backtest_setting))
+    return statistics.get(target, 0) or 0
+
+
+def run_backtest_daily(setting, start, end, backtest_setting=BACKTEST_SETTING):
+    """ 回测一组参数，返回统计指标和每日盈亏DataFrame（在工作进程中执行） """
+    engine = _backtest(setting, start, end, backtest_setting)
+    daily = vnpy_daily_pnl(engine)
+    return daily_statistics(daily, engine.capital), daily.to_dataframe()
+
+
+def vnpy_statistics(engine):
+    """ 由vnpy回测引擎的成交和K线，用ta.statistics向量化计算统计指标，代替逐日循环的calculate_result """
+    return daily_statistics(vnpy_daily_pnl(engine), engine.capital)
+
+
+def daily_statistics(daily, capital):
+    return calculate_statistics(daily.portfolio('net_pnl'), capital,
+                                [date.item() for date in daily.dates], daily.portfolio('commission'),
+                                daily.portfolio('slippage'), daily.portfolio('trade_count'))
+
+
+def vnpy_daily_pnl(engine):
+    """ vnpy回测引擎的每日盈亏（ta.statistics.DailyPnl） """
+    from vnpy.trader.constant import Direction, Offset
+
+    vt_symbol = engine.vt_symbol
+    ledger = FillLedger()
+    for trade in engine.trades.values():
+        ledger.add(trade.datetime, vt_symbol,
+                   LONG if trade.direction == Direction.LONG else SHORT,
+                   OPEN if trade.offset == Offset.OPEN else CLOSE, trade.price, trade.volume)
+
+    bars = engine.history_data
+    time = np.array([bar.datetime.replace(tzinfo=None) for bar in bars], dtype='datetime64[ns]')
+    close = np.array([bar.close_price for bar in bars])
+    return mark_to_market(ledger.records, ledger.symbol_list, {vt_symbol: (time, close)},
+                          {vt_symbol: engine.size}, {vt_symbol: engine.rate}, None,
+                          {vt_symbol: engine.slippage})
+
+
+class BollingerOptimizer:
+    """ 逐级减半/遗传算法参数优化器
+
+        executor: 外部传入的进程池，由调用方负责关闭；不传时在第一次回测时创建，close()或退出with时关闭
+    """
+
+    def __init__(self, space=None, target='sharpe_ratio', backtest_setting=None, max_workers=None,
+                 executor=None):
+        self.space = space or PARAMETER_SPACE
+        self.target = target  # 优化目标，越大越好
+        self.backtest_setting = backtest_setting or BACKTEST_SETTING
+        self.max_workers = max_workers
+        self.executor = executor
+        self.own_executor = executor is None
+        self.cache = {}  # (参数元组, 开始, 结束) -> 适应度
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """ 关闭自己创建的进程池 """
+        if self.own_executor and self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self.executor
+
+    def random_setting(self, rng):
+        return {name: rng.choice(values) for name, values in self.space.items()}
+
+    @staticmethod
+    def setting_key(setting):
+        return tuple(sorted(setting.items()))
+
+    def evaluate(self, setting_list, start, end):
+        """ 并行回测一批参数，已缓存的直接返回，结果与setting_list一一对应 """
+        keys = [(self.setting_key(setting), start, end) for setting in setting_list]
+        missing = {}
+        for key, setting in zip(keys, setting_list):
+            if key not in self.cache and key not in missing:
+                missing[key] = setting
+
+        if missing:
+            executor = self.get_executor()
+            futures = {key: executor.submit(run_backtest, setting, start, end, self.target,
+                                            self.backtest_setting)
+                       for key, setting in missing.items()}
+            for key, future in futures.items():
+                self.cache[key] = future.result()
+
+        return [self.cache[key] for key in keys]
+
+    def successive_halving(self, candidate_count=64, keep_ratio=0.5, stage_count=4, seed=None):
+        """ 逐级减半：第k级使用前(k+1)/stage_count的历史，每级保留keep_ratio的参数
+
+            返回按最后一级适应度排序的[(参数, 适应度)]
+        """
+        rng = random.Random(seed)
+        start = self.backtest_setting['start']
+        end = self.backtest_setting['end']
+
+        candidates = {}
+        for _ in range(candidate_count * 10):
+            setting = self.random_setting(rng)
+            candidates[self.setting_key(setting)] = setting
+            if len(candidates) >= candidate_count:
+                break
+        setting_list = list(candidates.values())
+
+        ranked = []
+        for stage in range(stage_count):
+            stage_end = start + (end - start) * (stage + 1) / stage_count
+            fitness_list = self.evaluate(setting_list, start, stage_end)
+            ranked = sorted(zip(setting_list, fitness_list), key=lambda item: item[1], reverse=True)
+            keep = max(1, int(len(ranked) * keep_ratio))
+            setting_list = [setting for setting, _ in ranked[:keep]]
+        return ranked
+
+    def genetic(self, population_size=32, generation_count=10, mutation_rate=0.2, elite_count=2,
+                tournament_size=3, seed=None):
+        """ 遗传算法：每代保留elite_count个最优个体，其余由锦标赛选出的父母交叉、变异产生
+
+            返回最后一代按适应度排序的[(参数, 适应度)]
+        """
+        rng = random.Random(seed)
+        start = self.backtest_setting['start']
+        end = self.backtest_setting['end']
+
+        population = [self.random_setting(rng) for _ in range(population_size)]
+        ranked = []
+        for _ in range(generation_count):
+            fitness_list = self.evaluate(population, start, end)
+            ranked = sorted(zip(population, fitness_list), key=lambda item: item[1], reverse=True)
+
+            population = [setting for setting, _ in ranked[:elite_count]]
+            while len(population) < population_size:
+                father = self.select(ranked, tournament_size, rng)
+                mother = self.select(ranked, tournament_size, rng)
+                child = {name: rng.choice((father[name], mother[name])) for name in self.space}
+                for name, values in self.space.items():
+                    if rng.random() < mutation_rate:
+                        child[name] = rng.choice(values)
+                population.append(child)
+        return ranked
+
+    @staticmethod
+    def select(ranked, tournament_size, rng):
+        """ 锦标赛选择：随机抽取tournament_size个个体，取适应度最高的 """
+        contestants = rng.sample(ranked, min(tournament_size, len(ranked)))
+        return max(contestants, key=lambda item: item[1])[0]
+
+
+def walk_forward_bollinger(folds, space=None, target='sharpe_ratio', backtest_setting=None, max_workers=None,
+                           **halving):
+    """ 滚动前推检验：每折在样本内用逐级减半选出参数，样本外区间并行回测
+
+        folds: ta.walk_forward.split_folds的结果
+        halving: 传给successive_halving的参数
+        返回值同ta.walk_forward.stitch
+    """
+    backtest_setting = backtest_setting or BACKTEST_SETTING
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # 各折的样本内优化共用一个进程池
+        def select(train_start, train_end):
+            optimizer = BollingerOptimizer(space, target, dict(backtest_setting, start=train_start, end=train_end),
+                                           max_workers, executor)
+            setting, score = optimizer.successive_halving(**halving)[0]
+            return setting, score
+
+        return walk_forward(folds, select, partial(run_backtest_daily, backtest_setting=backtest_setting),
+                            backtest_setting['capital'], max_workers)
+
+
+if __name__ == "__main__":
+    import os
+    os.chdir('C:\\myproject\\vn_trader_pro_workspace')
+
+    with BollingerOptimizer() as optimizer:
+        for setting, fitness in optimizer.successive_halving(seed=0)[:5]:
+            print(fitness, setting)
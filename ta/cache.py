@@ -0,0 +1,222 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from data.resample import EPOCH
+from ta.indicator import rolling_max, rolling_min, atr, rolling_mean, rolling_std
+
+MAX_BYTES = 256 * 1024 * 1024  # 每个缓存在内存中保留的序列总字节数
+
+# 指标序列缓存
+#
+# 参数优化时各组参数大多只改变阈值或持仓上限，唐奇安通道、ATR、均线和布林带在同一段行情上反复重算。
+# IndicatorCache按 (数据指纹, 合约, 周期, 指标, 参数) 缓存整段指标序列：内存中按LRU保留最近使用的，
+# 指定目录时同时保存为.npy文件，其他进程或下一次运行直接映射读取。
+# 内存按字节数限制：一年的分钟线约37万根，每个float64序列约3MB，十年约30MB；从磁盘映射的序列由操作系统
+# 页缓存管理，不计入限制。每个进程各有一个缓存，并行优化的内存上限为 进程数 x max_bytes。
+# 数据指纹由BarFile.fingerprint()计算，K线数据变化后自动使用新的缓存。
+#
+# 事件驱动的策略通过SeriesCursor等对象读取缓存的序列，代替ta.indicator的流式指标：seek()按K线时间
+# 在序列的时间轴上定位，可以跳过K线或从中间开始；推送的K线不在序列中（不是计算序列的BarFile中的K线，
+# 或已超出序列末尾）时抛出CursorError，不会读到错位的值。
+
+
+def _high_max(bar_file, window):
+    return rolling_max(np.ascontiguousarray(bar_file.high), window)
+
+
+def _low_min(bar_file, window):
+    return rolling_min(np.ascontiguousarray(bar_file.low), window)
+
+
+def _atr(bar_file, window):
+    return atr(np.ascontiguousarray(bar_file.high), np.ascontiguousarray(bar_file.low),
+               np.ascontiguousarray(bar_file.close), window)
+
+
+def _close_mean(bar_file, window):
+    return rolling_mean(np.ascontiguousarray(bar_file.close), window)
+
+
+def _close_std(bar_file, window):
+    return rolling_std(np.ascontiguousarray(bar_file.close), window)
+
+
+# 指标名称 -> 计算函数(bar_file, *参数)
+INDICATORS = {
+    'max': _high_max,  # 最高价滚动最大值（唐奇安上轨）
+    'min': _low_min,  # 最低价滚动最小值（唐奇安下轨）
+    'atr': _atr,
+    'mean': _close_mean,  # 收盘价均线
+    'std': _close_std,  # 收盘价标准差
+}
+
+
+class IndicatorCache:
+    """ 内存LRU + 磁盘.npy的指标序列缓存 """
+
+    def __init__(self, path=None, max_bytes=MAX_BYTES):
+        """ path为缓存目录（None时只缓存在内存中），max_bytes为内存中保留的序列总字节数（不含磁盘映射的序列） """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()  # 键 -> 序列
+        self.nbytes = 0  # 内存中序列的字节数
+        self.hits = 0
+        self.misses = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def make_key(fingerprint, symbol, timeframe, name, params):
+        return (fingerprint, symbol, timeframe, name, tuple(params))
+
+    def file_path(self, key):
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, name + '.npy')
+
+    def get(self, key, compute):
+        """ 读取缓存的序列，内存和磁盘中都没有时调用compute()计算并缓存 """
+        memory = self.memory
+        array = memory.get(key)
+        if array is not None:
+            memory.move_to_end(key)
+            self.hits += 1
+            return array
+
+        file_path = self.file_path(key) if self.path else None
+        if file_path and os.path.exists(file_path):
+            array = np.load(file_path, mmap_mode='r')
+            self.hits += 1
+        else:
+            array = compute()
+            self.misses += 1
+            if file_path:
+                # 先写临时文件再替换，并行的进程不会读到写了一半的文件
+                tmp_path = '{}.{}.tmp'.format(file_path, os.getpid())
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, array)
+                os.replace(tmp_path, file_path)
+
+        memory[key] = array
+        self.nbytes += self.size(array)
+        while self.nbytes > self.max_bytes and memory:
+            self.nbytes -= self.size(memory.popitem(last=False)[1])
+        return array
+
+    @staticmethod
+    def size(array):
+        """ 序列占用的进程内存，映射的文件不计 """
+        return 0 if isinstance(array, np.memmap) else array.nbytes
+
+    def indicator(self, bar_file, name, *params, timeframe=''):
+        """ bar_file上的指标序列，name为INDICATORS中的名称 """
+        key = self.make_key(bar_file.fingerprint(), bar_file.symbol, timeframe, name, params)
+        return self.get(key, lambda: INDICATORS[name](bar_file, *params))
+
+    def clear(self):
+        """ 清空内存中的缓存（不删除磁盘文件） """
+        self.memory.clear()
+        self.nbytes = 0
+
+
+def bar_indicator(cache, bar_file, name, *params, timeframe=''):
+    """ 有缓存时从缓存读取，否则直接计算 """
+    if cache is None:
+        return INDICATORS[name](bar_file, *params)
+    return cache.indicator(bar_file, name, *params, timeframe=timeframe)
+
+
+class CursorError(ValueError):
+    """ 推送的K线不在缓存序列的时间轴上，或超出了序列末尾 """
+
+
+def datetime_ns(dt):
+    """ K线时间 -> 纳秒时间戳；与BarAggregator相同，带时区的时间按其本地时间处理 """
+    if isinstance(dt, np.datetime64):
+        return int(dt.astype('datetime64[ns]').view('i8'))
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None)
+    delta = dt - EPOCH  # 逐根K线调用，避免timedelta的除法
+    return (delta.days * 86400 + delta.seconds) * 1000000000 + delta.microseconds * 1000
+
+
+class BarCursor:
+    """ 按K线时间定位预先计算的序列：seek(dt)通常只比较下一根，跳过或从中间开始时二分查找。
+        同一时间轴上的多个序列共用一个BarCursor，每根K线只定位一次 """
+
+    def __init__(self, time):
+        self.time = np.asarray(time, dtype='datetime64[ns]').view('i8')
+        self.index = -1
+        self.dt = None  # 上一次定位的K线时间
+
+    def seek(self, dt):
+        """ 定位到时间为dt的K线，返回其下标；序列中没有这根K线时抛出CursorError """
+        if dt is self.dt:
+            return self.index
+        t = datetime_ns(dt)
+        time = self.time
+        index = self.index + 1
+        if index >= len(time) or time[index] != t:
+            index = int(np.searchsorted(time, t))
+            if index >= len(time) or time[index] != t:
+                if not len(time) or t > time[-1]:
+                    raise CursorError('K线{}超出了缓存序列的末尾{}'.format(
+                        dt, np.datetime64(int(time[-1]), 'ns') if len(time) else '（序列为空）'))
+                raise CursorError('K线{}不在缓存的序列中，推送的K线须来自计算序列的同一个BarFile'.format(dt))
+        self.index = index
+        self.dt = dt
+        return index
+
+
+def _bar_cursor(time):
+    return time if isinstance(time, BarCursor) else BarCursor(time)
+
+
+class SeriesCursor:
+    """ 读取预先计算的序列，代替RollingMean、Atr：seek(K线时间)后value为该K线的值。
+        time为序列的时间数组或共用的BarCursor """
+
+    def __init__(self, time, array):
+        self.cursor = _bar_cursor(time)
+        self.array = array
+        self.value = np.nan
+
+    def seek(self, dt):
+        self.value = float(self.array[self.cursor.seek(dt)])
+        return self.value
+
+
+class DonchianCursor:
+    """ 代替Donchian的序列读取，seek()返回(上轨, 下轨) """
+
+    def __init__(self, time, up_array, down_array):
+        self.cursor = _bar_cursor(time)
+        self.up_array = up_array
+        self.down_array = down_array
+        self.up = np.nan
+        self.down = np.nan
+
+    def seek(self, dt):
+        index = self.cursor.seek(dt)
+        self.up = float(self.up_array[index])
+        self.down = float(self.down_array[index])
+        return self.up, self.down
+
+
+class StdCursor:
+    """ 代替RollingStd的序列读取，seek()返回(均值, 标准差) """
+
+    def __init__(self, time, mean_array, std_array):
+        self.cursor = _bar_cursor(time)
+        self.mean_array = mean_array
+        self.std_array = std_array
+        self.mean = np.nan
+        self.std = np.nan
+
+    def seek(self, dt):
+        index = self.cursor.seek(dt)
+        self.mean = float(self.mean_array[index])
+        self.std = float(self.std_array[index])
+        return self.mean, self.std
@@ -0,0 +1,150 @@
+import numpy as np
+
+# 滚动收益率相关性与品种分组
+#
+# RollingCorrelation用环形缓冲区保存最近window期的收益率向量，同时维护各品种收益率之和与两两乘积之和，
+# 每期只加入新的外积、减去移出的外积，n个品种的更新为O(n^2)（34个品种约一千次乘加），不重新扫描窗口。
+# CorrelationGroups按日汇总各品种收盘价，每隔interval期按相关系数阈值重新聚类：
+# 相关系数不低于阈值的品种相连，连通的品种为一组（单链接）。高阈值得到高度关联组，低阈值得到松散关联组，
+# 结果以 品种 -> 组名 字典发布给海龟组合的ExposureTracker。只考虑正相关，负相关品种同向持仓并不叠加风险。
+
+
+class RollingCorrelation:
+    """ 多个品种收益率的滚动协方差和相关系数，每期O(n^2)增量更新 """
+
+    RESYNC = 1000  # 每更新这么多次用缓冲区重新求和，消除累计的浮点误差
+
+    def __init__(self, size, window):
+        """ size为品种数，window为滚动期数 """
+        self.size = size
+        self.window = window
+        self.buffer = np.zeros((window, size))
+        self.index = 0
+        self.count = 0
+        self.total = np.zeros(size)  # 收益率之和
+        self.cross = np.zeros((size, size))  # 两两乘积之和
+
+    @property
+    def inited(self):
+        return self.count >= self.window
+
+    def update(self, returns):
+        """ 加入一期收益率向量，nan按0处理 """
+        returns = np.nan_to_num(np.asarray(returns, dtype=np.float64))
+        old = self.buffer[self.index]
+        self.count += 1
+        if self.count % self.RESYNC == 0:
+            self.buffer[self.index] = returns
+            self.total = self.buffer.sum(axis=0)
+            self.cross = self.buffer.T @ self.buffer
+        else:
+            self.total += returns - old
+            self.cross += np.outer(returns, returns) - np.outer(old, old)
+            self.buffer[self.index] = returns
+        self.index = (self.index + 1) % self.window
+
+    def covariance(self):
+        count = min(self.count, self.window)
+        if not count:
+            return np.full((self.size, self.size), np.nan)
+        mean = self.total / count
+        return self.cross / count - np.outer(mean, mean)
+
+    def correlation(self):
+        """ 相关系数矩阵，波动为0的品种与其他品种的相关系数为0 """
+        covariance = self.covariance()
+        std = np.sqrt(np.clip(np.diag(covariance), 0, None))
+        scale = np.outer(std, std)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = np.where(scale > 0, covariance / scale, 0.0)
+        np.fill_diagonal(correlation, 1.0)
+        return correlation
+
+
+def threshold_groups(correlation, symbols, threshold):
+    """ 相关系数不低于threshold的品种相连，返回 品种 -> 组名（组内第一个品种）；单独的品种不分组 """
+    n = len(symbols)
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows, columns = np.nonzero(np.triu(correlation >= threshold, 1))
+    for i, j in zip(rows.tolist(), columns.tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    roots = [find(i) for i in range(n)]
+    sizes = np.bincount(roots, minlength=n)
+    return {symbols[i]: symbols[root] for i, root in enumerate(roots) if sizes[root] > 1}
+
+
+class CorrelationGroups:
+    """ 按日汇总收盘价、滚动计算相关性并定期重新分组 """
+
+    def __init__(self, symbols, window=60, high_threshold=0.7, loose_threshold=0.4, interval=20,
+                 on_groups=None):
+        """
+        symbols: 品种列表
+        window: 计算相关性的日收益率个数
+        high_threshold/loose_threshold: 高度/松散关联的相关系数阈值
+        interval: 每隔多少日重新分组
+        on_groups: 分组更新后的回调 on_groups(group_dict, loose_group_dict)
+        """
+        self.symbols = list(symbols)
+        self.index_dict = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.high_threshold = high_threshold
+        self.loose_threshold = loose_threshold
+        self.interval = interval
+        self.on_groups = on_groups
+
+        self.rolling = RollingCorrelation(len(self.symbols), window)
+        self.close = np.full(len(self.symbols), np.nan)  # 各品种最新收盘价
+        self.previous_close = None  # 上一日各品种收盘价
+        self.current_date = None
+        self.day_count = 0
+
+        self.group_dict = {}  # 品种 -> 高度关联组
+        self.loose_group_dict = {}  # 品种 -> 松散关联组
+
+    def update_bar(self, vt_symbol, dt, close):
+        """ 推送一根K线，日期变化时把上一日收盘价计入相关性 """
+        date = dt.date()
+        if date != self.current_date:
+            if self.current_date is not None:
+                self.update_day()
+            self.current_date = date
+        i = self.index_dict.get(vt_symbol)
+        if i is not None:
+            self.close[i] = close
+
+    def update_close(self, close_dict):
+        """ 直接推送一日各品种的收盘价 """
+        for vt_symbol, close in close_dict.items():
+            i = self.index_dict.get(vt_symbol)
+            if i is not None:
+                self.close[i] = close
+        self.update_day()
+
+    def update_day(self):
+        close = self.close
+        if self.previous_close is not None:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                returns = np.log(close / self.previous_close)
+            self.rolling.update(returns)
+            self.day_count += 1
+            if self.rolling.inited and self.day_count % self.interval == 0:
+                self.cluster()
+        self.previous_close = close.copy()
+
+    def cluster(self):
+        """ 按当前相关系数重新分组并发布 """
+        correlation = self.rolling.correlation()
+        self.group_dict = threshold_groups(correlation, self.symbols, self.high_threshold)
+        self.loose_group_dict = threshold_groups(correlation, self.symbols, self.loose_threshold)
+        if self.on_groups:
+            self.on_groups(self.group_dict, self.loose_group_dict)
@@ -0,0 +1,227 @@
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 流式指标：每根K线O(1)更新，不保存K线数组，也不重复扫描窗口。
+# 同名的数组函数对整段序列一次性计算，结果与流式指标逐个相同（向量化回测使用）。
+
+
+class RollingMax:
+    """ 单调队列滚动最大值，窗口未满时为nan """
+
+    def __init__(self, window):
+        self.window = window
+        self.count = 0
+        self.queue = deque()  # (序号, 数值)，数值单调递减
+        self.value = np.nan
+
+    def update(self, value):
+        queue = self.queue
+        while queue and queue[-1][1] <= value:
+            queue.pop()
+        queue.append((self.count, value))
+        if queue[0][0] <= self.count - self.window:
+            queue.popleft()
+        self.count += 1
+        if self.count >= self.window:
+            self.value = queue[0][1]
+        return self.value
+
+
+class RollingMin:
+    """ 单调队列滚动最小值，窗口未满时为nan """
+
+    def __init__(self, window):
+        self.window = window
+        self.count = 0
+        self.queue = deque()  # (序号, 数值)，数值单调递增
+        self.value = np.nan
+
+    def update(self, value):
+        queue = self.queue
+        while queue and queue[-1][1] >= value:
+            queue.pop()
+        queue.append((self.count, value))
+        if queue[0][0] <= self.count - self.window:
+            queue.popleft()
+        self.count += 1
+        if self.count >= self.window:
+            self.value = queue[0][1]
+        return self.value
+
+
+class Donchian:
+    """ 唐奇安通道：window周期最高价与最低价 """
+
+    def __init__(self, window):
+        self.window = window
+        self.up_max = RollingMax(window)
+        self.down_min = RollingMin(window)
+        self.up = np.nan
+        self.down = np.nan
+
+    def update(self, high, low):
+        self.up = self.up_max.update(high)
+        self.down = self.down_min.update(low)
+        return self.up, self.down
+
+
+class Atr:
+    """ Wilder平滑ATR：前window个真实波幅的均值做种子，之后 atr = (atr * (n - 1) + tr) / n，
+        与talib.ATR对完整序列的计算方式相同 """
+
+    def __init__(self, window):
+        self.window = window
+        self.count = 0  # 已计算的真实波幅个数
+        self.total = 0.0
+        self.previous_close = None
+        self.value = np.nan
+
+    def update(self, high, low, close):
+        previous_close = self.previous_close
+        self.previous_close = close
+        if previous_close is None:
+            return self.value
+
+        tr = max(high - low, abs(previous_close - high), abs(previous_close - low))
+        window = self.window
+        self.count += 1
+        if self.count < window:
+            self.total += tr
+        elif self.count == window:
+            self.total += tr
+            self.value = self.total / window
+        else:
+            self.value = (self.value * (window - 1) + tr) / window
+        return self.value
+
+
+def rolling_max(array, window):
+    """ 滚动最大值，与RollingMax及talib.MAX一致，前window-1个为nan """
+    result = np.full(len(array), np.nan)
+    if len(array) >= window:
+        result[window - 1:] = sliding_window_view(array, window).max(axis=1)
+    return result
+
+
+def rolling_min(array, window):
+    """ 滚动最小值，与RollingMin及talib.MIN一致，前window-1个为nan """
+    result = np.full(len(array), np.nan)
+    if len(array) >= window:
+        result[window - 1:] = sliding_window_view(array, window).min(axis=1)
+    return result
+
+
+def true_range(high, low, close):
+    """ 真实波幅，与talib.TRANGE一致，第一个为nan """
+    result = np.full(len(high), np.nan)
+    previous = close[:-1]
+    greatest = high[1:] - low[1:]
+    greatest = np.maximum(greatest, np.abs(previous - high[1:]))
+    greatest = np.maximum(greatest, np.abs(previous - low[1:]))
+    result[1:] = greatest
+    return result
+
+
+def atr(high, low, close, window):
+    """ 整段序列的Wilder平滑ATR，与Atr逐个相同。递推部分按标量顺序计算以保证结果一致。 """
+    result = np.full(len(high), np.nan)
+    if len(high) <= window:
+        return result
+    tr = true_range(high, low, close).tolist()
+
+    total = 0.0
+    for k in range(1, window + 1):
+        total += tr[k]
+    value = total / window
+    values = [value]
+    for k in range(window + 1, len(tr)):
+        value = (value * (window - 1) + tr[k]) / window
+        values.append(value)
+    result[window:] = values
+    return result
+
+
+class RollingMean:
+    """ 环形缓冲区滚动均值，每次更新只加入新值、减去移出的值，窗口未满时为nan """
+
+    RESYNC = 1000  # 每更新这么多次用缓冲区重新求和，消除累计的浮点误差
+
+    def __init__(self, window):
+        self.window = window
+        self.buffer = [0.0] * window
+        self.index = 0  # 下一个写入位置
+        self.count = 0
+        self.total = 0.0
+        self.value = np.nan
+
+    def update(self, value):
+        old = self.buffer[self.index]
+        self.buffer[self.index] = value
+        self.index = (self.index + 1) % self.window
+        self.count += 1
+
+        if self.count % self.RESYNC == 0:
+            self.total = sum(self.buffer)
+        else:
+            self.total += value - old
+        if self.count >= self.window:
+            self.value = self.total / self.window
+        return self.value
+
+
+class RollingStd:
+    """ 环形缓冲区滚动均值和标准差（总体标准差，与talib.STDDEV一致），窗口未满时为nan。
+        平方和以第一个数值为基准累计，避免价格较大时相减造成的精度损失。 """
+
+    RESYNC = 1000
+
+    def __init__(self, window):
+        self.window = window
+        self.buffer = [0.0] * window  # 减去基准后的数值
+        self.index = 0
+        self.count = 0
+        self.shift = None  # 基准
+        self.total = 0.0
+        self.total_square = 0.0
+        self.mean = np.nan
+        self.std = np.nan
+
+    def update(self, value):
+        if self.shift is None:
+            self.shift = value
+        value -= self.shift
+        old = self.buffer[self.index]
+        self.buffer[self.index] = value
+        self.index = (self.index + 1) % self.window
+        self.count += 1
+
+        if self.count % self.RESYNC == 0:
+            self.total = sum(self.buffer)
+            self.total_square = sum(x * x for x in self.buffer)
+        else:
+            self.total += value - old
+            self.total_square += value * value - old * old
+        if self.count >= self.window:
+            mean = self.total / self.window
+            variance = self.total_square / self.window - mean * mean
+            self.mean = mean + self.shift
+            self.std = variance ** 0.5 if variance > 0 else 0.0
+        return self.mean, self.std
+
+
+def rolling_mean(array, window):
+    """ 滚动均值，与RollingMean一致（浮点误差以内），前window-1个为nan """
+    result = np.full(len(array), np.nan)
+    if len(array) >= window:
+        result[window - 1:] = sliding_window_view(array, window).mean(axis=1)
+    return result
+
+
+def rolling_std(array, window):
+    """ 滚动总体标准差，与RollingStd一致（浮点误差以内），前window-1个为nan。同样减去第一个数值后计算。 """
+    result = np.full(len(array), np.nan)
+    if len(array) >= window:
+        result[window - 1:] = sliding_window_view(array - array[0], window).std(axis=1)
+    return result
@@ -0,0 +1,303 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 策略回调耗时统计
+#
+# LatencyMonitor把策略的回调（on_tick、on_bar、onFiveBar、new_signal等）和发单方法替换为计时的包装函数，
+# 耗时按 (策略, 回调) 记入对数-线性分桶的直方图（HDR Histogram的做法）：每个2的幂区间再等分SUB_BUCKETS份，
+# 相对误差不超过1/SUB_BUCKETS，记录一次只是一次整数运算和一次列表下标加一，内存固定。
+# 从入口回调（on_tick或on_bar）开始到发出委托的时间另记为“入口_to_order”。
+#
+# 开关通过替换方法实现：启用时把包装函数设为实例属性，关闭时删除实例属性，调用回到类上的原方法，
+# 关闭状态下没有任何额外判断。对象属性中保存的回调引用（如BarAggregator.on_bar）也一并替换和恢复。
+# 注意在启用之前已经取出的绑定方法（如回测引擎循环开始前取出的portfolio.on_bar）不受影响。
+#
+# snapshot()/report()导出统计结果，serve()在本地端口上提供 /latency（JSON）和 /latency.txt（文本）。
+
+SUB_BITS = 7
+SUB_BUCKETS = 1 << (SUB_BITS - 1)  # 每个2的幂区间的分桶数，相对误差约1.6%
+MAX_VALUE = 1 << 40  # 纳秒，约18分钟，更大的值计入最后一个桶
+BUCKET_COUNT = ((MAX_VALUE.bit_length() - SUB_BITS) << (SUB_BITS - 1)) + (1 << SUB_BITS)
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def bucket_index(value):
+    """ 纳秒数对应的桶序号：小于2^SUB_BITS的值每个值一个桶，之后每个2的幂区间SUB_BUCKETS个桶 """
+    shift = value.bit_length() - SUB_BITS
+    if shift <= 0:
+        return value
+    return (shift << (SUB_BITS - 1)) + (value >> shift)
+
+
+def bucket_value(index):
+    """ 桶的下限 """
+    if index < 1 << SUB_BITS:
+        return index
+    shift = (index >> (SUB_BITS - 1)) - 1
+    return (index - (shift << (SUB_BITS - 1))) << shift
+
+
+class LatencyHistogram:
+    """ 对数-线性分桶的耗时直方图（纳秒） """
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def record(self, value):
+        if value >= MAX_VALUE:
+            value = MAX_VALUE - 1
+        elif value < 0:
+            value = 0
+        shift = value.bit_length() - SUB_BITS
+        self.counts[(shift << (SUB_BITS - 1)) + (value >> shift) if shift > 0 else value] += 1
+        if not self.count or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def merge(self, other):
+        """ 合并另一个直方图（如多个进程的结果） """
+        if not other.count:
+            return
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.min = min(self.min, other.min) if self.count else other.min
+        self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+
+    def reset(self):
+        self.__init__()
+
+    def percentile(self, q):
+        """ 第q百分位的耗时，取所在桶的中点 """
+        if not self.count:
+            return 0
+        rank = max(self.count * q / 100, 1)
+        cumulative = 0
+        for index, count in enumerate(list(self.counts)):
+            cumulative += count
+            if count and cumulative >= rank:
+                low = bucket_value(index)
+                high = bucket_value(index + 1)
+                return min((low + high - 1) / 2, self.max)
+        return self.max
+
+    def snapshot(self):
+        """ 次数、平均、最小、最大和各百分位耗时（纳秒） """
+        result = {"count": self.count,
+                  "mean": self.total / self.count if self.count else 0,
+                  "min": self.min,
+                  "max": self.max}
+        for q in PERCENTILES:
+            result["p{:g}".format(q)] = self.percentile(q)
+        return result
+
+
+class _Target:
+    """ 被计时的对象及其替换下来的方法 """
+
+    def __init__(self, obj, strategy, callbacks, orders, entry):
+        self.obj = obj
+        self.strategy = strategy
+        self.callbacks = callbacks
+        self.orders = orders
+        self.entry = entry
+        self.entry_start = None  # 当前入口回调开始的时间
+        self.installed = []  # (持有者, 属性名, 原值或None)
+
+
+class LatencyMonitor:
+    """ 替换策略的回调和发单方法，按 (策略, 回调) 统计耗时 """
+
+    def __init__(self):
+        self.histogram_dict = {}  # (策略, 回调) -> LatencyHistogram
+        self.target_list = []
+        self.enabled = False
+        self.server = None
+
+    def histogram(self, strategy, name):
+        key = (strategy, name)
+        histogram = self.histogram_dict.get(key)
+        if histogram is None:
+            histogram = self.histogram_dict[key] = LatencyHistogram()
+        return histogram
+
+    def attach(self, obj, callbacks, orders=(), entry=None, strategy=None):
+        """
+        登记需要计时的对象
+
+        callbacks: 计时的回调方法名
+        orders: 发单方法名，除自身耗时外还记录从入口回调开始到发单的时间
+        entry: 入口回调名（如on_tick），须在callbacks中
+        strategy: 统计使用的策略名，默认为obj.strategy_name或类名
+        """
+        if strategy is None:
+            strategy = getattr(obj, 'strategy_name', None) or type(obj).__name__
+        target = _Target(obj, strategy, [name for name in callbacks if hasattr(obj, name)],
+                         [name for name in orders if hasattr(obj, name)], entry)
+        self.target_list.append(target)
+        if self.enabled:
+            self._install(target)
+        return target
+
+    def enable(self):
+        """ 开始计时 """
+        if not self.enabled:
+            self.enabled = True
+            for target in self.target_list:
+                self._install(target)
+
+    def disable(self):
+        """ 停止计时，恢复原方法，已有的统计保留 """
+        if self.enabled:
+            self.enabled = False
+            for target in self.target_list:
+                self._uninstall(target)
+
+    def reset(self):
+        for histogram in self.histogram_dict.values():
+            histogram.reset()
+
+    def _install(self, target):
+        obj = target.obj
+        for name in target.callbacks + target.orders:
+            original = getattr(obj, name)
+            if name in target.orders:
+                wrapper = self._timed_order(original, target, name)
+            else:
+                wrapper = self._timed(original, target, name)
+            # 实例属性覆盖类上的方法；对象属性中保存的同一回调（如BarAggregator.on_bar）一起替换
+            target.installed.append((obj, name, obj.__dict__.get(name)))
+            setattr(obj, name, wrapper)
+            for holder in list(vars(obj).values()):
+                holder_dict = getattr(holder, '__dict__', None)
+                if not holder_dict:
+                    continue
+                for attribute, value in list(holder_dict.items()):
+                    if callable(value) and value == original:
+                        target.installed.append((holder, attribute, value))
+                        setattr(holder, attribute, wrapper)
+
+    @staticmethod
+    def _uninstall(target):
+        for holder, attribute, value in reversed(target.installed):
+            if value is None:
+                holder.__dict__.pop(attribute, None)
+            else:
+                setattr(holder, attribute, value)
+        target.installed = []
+
+    def _timed(self, function, target, name):
+        histogram = self.histogram(target.strategy, name)
+        record = histogram.record
+        clock = time.perf_counter_ns
+        if name != target.entry:
+            def timed(*args, **kwargs):
+                start = clock()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    record(clock() - start)
+            return timed
+
+        def timed_entry(*args, **kwargs):
+            start = target.entry_start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                target.entry_start = None
+                record(clock() - start)
+        return timed_entry
+
+    def _timed_order(self, function, target, name):
+        record = self.histogram(target.strategy, name).record
+        record_latency = self.histogram(target.strategy, (target.entry or 'entry') + '_to_order').record
+        clock = time.perf_counter_ns
+
+        def timed_order(*args, **kwargs):
+            start = clock()
+            entry_start = target.entry_start
+            if entry_start is not None:
+                record_latency(start - entry_start)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(clock() - start)
+        return timed_order
+
+    def snapshot(self):
+        """ {策略: {回调: 统计}}，耗时单位为纳秒 """
+        result = {}
+        for (strategy, name), histogram in list(self.histogram_dict.items()):
+            result.setdefault(strategy, {})[name] = histogram.snapshot()
+        return result
+
+    def report(self):
+        """ 文本报告，耗时单位为微秒 """
+        lines = ['{:<24} {:<20} {:>10} {:>9} {:>9} {:>9} {:>9} {:>10}'.format(
+            'strategy', 'callback', 'count', 'mean', 'p50', 'p99', 'p99.9', 'max')]
+        for strategy, callbacks in sorted(self.snapshot().items()):
+            for name, stats in sorted(callbacks.items()):
+                lines.append('{:<24} {:<20} {:>10} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>10.2f}'.format(
+                    strategy, name, stats["count"], stats["mean"] / 1000, stats["p50"] / 1000,
+                    stats["p99"] / 1000, stats["p99.9"] / 1000, stats["max"] / 1000))
+        return '\n'.join(lines)
+
+    def serve(self, host='127.0.0.1', port=0):
+        """ 在后台线程提供 /latency（JSON）和 /latency.txt（文本），返回实际端口 """
+        monitor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.startswith('/latency.txt'):
+                    body, content_type = monitor.report(), 'text/plain; charset=utf-8'
+                elif self.path.startswith('/latency'):
+                    body, content_type = json.dumps(monitor.snapshot()), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_address[1]
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def attach_strategy(monitor, strategy, callbacks=('on_tick', 'on_bar', 'onFiveBar')):
+    """ 登记一个vnpy CTA策略：行情回调计时，从on_tick（没有时为on_bar）到send_order的时间 """
+    entry = 'on_tick' if 'on_tick' in callbacks else callbacks[0]
+    return monitor.attach(strategy, callbacks, orders=('send_order',), entry=entry)
+
+
+def attach_turtle(monitor, portfolio, strategy='turtle'):
+    """ 登记海龟组合及其全部信号：组合on_bar、new_signal和各信号的on_bar（记在“策略名.signal”下）计时，
+        以及从组合on_bar到send_order的时间 """
+    target = monitor.attach(portfolio, ('on_bar', 'new_signal'), orders=('send_order',), entry='on_bar',
+                            strategy=strategy)
+    for signal_list in portfolio.signal_dict.values():
+        for signal in signal_list:
+            monitor.attach(signal, ('on_bar',), strategy=strategy + '.signal')
+    return target
@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+
+# 回测盈亏与统计指标
+#
+# mark_to_market()用成交记录（ta.turtle.ledger.FillLedger的列）和各品种K线数组一次性计算每日盈亏：
+# 每日收盘价由searchsorted取当日最后一根K线，成交按日期用bincount汇总，持仓为成交净数量的累计和，
+# 全部品种、全部日期都是数组运算，没有逐日逐笔的Python循环。计算方法与BackTestingEngine.calculate_result相同。
+# calculate_statistics()由每日净盈亏计算收益、回撤、夏普等指标；RunningStatistics在回测过程中逐日增量更新同样的指标。
+
+ANNUAL_DAYS = 240  # 年化使用的交易日数
+DAY_NS = 86400 * 10 ** 9
+
+PNL_FIELDS = ('trade_count', 'trading_pnl', 'position_pnl', 'total_pnl', 'commission', 'slippage', 'net_pnl')
+
+
+class DailyPnl:
+    """ 每日盈亏表：各字段为 日期 x 品种 的二维数组 """
+
+    def __init__(self, dates, symbols, **fields):
+        self.dates = dates  # datetime64[D]
+        self.symbols = symbols
+        for name in PNL_FIELDS:
+            setattr(self, name, fields[name])
+
+    def portfolio(self, name):
+        """ 组合每日合计 """
+        return getattr(self, name).sum(axis=1)
+
+    def to_dataframe(self, vt_symbol=None):
+        """ 单品种或组合（vt_symbol为None）的每日盈亏 """
+        if vt_symbol is None:
+            data = {name: self.portfolio(name) for name in PNL_FIELDS}
+        else:
+            k = self.symbols.index(vt_symbol)
+            data = {name: getattr(self, name)[:, k] for name in PNL_FIELDS}
+        return pd.DataFrame(data, index=pd.Index(self.dates, name='date'))
+
+
+def mark_to_market(records, symbol_list, bar_dict, size_dict, variable_commission_dict=None,
+                   fixed_commission_dict=None, slippage_dict=None):
+    """
+    由成交记录计算每日盈亏
+
+    records: FillLedger.records（time, symbol, direction, price, volume列）
+    symbol_list: records中合约序号对应的vt_symbol
+    bar_dict: vt_symbol -> (时间数组datetime64[ns], 收盘价数组)，决定品种和日期
+    size_dict等: 合约大小和交易成本，缺省为0
+    """
+    variable_commission_dict = variable_commission_dict or {}
+    fixed_commission_dict = fixed_commission_dict or {}
+    slippage_dict = slippage_dict or {}
+    symbols = list(bar_dict)
+
+    time_list = [np.asarray(time, dtype='datetime64[ns]').view(np.int64) for time, _ in bar_dict.values()]
+    days = np.unique(np.concatenate([time // DAY_NS for time in time_list])) if time_list else np.empty(0, np.int64)
+    day_count = len(days)
+    fields = {name: np.zeros((day_count, len(symbols))) for name in PNL_FIELDS}
+
+    fill_symbol = np.asarray(records['symbol'])
+    fill_day = np.searchsorted(days, np.asarray(records['time']) // DAY_NS)
+    signed = np.asarray(records['direction'], dtype=np.float64) * records['volume']
+    ledger_index = {vt_symbol: i for i, vt_symbol in enumerate(symbol_list)}
+
+    for k, vt_symbol in enumerate(symbols):
+        time = time_list[k]
+        close = np.asarray(bar_dict[vt_symbol][1], dtype=np.float64)
+        size = size_dict.get(vt_symbol, 1)
+
+        # 每日收盘价：当日结束前最后一根K线，之前没有K线的日期为nan
+        last = np.searchsorted(time, (days + 1) * DAY_NS, 'left') - 1
+        day_close = np.where(last >= 0, close[np.maximum(last, 0)], np.nan)
+        valid = ~np.isnan(day_close)
+        previous_close = np.concatenate(([np.nan], day_close[:-1]))
+        previous_close = np.where(np.isnan(previous_close), day_close, previous_close)
+
+        mask = fill_symbol == ledger_index.get(vt_symbol, -1)
+        day = fill_day[mask]
+        volume = np.asarray(records['volume'][mask], dtype=np.float64)
+        price = np.asarray(records['price'][mask], dtype=np.float64)
+        net_volume = np.bincount(day, signed[mask], minlength=day_count)
+        net_value = np.bincount(day, signed[mask] * price, minlength=day_count)
+        turnover = np.bincount(day, volume * price, minlength=day_count) * size
+        total_volume = np.bincount(day, volume, minlength=day_count)
+
+        open_position = np.cumsum(net_volume) - net_volume
+        position_pnl = np.where(valid, open_position * (day_close - previous_close) * size, 0.0)
+        trading_pnl = np.where(valid, (net_volume * day_close - net_value) * size, 0.0)
+        commission = turnover * variable_commission_dict.get(vt_symbol, 0) + \
+            total_volume * fixed_commission_dict.get(vt_symbol, 0)
+        slippage = total_volume * slippage_dict.get(vt_symbol, 0) * size
+        total_pnl = trading_pnl + position_pnl
+
+        fields['trade_count'][:, k] = np.bincount(day, minlength=day_count)
+        fields['trading_pnl'][:, k] = trading_pnl
+        fields['position_pnl'][:, k] = position_pnl
+        fields['total_pnl'][:, k] = total_pnl
+        fields['commission'][:, k] = commission
+        fields['slippage'][:, k] = slippage
+        fields['net_pnl'][:, k] = total_pnl - commission - slippage
+
+    return DailyPnl(days.astype('datetime64[D]'), symbols, **fields)
+
+
+# calculate_statistics和RunningStatistics.result返回的统计指标
+STATISTICS_FIELDS = ("start_date", "end_date", "total_days", "capital", "end_balance", "total_net_pnl",
+                     "total_return", "annual_return", "max_drawdown", "max_ddpercent", "sharpe_ratio",
+                     "return_drawdown_ratio", "total_commission", "total_slippage", "total_trade_count")
+
+
+def calculate_statistics(net_pnl, capital, dates, commission=None, slippage=None, trade_count=None):
+    """ 由每日净盈亏计算回测统计指标，dates为对应的日期 """
+    net_pnl = np.asarray(net_pnl, dtype=np.float64)
+    if not len(net_pnl):
+        return {}
+    balance = capital + np.cumsum(net_pnl)
+    high_level = np.maximum.accumulate(np.concatenate(([capital], balance)))[1:]
+    drawdown = balance - high_level
+    previous = np.concatenate(([capital], balance[:-1]))
+    # 资金不为正时（如未设置组合市值）收益率记为0
+    daily_return = np.divide(net_pnl, previous, out=np.zeros_like(net_pnl), where=previous > 0)
+
+    total_days = len(net_pnl)
+    total_return = (balance[-1] / capital - 1) * 100 if capital > 0 else 0
+    annual_return = total_return / total_days * ANNUAL_DAYS
+    max_drawdown = drawdown.min()
+    ddpercent = np.divide(drawdown, high_level, out=np.zeros_like(drawdown), where=high_level > 0)
+    max_ddpercent = ddpercent.min() * 100
+    return_std = daily_return.std()
+    sharpe_ratio = daily_return.mean() / return_std * np.sqrt(ANNUAL_DAYS) if return_std else 0
+
+    return {
+        "start_date": dates[0],
+        "end_date": dates[-1],
+        "total_days": total_days,
+        "capital": capital,
+        "end_balance": balance[-1],
+        "total_net_pnl": net_pnl.sum(),
+        "total_return": total_return,
+        "annual_return": annual_return,
+        "max_drawdown": max_drawdown,
+        "max_ddpercent": max_ddpercent,
+        "sharpe_ratio": sharpe_ratio,
+        "return_drawdown_ratio": -total_return / max_ddpercent if max_ddpercent else 0,
+        "total_commission": np.sum(commission) if commission is not None else 0,
+        "total_slippage": np.sum(slippage) if slippage is not None else 0,
+        "total_trade_count": np.sum(trade_count) if trade_count is not None else 0,
+    }
+
+
+def symbol_statistics(daily, capital):
+    """ 各品种与组合的统计指标，每个品种按全部资金计算收益率 """
+    dates = [date.item() for date in daily.dates]
+    rows = {}
+    for k, vt_symbol in enumerate(daily.symbols):
+        rows[vt_symbol] = calculate_statistics(daily.net_pnl[:, k], capital, dates, daily.commission[:, k],
+                                               daily.slippage[:, k], daily.trade_count[:, k])
+    rows['portfolio'] = calculate_statistics(daily.portfolio('net_pnl'), capital, dates,
+                                             daily.portfolio('commission'), daily.portfolio('slippage'),
+                                             daily.portfolio('trade_count'))
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+class RunningStatistics:
+    """ 回测过程中逐日增量更新的统计指标，每日O(1)，结果与calculate_statistics相同（浮点误差以内） """
+
+    def __init__(self, capital):
+        self.capital = capital
+        self.balance = capital
+        self.high_level = capital
+        self.max_drawdown = 0
+        self.max_ddpercent = 0
+        self.total_days = 0
+        self.return_total = 0.0  # 日收益率之和
+        self.return_square = 0.0  # 日收益率平方和
+        self.total_net_pnl = 0
+        self.total_commission = 0
+        self.total_slippage = 0
+        self.total_trade_count = 0
+        self.start_date = None
+        self.end_date = None
+
+    def update(self, date, net_pnl, commission=0, slippage=0, trade_count=0):
+        """ 计入一日的组合盈亏 """
+        daily_return = net_pnl / self.balance if self.balance > 0 else 0
+        self.balance += net_pnl
+        self.high_level = max(self.high_level, self.balance)
+        drawdown = self.balance - self.high_level
+        self.max_drawdown = min(self.max_drawdown, drawdown)
+        if self.high_level > 0:
+            self.max_ddpercent = min(self.max_ddpercent, drawdown / self.high_level * 100)
+
+        self.total_days += 1
+        self.return_total += daily_return
+        self.return_square += daily_return * daily_return
+        self.total_net_pnl += net_pnl
+        self.total_commission += commission
+        self.total_slippage += slippage
+        self.total_trade_count += trade_count
+        if self.start_date is None:
+            self.start_date = date
+        self.end_date = date
+
+    def result(self):
+        """ 截至目前的统计指标，与calculate_statistics的结果字段相同 """
+        if not self.total_days:
+            return {}
+        total_days = self.total_days
+        total_return = (self.balance / self.capital - 1) * 100 if self.capital > 0 else 0
+        mean = self.return_total / total_days
+        variance = self.return_square / total_days - mean * mean
+        return_std = variance ** 0.5 if variance > 0 else 0
+        return {
+            "start_date": self.start_date,
+            "end_date": self.end_date,
+            "total_days": total_days,
+            "capital": self.capital,
+            "end_balance": self.balance,
+            "total_net_pnl": self.total_net_pnl,
+            "total_return": total_return,
+            "annual_return": total_return / total_days * ANNUAL_DAYS,
+            "max_drawdown": self.max_drawdown,
+            "max_ddpercent": self.max_ddpercent,
+            "sharpe_ratio": mean / return_std * np.sqrt(ANNUAL_DAYS) if return_std else 0,
+            "return_drawdown_ratio": -total_return / self.max_ddpercent if self.max_ddpercent else 0,
+            "total_commission": self.total_commission,
+            "total_slippage": self.total_slippage,
+            "total_trade_count": self.total_trade_count,
+        }
@@ -1,5 +1,113 @@
+import heapq
 from collections import OrderedDict, defaultdict
 
+from vnpy.trader.constant import Direction, Offset
+
+from data.bar_file import BarFile, bar_file_path
+from ta.statistics import calculate_statistics, mark_to_market, RunningStatistics
+from ta.turtle.ledger import FillLedger, LONG, SHORT, OPEN, CLOSE
+from ta.turtle.strategy import TurtlePortfolio
+
+
+class TradeData:
+    """ 回测成交记录 """
+    __slots__ = ('vt_symbol', 'direction', 'offset', 'price', 'volume', 'datetime')
+
+    def __init__(self, vt_symbol, direction, offset, price, volume, datetime):
+        self.vt_symbol = vt_symbol
+        self.direction = direction
+        self.offset = offset
+        self.price = price
+        self.volume = volume
+        self.datetime = datetime
+
+
+class DailyResult:
+    """ 单品种每日盈亏；成交只累计汇总量，不保存成交对象 """
+    __slots__ = ('vt_symbol', 'size', 'variable_commission', 'fixed_commission', 'slippage',
+                 'close_price', 'previous_close', 'trade_count', 'net_volume', 'net_value',
+                 'turnover', 'volume', 'open_position', 'close_position', 'trading_pnl', 'position_pnl',
+                 'total_pnl', 'commission', 'slippage_cost', 'net_pnl')
+
+    def __init__(self, vt_symbol, size, variable_commission, fixed_commission, slippage):
+        self.vt_symbol = vt_symbol
+        self.size = size  # 合约大小
+        self.variable_commission = variable_commission  # 变动手续费
+        self.fixed_commission = fixed_commission  # 固定手续费
+        self.slippage = slippage  # 单手滑点
+
+        self.close_price = 0
+        self.previous_close = 0
+        self.trade_count = 0
+        self.net_volume = 0  # 成交净数量（买入为正）
+        self.net_value = 0  # 成交净金额（按价格，不含合约大小）
+        self.turnover = 0  # 成交额
+        self.volume = 0  # 成交数量
+
+        self.open_position = 0  # 开盘时持仓
+        self.close_position = 0  # 收盘时持仓
+
+        self.trading_pnl = 0  # 交易盈亏
+        self.position_pnl = 0  # 持仓盈亏
+        self.total_pnl = 0  # 总盈亏
+
+        self.commission = 0  # 手续费
+        self.slippage_cost = 0  # 滑点
+        self.net_pnl = 0  # 净盈亏
+
+    def add_trade(self, direction, price, volume):
+        """ 累计一笔成交 """
+        side = 1 if direction == Direction.LONG else -1
+        self.trade_count += 1
+        self.net_volume += volume * side
+        self.net_value += volume * side * price
+        self.turnover += volume * price * self.size
+        self.volume += volume
+
+    def calculate_pnl(self, open_position, previous_close, close_price):
+        """ 计算当日持仓盈亏（隔夜持仓按收盘价盯市）和交易盈亏（成交价到收盘价），扣除手续费和滑点 """
+        self.open_position = open_position
+        self.previous_close = previous_close
+        self.close_price = close_price
+
+        self.position_pnl = open_position * (close_price - previous_close) * self.size
+        self.close_position = open_position + self.net_volume
+        self.trading_pnl = (self.net_volume * close_price - self.net_value) * self.size
+
+        self.commission = self.turnover * self.variable_commission + self.volume * self.fixed_commission
+        self.slippage_cost = self.volume * self.slippage * self.size
+
+        self.total_pnl = self.trading_pnl + self.position_pnl
+        self.net_pnl = self.total_pnl - self.commission - self.slippage_cost
+
+
+class PortfolioResult:
+    """ 组合每日盈亏 """
+
+    def __init__(self, date):
+        self.date = date
+        self.result_dict = OrderedDict()  # 各品种的DailyResult
+
+        self.trade_count = 0
+        self.trading_pnl = 0
+        self.position_pnl = 0
+        self.total_pnl = 0
+        self.commission = 0
+        self.slippage = 0
+        self.net_pnl = 0
+
+    def add_result(self, result):
+        self.result_dict[result.vt_symbol] = result
+
+        self.trade_count += result.trade_count
+        self.trading_pnl += result.trading_pnl
+        self.position_pnl += result.position_pnl
+        self.total_pnl += result.total_pnl
+        self.commission += result.commission
+        self.slippage += result.slippage_cost
+        self.net_pnl += result.net_pnl
+
+
 class BackTestingEngine:
     """组合类CTA策略回测引擎"""
 
@@ -21,7 +129,171 @@ class BackTestingEngine:
         self.current_dt = None
 
         self.data_dict = OrderedDict()
-        self.trade_dict = OrderedDict()
+        self.fill_ledger = FillLedger()  # 全部成交记录（列式）
+        self._trade_ledger = None  # trade_dict缓存对应的成交记录及已转换的成交数
+        self._trade_dict = OrderedDict()
+        self._trade_count = 0
 
         self.result = None
         self.result_list = []
+        self.running_statistics = None  # 逐日增量更新的统计指标
+
+        self.bar_dict = {}  # 各品种最新K线
+        self.close_dict = {}  # 各品种上一日收盘价
+        self.pos_dict = defaultdict(int)  # 各品种上一日收盘持仓
+        self.daily_dict = {}  # 当日各品种的DailyResult
+        self.current_date = None
+
+        self.indicator_cache = None  # ta.cache.IndicatorCache，设置后信号从缓存读取指标序列
+
+    def add_contract(self, vt_symbol, size, price_tick, variable_commission=0, fixed_commission=0,
+                     slippage=0):
+        """ 添加合约及其交易成本设置 """
+        self.vt_symbol_list.append(vt_symbol)
+        self.size_dict[vt_symbol] = size
+        self.price_tick_dict[vt_symbol] = price_tick
+        self.variable_commission_dict[vt_symbol] = variable_commission
+        self.fixed_commission_dict[vt_symbol] = fixed_commission
+        self.slippage_dict[vt_symbol] = slippage
+
+    def set_period(self, start_dt, end_dt):
+        """ 设置回测区间 """
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+
+    def load_data(self, data_path):
+        """ 映射各合约的二进制K线文件（numpy.memmap，不复制数据），按回测区间切片后缓存到data_dict """
+        for vt_symbol in self.vt_symbol_list:
+            bar_file = BarFile(bar_file_path(data_path, vt_symbol))
+            self.data_dict[vt_symbol] = bar_file.slice(self.start_dt, self.end_dt)
+
+    def init_portfolio(self, portfolio=None):
+        """ 创建海龟组合（默认参数），传入组合市值和合约大小 """
+        if portfolio is None:
+            portfolio = TurtlePortfolio(self)
+            portfolio.init(self.portfolio_value, self.vt_symbol_list, self.size_dict)
+        self.portfolio = portfolio
+
+    def run_backtesting(self):
+        """ 按时间戳堆归并所有品种的K线逐根回放；同一时间戳按vt_symbol_list的顺序推送。
+            日期切换时增量计算上一日的盈亏。 """
+        if self.portfolio is None:
+            self.init_portfolio()
+        if self.indicator_cache is not None:
+            for vt_symbol, signal_list in self.portfolio.signal_dict.items():
+                for signal in signal_list:
+                    signal.use_indicator_cache(self.indicator_cache, self.data_dict[vt_symbol])
+
+        streams = [self.data_dict[vt_symbol].iter_bars(vt_symbol) for vt_symbol in self.vt_symbol_list]
+        on_bar = self.portfolio.on_bar
+        bar_dict = self.bar_dict
+        current_date = self.current_date
+
+        for bar in heapq.merge(*streams, key=_bar_datetime):
+            dt = bar.datetime
+            if dt.date() != current_date:
+                if current_date is not None:
+                    self.calculate_result()
+                current_date = self.current_date = dt.date()
+            self.current_dt = dt
+            bar_dict[bar.vt_symbol] = bar
+            on_bar(bar)
+
+        if current_date is not None:
+            self.calculate_result()
+
+    def send_order(self, vt_symbol, direction, offset, price, volume):
+        """ 记录成交（由portfolio调用）：价格按最小价格变动取整后立即成交 """
+        if not volume:
+            return
+        price_tick = self.price_tick_dict[vt_symbol]
+        if price_tick:
+            price = int(round(price / price_tick, 0)) * price_tick
+
+        self.fill_ledger.add(self.current_dt, vt_symbol,
+                             LONG if direction == Direction.LONG else SHORT,
+                             OPEN if offset == Offset.OPEN else CLOSE, price, volume)
+        self.get_daily_result(vt_symbol).add_trade(direction, price, volume)
+
+    @property
+    def trade_dict(self):
+        """ 按成交时间分组的TradeData，由成交记录生成并缓存，只用于查看。
+            成交记录只追加，再次读取时只转换上次之后新增的成交 """
+        ledger = self.fill_ledger
+        if self._trade_ledger is not ledger:
+            self._trade_ledger = ledger
+            self._trade_dict = OrderedDict()
+            self._trade_count = 0
+        if self._trade_count < len(ledger):
+            trade_dict = self._trade_dict
+            records = ledger.records[self._trade_count:]
+            times = records['time'].view('datetime64[ns]').astype('datetime64[us]').tolist()
+            for dt, symbol, direction, offset, price, volume in zip(
+                    times, records['symbol'].tolist(), records['direction'].tolist(),
+                    records['offset'].tolist(), records['price'].tolist(), records['volume'].tolist()):
+                trade = TradeData(ledger.symbol_list[symbol],
+                                  Direction.LONG if direction == LONG else Direction.SHORT,
+                                  Offset.OPEN if offset == OPEN else Offset.CLOSE,
+                                  price, volume, dt)
+                trade_dict.setdefault(dt, []).append(trade)
+            self._trade_count = len(ledger)
+        return self._trade_dict
+
+    def get_daily_result(self, vt_symbol):
+        """ 获取当日某品种的DailyResult，没有则新建 """
+        result = self.daily_dict.get(vt_symbol)
+        if result is None:
+            result = DailyResult(vt_symbol,
+                                 self.size_dict[vt_symbol],
+                                 self.variable_commission_dict[vt_symbol],
+                                 self.fixed_commission_dict[vt_symbol],
+                                 self.slippage_dict[vt_symbol])
+            self.daily_dict[vt_symbol] = result
+        return result
+
+    def calculate_result(self):
+        """ 计算当前日期的组合盈亏，用各品种最新K线收盘价盯市，缓存到result_list """
+        self.result = PortfolioResult(self.current_date)
+
+        for vt_symbol in self.vt_symbol_list:
+            bar = self.bar_dict.get(vt_symbol)
+            if bar is None:
+                continue
+            close_price = bar.close
+            previous_close = self.close_dict.get(vt_symbol, close_price)
+
+            result = self.get_daily_result(vt_symbol)
+            result.calculate_pnl(self.pos_dict[vt_symbol], previous_close, close_price)
+            self.result.add_result(result)
+
+            self.close_dict[vt_symbol] = close_price
+            self.pos_dict[vt_symbol] = result.close_position
+
+        self.result_list.append(self.result)
+        self.daily_dict = {}
+
+        if self.running_statistics is None:
+            self.running_statistics = RunningStatistics(self.portfolio_value)
+        result = self.result
+        self.running_statistics.update(result.date, result.net_pnl, result.commission, result.slippage,
+                                       result.trade_count)
+
+    def calculate_statistics(self):
+        """ 根据每日组合盈亏计算回测统计指标 """
+        result_list = self.result_list
+        return calculate_statistics([result.net_pnl for result in result_list], self.portfolio_value,
+                                    [result.date for result in result_list],
+                                    [result.commission for result in result_list],
+                                    [result.slippage for result in result_list],
+                                    [result.trade_count for result in result_list])
+
+    def calculate_daily_pnl(self):
+        """ 由成交记录和K线数组一次性向量化计算各品种每日盈亏（ta.statistics.DailyPnl），与逐日计算的结果相同 """
+        bar_dict = OrderedDict((vt_symbol, (self.data_dict[vt_symbol].time, self.data_dict[vt_symbol].close))
+                               for vt_symbol in self.vt_symbol_list)
+        return mark_to_market(self.fill_ledger.records, self.fill_ledger.symbol_list, bar_dict, self.size_dict,
+                              self.variable_commission_dict, self.fixed_commission_dict, self.slippage_dict)
+
+
+def _bar_datetime(bar):
+    return bar.datetime
@@ -0,0 +1,111 @@
+from collections import defaultdict
+
+# 海龟组合的单位头寸统计
+#
+# 原版海龟策略的4个维度的单位头寸限制：
+#   单个市场：头寸上限是4个
+#   高度关联的多个市场：单个方向头寸单位不超过6个
+#   松散关联的多个市场：某一个方向上的头寸单位不超过10个
+#   单个方向：头寸单位总数有上限
+#
+# ExposureTracker在每次成交时只按成交品种的持仓变化增减品种、关联组和方向的合计，
+# 不遍历全部品种，检查开仓是否超限也是O(1)，品种数量再多也不增加每笔委托的开销。
+# 没有分组的品种不受关联组限制。
+
+
+def _long_part(unit):
+    return unit if unit > 0 else 0
+
+
+def _short_part(unit):
+    return unit if unit < 0 else 0
+
+
+class ExposureTracker:
+    """ 按品种、高度关联组、松散关联组和方向增量统计单位头寸（多头为正，空头为负） """
+
+    def __init__(self, max_product_pos, max_correlated_pos, max_loose_pos, max_direction_pos,
+                 group_dict=None, loose_group_dict=None):
+        """ group_dict/loose_group_dict为 品种 -> 高度/松散关联组名 """
+        self.max_product_pos = max_product_pos  # 单品种最大持仓
+        self.max_correlated_pos = max_correlated_pos  # 高度关联组单方向最大持仓
+        self.max_loose_pos = max_loose_pos  # 松散关联组单方向最大持仓
+        self.max_direction_pos = max_direction_pos  # 单方向最大持仓
+
+        self.unit_dict = defaultdict(int)  # 品种 -> 持仓
+        self.group_dict = dict(group_dict or {})
+        self.loose_group_dict = dict(loose_group_dict or {})
+
+        self.group_long = defaultdict(int)  # 高度关联组 -> 多头合计
+        self.group_short = defaultdict(int)  # 高度关联组 -> 空头合计（负数）
+        self.loose_long = defaultdict(int)
+        self.loose_short = defaultdict(int)
+        self.total_long = 0  # 总的多头持仓
+        self.total_short = 0  # 总的空头持仓（负数）
+
+    def update(self, vt_symbol, change):
+        """ 成交后更新，change为持仓变化（买入为正，卖出为负） """
+        old = self.unit_dict[vt_symbol]
+        new = old + change
+        self.unit_dict[vt_symbol] = new
+
+        long_change = _long_part(new) - _long_part(old)
+        short_change = _short_part(new) - _short_part(old)
+        self.total_long += long_change
+        self.total_short += short_change
+
+        group = self.group_dict.get(vt_symbol)
+        if group is not None:
+            self.group_long[group] += long_change
+            self.group_short[group] += short_change
+        loose_group = self.loose_group_dict.get(vt_symbol)
+        if loose_group is not None:
+            self.loose_long[loose_group] += long_change
+            self.loose_short[loose_group] += short_change
+
+    def can_open(self, vt_symbol, side):
+        """ 检查再开1个单位是否超过任一维度的上限，side为1（多）或-1（空） """
+        unit = self.unit_dict[vt_symbol]
+        group = self.group_dict.get(vt_symbol)
+        loose_group = self.loose_group_dict.get(vt_symbol)
+
+        if side > 0:
+            if self.total_long >= self.max_direction_pos:
+                return False
+            if unit >= self.max_product_pos:
+                return False
+            if group is not None and self.group_long[group] >= self.max_correlated_pos:
+                return False
+            if loose_group is not None and self.loose_long[loose_group] >= self.max_loose_pos:
+                return False
+        else:
+            if self.total_short <= -self.max_direction_pos:
+                return False
+            if unit <= -self.max_product_pos:
+                return False
+            if group is not None and self.group_short[group] <= -self.max_correlated_pos:
+                return False
+            if loose_group is not None and self.loose_short[loose_group] <= -self.max_loose_pos:
+                return False
+        return True
+
+    def set_groups(self, group_dict=None, loose_group_dict=None):
+        """ 更换分组（例如按相关性重新聚类后），按当前持仓重新计算各组合计。只在分组变化时调用。 """
+        if group_dict is not None:
+            self.group_dict = dict(group_dict)
+        if loose_group_dict is not None:
+            self.loose_group_dict = dict(loose_group_dict)
+
+        self.group_long.clear()
+        self.group_short.clear()
+        self.loose_long.clear()
+        self.loose_short.clear()
+        for vt_symbol, unit in self.unit_dict.items():
+            group = self.group_dict.get(vt_symbol)
+            if group is not None:
+                self.group_long[group] += _long_part(unit)
+                self.group_short[group] += _short_part(unit)
+            loose_group = self.loose_group_dict.get(vt_symbol)
+            if loose_group is not None:
+                self.loose_long[loose_group] += _long_part(unit)
+                self.loose_short[loose_group] += _short_part(unit)
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# 列式成交记录
+#
+# 多年的分钟线回测和参数优化会产生大量交易，每笔交易一个带__dict__的对象要占几百字节。
+# 这里把记录按列保存在一个numpy结构化数组中（容量不足时翻倍），每笔只占几十字节，
+# 最后一笔通过下标O(1)读取，需要分析时再整体导出为DataFrame。
+
+EPOCH = datetime(1970, 1, 1)
+INITIAL_CAPACITY = 16
+
+LONG = 1
+SHORT = -1
+OPEN = 0
+CLOSE = 1
+
+
+def to_ns(dt):
+    """ datetime转为1970-01-01起的纳秒数（按墙上时间，忽略时区），None为0 """
+    if dt is None:
+        return 0
+    return (dt.replace(tzinfo=None) - EPOCH) // timedelta(microseconds=1) * 1000
+
+
+class ColumnLedger:
+    """ 按行追加、按列保存的记录，dtype为numpy结构化类型 """
+
+    dtype = None
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.data = np.empty(capacity, dtype=self.dtype)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, *values):
+        if self.count == len(self.data):
+            data = np.empty(max(INITIAL_CAPACITY, len(self.data) * 2), dtype=self.dtype)
+            data[:self.count] = self.data[:self.count]
+            self.data = data
+        self.data[self.count] = values
+        self.count += 1
+
+    @property
+    def records(self):
+        """ 已记录部分的视图 """
+        return self.data[:self.count]
+
+    def to_dataframe(self):
+        df = pd.DataFrame(self.records)
+        for name in self.dtype.names:
+            if name.endswith('time'):
+                df[name] = df[name].values.view('datetime64[ns]')
+        return df
+
+
+class TradeLedger(ColumnLedger):
+    """ 信号的开平仓交易记录：开仓时间、平仓时间、开仓均价、平仓价、单位头寸（空头为负）、盈亏 """
+
+    dtype = np.dtype([('open_time', '<i8'),
+                      ('close_time', '<i8'),
+                      ('entry', '<f8'),
+                      ('exit', '<f8'),
+                      ('unit', '<i8'),
+                      ('pnl', '<f8')])
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        super().__init__(capacity)
+        self.last_pnl = 0  # 上一笔交易的盈亏
+
+    def add(self, result, open_dt=None, close_dt=None):
+        """ 记录一笔已平仓的TurtleResult """
+        self.append(to_ns(open_dt), to_ns(close_dt), result.entry, result.exit, result.unit, result.pnl)
+        self.last_pnl = result.pnl
+
+
+class FillLedger(ColumnLedger):
+    """ 回测引擎的成交记录：时间、合约序号、方向（1多/-1空）、开平（0开/1平）、价格、数量 """
+
+    dtype = np.dtype([('time', '<i8'),
+                      ('symbol', '<i4'),
+                      ('direction', '<i1'),
+                      ('offset', '<i1'),
+                      ('price', '<f8'),
+                      ('volume', '<f8')])
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        super().__init__(capacity)
+        self.symbol_list = []  # 合约序号 -> vt_symbol
+        self.symbol_dict = {}  # vt_symbol -> 合约序号
+
+    def symbol_index(self, vt_symbol):
+        index = self.symbol_dict.get(vt_symbol)
+        if index is None:
+            index = self.symbol_dict[vt_symbol] = len(self.symbol_list)
+            self.symbol_list.append(vt_symbol)
+        return index
+
+    def add(self, dt, vt_symbol, direction, offset, price, volume):
+        """ direction/offset为LONG/SHORT和OPEN/CLOSE """
+        self.append(to_ns(dt), self.symbol_index(vt_symbol), direction, offset, price, volume)
+
+    def to_dataframe(self):
+        df = super().to_dataframe()
+        df['symbol'] = np.array(self.symbol_list, dtype=object)[df['symbol'].values]
+        return df.rename(columns={'symbol': 'vt_symbol', 'time': 'datetime'})
@@ -0,0 +1,169 @@
+import csv
+import itertools
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from ta.cache import IndicatorCache
+from ta.statistics import STATISTICS_FIELDS
+from ta.turtle.strategy import (TurtlePortfolio, SIGNAL_PARAMS, MAX_PRODUCT_POS, MAX_DIRECTION_POS,
+                                MAX_CORRELATED_POS, MAX_LOOSE_POS)
+from ta.turtle.vector import VectorBackTestingEngine
+
+# 海龟组合参数优化
+#
+# 每组参数对应一次向量化回测。行情数据是data.bar_file的二进制K线文件：每个工作进程只在初始化时
+# 映射一次（numpy.memmap，只读），所有进程共享操作系统页缓存中的同一份数据，不复制也不序列化传递。
+# 每个工作进程持有一个IndicatorCache，相同周期的通道和ATR序列只计算一次；指定cache_path时序列同时
+# 保存到磁盘，各进程以及之后的优化共用。
+# 每完成一组参数，结果立即追加到结果文件，最后按指定的统计指标排序返回。
+
+# 默认参数，与SIGNAL_PARAMS和模块常量一致
+DEFAULT_SETTING = {
+    "short_entry_window": SIGNAL_PARAMS[0][0],
+    "short_exit_window": SIGNAL_PARAMS[0][1],
+    "long_entry_window": SIGNAL_PARAMS[1][0],
+    "long_exit_window": SIGNAL_PARAMS[1][1],
+    "atr_window": SIGNAL_PARAMS[0][2],
+    "max_product_pos": MAX_PRODUCT_POS,
+    "max_direction_pos": MAX_DIRECTION_POS,
+    "max_correlated_pos": MAX_CORRELATED_POS,
+    "max_loose_pos": MAX_LOOSE_POS,
+}
+
+
+def make_portfolio(engine, setting):
+    """ 按参数设置创建海龟组合：短周期信号检查上一笔盈利，长周期信号不检查 """
+    setting = dict(DEFAULT_SETTING, **setting)
+    signal_params = [
+        (setting["short_entry_window"], setting["short_exit_window"], setting["atr_window"], True),
+        (setting["long_entry_window"], setting["long_exit_window"], setting["atr_window"], False),
+    ]
+    portfolio = TurtlePortfolio(engine, signal_params, setting["max_product_pos"],
+                                setting["max_direction_pos"], setting["max_correlated_pos"],
+                                setting["max_loose_pos"], setting.get("group_dict"),
+                                setting.get("loose_group_dict"))
+    portfolio.init(engine.portfolio_value, engine.vt_symbol_list, engine.size_dict)
+    return portfolio
+
+
+def grid_settings(space):
+    """ 网格搜索：space为 参数名 -> 取值列表，返回所有组合 """
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def random_settings(space, count, seed=None):
+    """ 随机搜索：从网格中不重复地抽取count组参数 """
+    settings = grid_settings(space)
+    if count >= len(settings):
+        return settings
+    return random.Random(seed).sample(settings, count)
+
+
+# 工作进程中的回测引擎模板，只在进程初始化时创建一次
+_template = None
+
+
+def _init_worker(contract_list, data_path, start_dt, end_dt, portfolio_value, cache_path=None):
+    global _template
+    _template = create_engine(contract_list, data_path, start_dt, end_dt, portfolio_value)
+    _template.indicator_cache = IndicatorCache(cache_path)
+
+
+def create_engine(contract_list, data_path, start_dt, end_dt, portfolio_value, data_dict=None):
+    """ 创建向量化回测引擎；contract_list中每项为add_contract的参数元组。传入data_dict时直接复用已映射的数据 """
+    engine = VectorBackTestingEngine()
+    for contract in contract_list:
+        engine.add_contract(*contract)
+    engine.set_period(start_dt, end_dt)
+    engine.portfolio_value = portfolio_value
+    if data_dict is None:
+        engine.load_data(data_path)
+    else:
+        engine.data_dict.update(data_dict)
+    return engine
+
+
+def clone_engine(template, start_dt=None, end_dt=None):
+    """ 以模板的合约设置和已映射的数据创建新引擎；给出start_dt/end_dt时只取该区间的K线（memmap切片，不复制） """
+    engine = VectorBackTestingEngine()
+    engine.vt_symbol_list = template.vt_symbol_list
+    engine.size_dict = template.size_dict
+    engine.price_tick_dict = template.price_tick_dict
+    engine.variable_commission_dict = template.variable_commission_dict
+    engine.fixed_commission_dict = template.fixed_commission_dict
+    engine.slippage_dict = template.slippage_dict
+    engine.portfolio_value = template.portfolio_value
+    engine.indicator_cache = template.indicator_cache
+    if start_dt is None and end_dt is None:
+        engine.data_dict = template.data_dict
+    else:
+        engine.set_period(start_dt, end_dt)
+        for vt_symbol, bar_file in template.data_dict.items():
+            engine.data_dict[vt_symbol] = bar_file.slice(start_dt, end_dt)
+    return engine
+
+
+def evaluate(setting, start_dt=None, end_dt=None):
+    """ 在工作进程中回测一组参数，返回参数与统计指标 """
+    engine = clone_engine(_template, start_dt, end_dt)
+    engine.init_portfolio(make_portfolio(engine, setting))
+    engine.run_backtesting()
+    statistics = engine.calculate_statistics()
+    return dict(setting, **statistics)
+
+
+def evaluate_daily(setting, start_dt=None, end_dt=None):
+    """ 在工作进程中回测一组参数，返回统计指标和组合每日盈亏（DataFrame） """
+    engine = clone_engine(_template, start_dt, end_dt)
+    engine.init_portfolio(make_portfolio(engine, setting))
+    engine.run_backtesting()
+    return engine.calculate_statistics(), engine.calculate_daily_pnl().to_dataframe()
+
+
+def run_optimization(settings, contract_list, data_path, start_dt=None, end_dt=None,
+                     portfolio_value=1000000, sort_by=("sharpe_ratio",), result_path=None,
+                     max_workers=None, cache_path=None):
+    """ 使用进程池并行回测所有参数组合
+
+        settings: 参数设置列表（grid_settings或random_settings的结果）
+        contract_list: add_contract的参数元组列表
+        data_path: 二进制K线文件所在目录
+        sort_by: 排序使用的统计指标，按从大到小排列；结果中没有的指标不参与排序
+        result_path: 结果CSV文件，每完成一组立即追加一行；列为参数名和全部统计指标，没有结果的回测统计指标留空
+        cache_path: 指标缓存目录，None时只在各进程内存中缓存（每个进程最多ta.cache.MAX_BYTES）
+    """
+    rows = []
+    writer = None
+    result_file = None
+    if result_path:
+        result_file = open(result_path, 'a', newline='')
+        fieldnames = list(dict.fromkeys(name for setting in settings for name in setting))
+        fieldnames += [name for name in STATISTICS_FIELDS if name not in fieldnames]
+        writer = csv.DictWriter(result_file, fieldnames=fieldnames, restval='')
+        if result_file.tell() == 0:
+            writer.writeheader()
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                 initializer=_init_worker,
+                                 initargs=(contract_list, data_path, start_dt, end_dt,
+                                           portfolio_value, cache_path)) as executor:
+            futures = [executor.submit(evaluate, setting) for setting in settings]
+            for future in as_completed(futures):
+                row = future.result()
+                rows.append(row)
+                if result_file:
+                    writer.writerow(row)
+                    result_file.flush()
+    finally:
+        if result_file:
+            result_file.close()
+
+    df = pd.DataFrame(rows)
+    sort_by = [name for name in sort_by if name in df.columns]
+    if len(df) and sort_by:
+        df = df.sort_values(sort_by, ascending=False).reset_index(drop=True)
+    return df
@@ -1,22 +1,36 @@
-from vnpy.trader.utility import ArrayManager
 from vnpy.trader.constant import (Direction, Offset)
 from collections import defaultdict
 
-# TODO:
-# 原版海龟策略规定了4个维度的单位头寸限制，分别是
+from ta.cache import bar_indicator, BarCursor, DonchianCursor, SeriesCursor
+from ta.indicator import Donchian, Atr
+from ta.turtle.exposure import ExposureTracker
+from ta.turtle.ledger import TradeLedger
+
+# 原版海龟策略规定了4个维度的单位头寸限制，由ExposureTracker统计和检查（见ta/turtle/exposure.py）：
 #
 # 单个市场：头寸上限是4个
 # 高度关联的多个市场：单个方向头寸单位不超过6个
 # 松散关联的多个市场：某一个方向上的头寸单位不超过10个
-# 单个方向：最多12个 ??? 什么情况下可以达到12？？？
+# 单个方向：原版最多12个，这里默认10个
 
 
 MAX_PRODUCT_POS = 4         # 单品种最大持仓
+MAX_CORRELATED_POS = 6      # 高度关联市场单方向最大持仓
+MAX_LOOSE_POS = 10          # 松散关联市场单方向最大持仓
 MAX_DIRECTION_POS = 10      # 单方向最大持仓
+BUFFER_SIZE = 60            # 信号开始计算前需要的K线数
+
+# 每个品种的海龟信号参数：(入场通道周期, 出场通道周期, ATR周期, 是否检查上一笔盈利)
+SIGNAL_PARAMS = [
+    (20, 10, 20, True),     # 短周期
+    (55, 20, 20, False),    # 长周期
+]
 
 
 class TurtleResult:
     """ 用于计算单笔开平仓交易盈亏，是海龟策略中判断“若上一笔盈利当前信号无效”的基础 """
+    __slots__ = ('unit', 'entry', 'exit', 'pnl')
+
     def __init__(self):
         """初始化单位头寸，开仓均价，平仓均价和单笔开平仓交易盈亏数"""
         self.unit = 0
@@ -43,7 +57,7 @@ class TurtleSignal:
     def __init__(self, portfolio, vt_symbol,
                  entry_window, exit_window, atr_window,
                  profit_check=False):
-        """Constructor， 初始化海龟信号的策略参数（默认不检查上一笔盈亏，默认缓存60根K线）"""
+        """Constructor， 初始化海龟信号的策略参数（默认不检查上一笔盈亏，收到60根K线后开始计算）"""
         self.portfolio = portfolio  # 投资组合
 
         self.vt_symbol = vt_symbol  # 合约代码
@@ -52,7 +66,12 @@ class TurtleSignal:
         self.atr_window = atr_window  # 计算ATR周期数
         self.profit_check = profit_check  # 是否检查上一笔盈利
 
-        self.am = ArrayManager(60)  # K线容器
+        # 流式指标，每根K线O(1)更新
+        self.entry_channel = Donchian(entry_window)  # 入场通道
+        self.exit_channel = Donchian(exit_window)  # 出场通道
+        self.atr = Atr(atr_window)  # ATR
+        self.cached = False  # 是否改为读取指标缓存
+        self.bar_count = 0  # 已收到的K线数
 
         self.atr_volatility = 0  # ATR波动率
         self.entry_up = 0  # 入场通道
@@ -74,17 +93,38 @@ class TurtleSignal:
 
         self.unit = 0  # 信号持仓
         self.result = None  # 当前的交易
-        self.result_list = []  # 交易列表
+        self.open_dt = None  # 当前交易的开仓时间
+        self.ledger = TradeLedger()  # 已平仓的交易记录
         self.bar = None  # 最新K线
 
+    def use_indicator_cache(self, cache, bar_file):
+        """ 改为按K线时间读取指标缓存中预先计算的通道和ATR序列（cache为None时一次性计算），
+            随后推送的K线必须是bar_file中的K线 """
+        time = BarCursor(bar_file.time)  # 三个序列共用同一个时间轴
+        self.entry_channel = DonchianCursor(time, bar_indicator(cache, bar_file, 'max', self.entry_window),
+                                            bar_indicator(cache, bar_file, 'min', self.entry_window))
+        self.exit_channel = DonchianCursor(time, bar_indicator(cache, bar_file, 'max', self.exit_window),
+                                           bar_indicator(cache, bar_file, 'min', self.exit_window))
+        self.atr = SeriesCursor(time, bar_indicator(cache, bar_file, 'atr', self.atr_window))
+        self.cached = True
+
     def on_bar(self, bar):
         """ 缓存足够K线后，开始计算相关技术指标，判断交易信号 """
         self.bar = bar
-        self.am.update_bar(bar)
-        if not self.am.inited:
+        if self.cached:
+            dt = bar.datetime
+            self.entry_channel.seek(dt)
+            self.exit_channel.seek(dt)
+            self.atr.seek(dt)
+        else:
+            self.entry_channel.update(bar.high, bar.low)
+            self.exit_channel.update(bar.high, bar.low)
+            self.atr.update(bar.high, bar.low, bar.close)
+        self.bar_count += 1
+        if self.bar_count < BUFFER_SIZE:
             return
         self.generate_signal(bar)
-        self.calulate_indicator()
+        self.calculate_indicator()
 
     def generate_signal(self, bar):
         """
@@ -104,12 +144,12 @@ class TurtleSignal:
             long_exit = max(self.long_stop, self.exit_down)
 
             if bar.low <= long_exit:
-                self.sell(long_exit)
+                self.sell(long_exit, abs(self.unit))
                 return
         elif self.unit < 0:
             short_exit = min(self.short_stop, self.exit_up)
             if bar.high >= short_exit:
-                self.cover(short_exit)
+                self.cover(short_exit, abs(self.unit))
                 return
 
         # 没有仓位或者持有多头仓位的时候，可以做多（加仓）
@@ -154,12 +194,12 @@ class TurtleSignal:
             负责计算指标的产生，包括计算入场和止盈离场的唐奇安通道上下轨，判断到有单位持仓后，
             计算ATR指标并且设定随后8个入场位置（做多4个和做空4个），同时初始化离场价格。
         """
-        self.entry_up, self.entry_down = self.am.donchian(self.entry_window)
-        self.exit_up, self.exit_down = self.am.donchian(self.exit_window)
+        self.entry_up, self.entry_down = self.entry_channel.up, self.entry_channel.down
+        self.exit_up, self.exit_down = self.exit_channel.up, self.exit_channel.down
 
         # 有持仓后，ATR波动率和入场位等都不再变化
         if not self.unit:
-            self.atr_volatility = self.am.atr(self.atr_window)
+            self.atr_volatility = self.atr.value
 
             self.long_entry1 = self.entry_up
             self.long_entry2 = self.entry_up + self.atr_volatility * 0.5
@@ -229,25 +269,21 @@ class TurtleSignal:
 
         if not self.result:
             self.result = TurtleResult()
+            self.open_dt = self.bar.datetime if self.bar else None
         self.result.open(price, change)
 
     def close(self, price):
         """平仓
-            调用TurtleResult类定义的close函数计算单笔开平仓交易盈亏。创建列表专门缓存开平仓交易盈亏。"""
+            调用TurtleResult类定义的close函数计算单笔开平仓交易盈亏，记录到列式的交易记录中。"""
         self.unit = 0
 
         self.result.close(price)
-        self.result_list.append(self.result)
+        self.ledger.add(self.result, self.open_dt, self.bar.datetime if self.bar else None)
         self.result = None
 
     def get_last_pnl(self):
-        """ 获取上一笔交易的盈亏；
-            在开平仓交易盈亏列表中获取上一笔交易的盈亏"""
-        if not self.result_list:
-            return 0
-
-        result = self.result_list[-1]
-        return result.pnl
+        """ 获取上一笔交易的盈亏，O(1)；没有交易时为0 """
+        return self.ledger.last_pnl
 
     def calculate_trade_price(self, direction, price):
         """计算成交价格； 设置停止单价格，要求买入时，停止单成交的最优价格不能低于当前K线开盘价；
@@ -267,16 +303,25 @@ class TurtleSignal:
 class TurtlePortfolio:
     """海龟组合"""
 
-    def __init__(self, engine):
+    def __init__(self, engine, signal_params=None, max_product_pos=MAX_PRODUCT_POS,
+                 max_direction_pos=MAX_DIRECTION_POS, max_correlated_pos=MAX_CORRELATED_POS,
+                 max_loose_pos=MAX_LOOSE_POS, group_dict=None, loose_group_dict=None):
         """Constructor， 初始化海龟投资组合的组合市值（即账户资金）和多空头持仓，创建多个字典分别缓存海龟信号、每个品种持仓情况、
-            交易中的信号、合约大小、单位头寸规模、真实持仓量。"""
+            交易中的信号、合约大小、单位头寸规模、真实持仓量。信号参数和持仓上限可以设置，默认使用模块常量。
+            group_dict/loose_group_dict为 品种 -> 高度/松散关联组名，不分组时只检查单品种和单方向上限。"""
         self.engine = engine
 
+        self.signal_params = signal_params or SIGNAL_PARAMS  # 每个品种的信号参数
+        self.max_product_pos = max_product_pos  # 单品种最大持仓
+        self.max_direction_pos = max_direction_pos  # 单方向最大持仓
+
         self.signal_dict = defaultdict(list)
 
-        self.unit_dict = {}  # 每个品种的持仓情况
-        self.total_long = 0  # 总的多头持仓
-        self.total_short = 0  # 总的空头持仓
+        # 单位头寸统计，成交时增量更新
+        self.exposure = ExposureTracker(max_product_pos, max_correlated_pos, max_loose_pos,
+                                        max_direction_pos, group_dict, loose_group_dict)
+        self.unit_dict = self.exposure.unit_dict  # 每个品种的持仓情况
+        self.correlation = None  # ta.correlation.CorrelationGroups，按相关性自动分组
 
         self.trading_dict = {}  # 交易中的信号字典
 
@@ -287,24 +332,42 @@ class TurtlePortfolio:
         self.portfolio_value = 0  # 组合市值
 
     def init(self, portfolio_value, vt_symbol_list, size_dict):
-        """ 传入组合市值和合约大小字典，调用TurtleSignal类来产生短周期版本和
-            长周期版的交易信号（包括入场，止盈，止损），同时缓存到信号字典中。 """
+        """ 传入组合市值和合约大小字典，按signal_params调用TurtleSignal类来产生各周期版本
+            （默认短周期和长周期）的交易信号（包括入场，止盈，止损），同时缓存到信号字典中。 """
         self.portfolio_value = portfolio_value
         self.size_dict = size_dict
 
         for vt_symbol in vt_symbol_list:
-            signal1 = TurtleSignal(self, vt_symbol, 20, 10, 20, True)  # 短周期
-            signal2 = TurtleSignal(self, vt_symbol, 55, 20, 20, False)  # 长周期
-
             l = self.signal_dict[vt_symbol]
-            l.append(signal1)
-            l.append(signal2)
+            for entry_window, exit_window, atr_window, profit_check in self.signal_params:
+                l.append(TurtleSignal(self, vt_symbol, entry_window, exit_window, atr_window, profit_check))
 
             self.unit_dict[vt_symbol] = 0
             self.pos_dict[vt_symbol] = 0
 
+    @property
+    def total_long(self):
+        """ 总的多头持仓 """
+        return self.exposure.total_long
+
+    @property
+    def total_short(self):
+        """ 总的空头持仓 """
+        return self.exposure.total_short
+
+    def set_groups(self, group_dict=None, loose_group_dict=None):
+        """ 更新品种的关联分组 """
+        self.exposure.set_groups(group_dict, loose_group_dict)
+
+    def use_correlation_groups(self, correlation):
+        """ 由CorrelationGroups按滚动相关性定期重新分组，结果直接更新到ExposureTracker """
+        self.correlation = correlation
+        correlation.on_groups = self.set_groups
+
     def on_bar(self, bar):
         """ 根据信号字典产生具体交易委托 """
+        if self.correlation is not None:
+            self.correlation.update_bar(bar.vt_symbol, bar.datetime, bar.close)
         for signal in self.signal_dict[bar.vt_symbol]:
             signal.on_bar(bar)
 
@@ -329,26 +392,14 @@ class TurtlePortfolio:
             # 检查上一次是否为盈利
             # ZL：？？？短周期适用？？？
             if signal.profit_check:
-                pnl = signal.get_Last_pnl()
+                pnl = signal.get_last_pnl()
                 if pnl > 0:
                     return
 
-            # 买入
-            if direction == Direction.LONG:
-                # 组合持仓不能超过上限
-                if self.total_long >= MAX_DIRECTION_POS:
-                    return
-
-                # 单品种持仓不能超过上限
-                if self.unit_dict[signal.vt_symbol] >= MAX_PRODUCT_POS:
-                    return
-            # 卖出
-            else:
-                if self.total_short <= -MAX_DIRECTION_POS:
-                    return
-
-                if self.unit_dict[signal.vt_symbol] <= -MAX_PRODUCT_POS:
-                    return
+            # 单品种、关联组和单方向持仓都不能超过上限
+            side = 1 if direction == Direction.LONG else -1
+            if not self.exposure.can_open(signal.vt_symbol, side):
+                return
         # 平仓
         else:
             if direction == Direction.LONG:
@@ -380,23 +431,13 @@ class TurtlePortfolio:
 
     def send_order(self, vt_symbol, direction, offset, price, volume, multiplier):
         """ 计算单品种持仓和整体持仓，向回测引擎中发单记录 """
-        # 计算合约持仓
+        # 计算合约持仓，同时增量更新关联组和总持仓
         if direction == Direction.LONG:
-            self.unit_dict[vt_symbol] += volume
+            self.exposure.update(vt_symbol, volume)
             self.pos_dict[vt_symbol] += volume * multiplier
         else:
-            self.unit_dict[vt_symbol] -= volume
+            self.exposure.update(vt_symbol, -volume)
             self.pos_dict[vt_symbol] -= volume * multiplier
 
-        # 计算总持仓
-        self.total_long = 0
-        self.total_short = 0
-
-        for unit in self.unit_dict.values():
-            if unit > 0:
-                self.total_long += unit
-            elif unit < 0:
-                self.total_short += unit
-
         # 向回测引擎中发单记录
         self.engine.send_order(vt_symbol, direction, offset, price, volume * multiplier)
@@ -0,0 +1,280 @@
+import numpy as np
+from vnpy.trader.constant import Direction, Offset
+
+from data.bar_file import BarRecord
+from ta.cache import bar_indicator
+from ta.turtle.engine import BackTestingEngine
+from ta.turtle.strategy import TurtleResult, BUFFER_SIZE
+
+# 向量化海龟回测
+#
+# 事件驱动模式下每根K线都要逐个更新唐奇安通道和ATR。
+# 这里先对整段序列一次性计算指标，然后对每个信号在数组上查找下一个可能触发交易的K线，
+# 只在这些K线上逐根执行与TurtleSignal完全相同的判断逻辑，得到按时间排序的信号委托；
+# 最后由TurtlePortfolio按原有规则过滤并向引擎发单，结果与事件驱动模式逐笔一致。
+
+SEARCH_SIZE = 64  # 查找下一个触发点时首次检查的K线数，之后每次翻倍
+
+
+def _first_true(condition, start, end):
+    """ 在[start, end)中查找condition(lo, hi)第一个为True的位置，按倍增的分段检查，找不到返回end """
+    lo = start
+    size = SEARCH_SIZE
+    while lo < end:
+        hi = min(end, lo + size)
+        hits = np.flatnonzero(condition(lo, hi))
+        if len(hits):
+            return lo + int(hits[0])
+        lo = hi
+        size *= 2
+    return end
+
+
+class VectorSignal:
+    """ 与TurtleSignal逻辑相同的信号状态机，指标从预先计算好的数组中读取，产生的委托缓存在order_list """
+
+    def __init__(self, vt_symbol, index, entry_window, exit_window, atr_window, profit_check,
+                 open_array, high_array, low_array, indicator):
+        self.vt_symbol = vt_symbol
+        self.index = index  # 信号在组合中的顺序（同一时间戳下的推送顺序）
+        self.entry_window = entry_window
+        self.exit_window = exit_window
+        self.atr_window = atr_window
+        self.profit_check = profit_check
+
+        self.open_array = open_array
+        self.high_array = high_array
+        self.low_array = low_array
+        self.entry_up_array, self.entry_down_array, self.exit_up_array, \
+            self.exit_down_array, self.atr_array = indicator
+
+        self.atr_volatility = 0
+        self.entry_up = 0
+        self.entry_down = 0
+        self.exit_up = 0
+        self.exit_down = 0
+
+        self.long_entry = [0, 0, 0, 0]
+        self.long_stop = 0
+        self.short_entry = [0, 0, 0, 0]
+        self.short_stop = 0
+
+        self.unit = 0
+        self.result = None
+        self.last_pnl = 0
+
+        self.order_list = []  # (K线序号, 信号序号, 委托序号, 方向, 开平, 价格, 数量, ATR, 上一笔盈亏)
+
+    def run(self):
+        """ 遍历所有K线：无仓位或持仓期间都先用数组查找下一根可能触发交易的K线，跳过中间的K线 """
+        high = self.high_array
+        low = self.low_array
+        end = len(high)
+        if end < BUFFER_SIZE:
+            return
+
+        # 第一根完成初始化的K线上只计算指标
+        i = BUFFER_SIZE - 1
+        self.calculate_indicator(i)
+        i += 1
+
+        while i < end:
+            if self.unit == 0:
+                entry_up = self.entry_up_array
+                entry_down = self.entry_down_array
+                j = _first_true(lambda lo, hi: (high[lo:hi] >= entry_up[lo - 1:hi - 1]) |
+                                               (low[lo:hi] <= entry_down[lo - 1:hi - 1]), i, end)
+            elif self.unit > 0:
+                exit_down = self.exit_down_array
+                stop = self.long_stop
+                entry = self.long_entry[self.unit] if self.unit < 4 else np.inf
+                j = _first_true(lambda lo, hi: (low[lo:hi] <= np.maximum(stop, exit_down[lo - 1:hi - 1])) |
+                                               (high[lo:hi] >= entry), i, end)
+            else:
+                exit_up = self.exit_up_array
+                stop = self.short_stop
+                entry = self.short_entry[-self.unit] if self.unit > -4 else -np.inf
+                j = _first_true(lambda lo, hi: (high[lo:hi] >= np.minimum(stop, exit_up[lo - 1:hi - 1])) |
+                                               (low[lo:hi] <= entry), i, end)
+            if j >= end:
+                break
+            # 跳过的K线上没有交易，只需要刷新出场通道
+            if j > i:
+                self.calculate_indicator(j - 1)
+            self.generate_signal(j)
+            self.calculate_indicator(j)
+            i = j + 1
+
+    def generate_signal(self, i):
+        """ 与TurtleSignal.generate_signal相同 """
+        high = self.high_array[i]
+        low = self.low_array[i]
+
+        if self.unit > 0:
+            long_exit = max(self.long_stop, self.exit_down)
+            if low <= long_exit:
+                self.sell(i, long_exit)
+                return
+        elif self.unit < 0:
+            short_exit = min(self.short_stop, self.exit_up)
+            if high >= short_exit:
+                self.cover(i, short_exit)
+                return
+
+        if self.unit >= 0:
+            trade = False
+            for n in range(4):
+                if high >= self.long_entry[n] and self.unit < n + 1:
+                    self.buy(i, self.long_entry[n])
+                    trade = True
+            if trade:
+                return
+
+        if self.unit <= 0:
+            for n in range(4):
+                if low <= self.short_entry[n] and self.unit > -(n + 1):
+                    self.short(i, self.short_entry[n])
+
+    def calculate_indicator(self, i):
+        """ 与TurtleSignal.calculate_indicator相同 """
+        self.entry_up = self.entry_up_array[i]
+        self.entry_down = self.entry_down_array[i]
+        self.exit_up = self.exit_up_array[i]
+        self.exit_down = self.exit_down_array[i]
+
+        if not self.unit:
+            self.atr_volatility = self.atr_array[i]
+
+            self.long_entry = [self.entry_up,
+                               self.entry_up + self.atr_volatility * 0.5,
+                               self.entry_up + self.atr_volatility * 1,
+                               self.entry_up + self.atr_volatility * 1.5]
+            self.long_stop = 0
+
+            self.short_entry = [self.entry_down,
+                                self.entry_down - self.atr_volatility * 0.5,
+                                self.entry_down - self.atr_volatility * 1,
+                                self.entry_down - self.atr_volatility * 1.5]
+            self.short_stop = 0
+
+    def new_signal(self, i, direction, offset, price, volume):
+        self.order_list.append((i, self.index, len(self.order_list), direction, offset, price, volume,
+                                self.atr_volatility, self.last_pnl))
+
+    def buy(self, i, price):
+        price = max(self.open_array[i], price)
+        self.open(price, 1)
+        self.new_signal(i, Direction.LONG, Offset.OPEN, price, 1)
+        self.long_stop = price - self.atr_volatility * 2
+
+    def sell(self, i, price):
+        price = min(self.open_array[i], price)
+        volume = abs(self.unit)
+        self.close(price)
+        self.new_signal(i, Direction.SHORT, Offset.CLOSE, price, volume)
+
+    def short(self, i, price):
+        price = min(self.open_array[i], price)
+        self.open(price, -1)
+        self.new_signal(i, Direction.SHORT, Offset.OPEN, price, 1)
+        self.short_stop = price + self.atr_volatility * 2
+
+    def cover(self, i, price):
+        price = max(self.open_array[i], price)
+        volume = abs(self.unit)
+        self.close(price)
+        self.new_signal(i, Direction.LONG, Offset.CLOSE, price, volume)
+
+    def open(self, price, change):
+        self.unit += change
+        if not self.result:
+            self.result = TurtleResult()
+        self.result.open(price, change)
+
+    def close(self, price):
+        self.unit = 0
+        self.result.close(price)
+        self.last_pnl = self.result.pnl
+        self.result = None
+
+    def get_last_pnl(self):
+        return self.last_pnl
+
+
+class VectorBackTestingEngine(BackTestingEngine):
+    """ 向量化海龟回测引擎：数据、组合与结果计算沿用BackTestingEngine，只替换逐根K线回放 """
+
+    def run_backtesting(self):
+        if self.portfolio is None:
+            self.init_portfolio()
+        portfolio = self.portfolio
+
+        # 计算指标，生成各信号的委托
+        order_list = []
+        day_dict = {}
+        for symbol_index, vt_symbol in enumerate(self.vt_symbol_list):
+            bar_file = self.data_dict[vt_symbol]
+            open_array = np.ascontiguousarray(bar_file.open)
+            high_array = np.ascontiguousarray(bar_file.high)
+            low_array = np.ascontiguousarray(bar_file.low)
+            close_array = np.ascontiguousarray(bar_file.close)
+            time_array = np.ascontiguousarray(bar_file.time)
+            time_ns = time_array.view('int64')
+            day_dict[vt_symbol] = (time_array.astype('datetime64[D]'), time_array, close_array, bar_file)
+
+            indicator_dict = {}
+            for n, signal in enumerate(portfolio.signal_dict[vt_symbol]):
+                key = (signal.entry_window, signal.exit_window, signal.atr_window)
+                indicator = indicator_dict.get(key)
+                if indicator is None:
+                    # 设置了indicator_cache时从缓存读取，参数优化中不同参数组合共用相同周期的序列
+                    cache = self.indicator_cache
+                    indicator = (bar_indicator(cache, bar_file, 'max', signal.entry_window),
+                                 bar_indicator(cache, bar_file, 'min', signal.entry_window),
+                                 bar_indicator(cache, bar_file, 'max', signal.exit_window),
+                                 bar_indicator(cache, bar_file, 'min', signal.exit_window),
+                                 bar_indicator(cache, bar_file, 'atr', signal.atr_window))
+                    indicator_dict[key] = indicator
+
+                vector_signal = VectorSignal(vt_symbol, n, signal.entry_window, signal.exit_window,
+                                             signal.atr_window, signal.profit_check,
+                                             open_array, high_array, low_array, indicator)
+                vector_signal.run()
+                for order in vector_signal.order_list:
+                    order_list.append((int(time_ns[order[0]]), symbol_index) + order[1:] + (vector_signal,))
+
+        # 与事件驱动相同的顺序：时间戳，合约顺序，信号顺序，信号内委托顺序
+        order_list.sort(key=lambda order: order[:4])
+
+        # 按日期回放委托，每日结束后计算盈亏
+        days = np.unique(np.concatenate([d[0] for d in day_dict.values()])) if day_dict else []
+        order_index = 0
+        for day in days:
+            next_day = int((day + np.timedelta64(1, 'D')).astype('datetime64[ns]').view('int64'))
+            while order_index < len(order_list) and order_list[order_index][0] < next_day:
+                (dt, symbol_index, signal_index, order_seq, direction, offset, price, volume,
+                 atr_volatility, last_pnl, vector_signal) = order_list[order_index]
+                self.current_dt = _to_datetime(np.datetime64(dt, 'ns'))
+                # 恢复发出委托时信号的ATR和上一笔盈亏，供组合计算委托量单位和检查上一笔盈利
+                vector_signal.atr_volatility = atr_volatility
+                vector_signal.last_pnl = last_pnl
+                portfolio.new_signal(vector_signal, direction, offset, price, volume)
+                order_index += 1
+
+            for vt_symbol, (bar_days, time_array, close_array, bar_file) in day_dict.items():
+                i = np.searchsorted(bar_days, day, 'right') - 1
+                if i >= 0:
+                    self.bar_dict[vt_symbol] = BarRecord(vt_symbol, _to_datetime(time_array[i]),
+                                                         float(bar_file.open[i]), float(bar_file.high[i]),
+                                                         float(bar_file.low[i]), float(close_array[i]),
+                                                         int(bar_file.volume[i]))
+            self.current_date = day.item()
+            self.calculate_result()
+
+            # 与事件驱动相同：当日收盘价在下一日的委托之前计入相关性分组
+            if portfolio.correlation is not None:
+                portfolio.correlation.update_close({vt_symbol: bar.close for vt_symbol, bar in self.bar_dict.items()})
+
+
+def _to_datetime(value):
+    return value.astype('datetime64[us]').item()
@@ -0,0 +1,136 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from ta.statistics import calculate_statistics
+
+# 滚动前推（walk-forward）检验
+#
+# 把历史切成多个折：每折先在样本内区间优化参数，再用选出的参数回测紧接着的样本外区间，
+# 所有折的样本外每日盈亏按时间拼接为一条资金曲线，同时给出每折的参数和统计指标。
+# 样本外回测之间没有依赖，在进程池中并行执行。海龟组合的各工作进程只在初始化时映射一次全部K线文件，
+# 每个区间的回测都是memmap上的切片，样本内各参数组合和样本外回测共用同一个进程池。
+# 样本外区间从空仓开始，指标在区间开头重新预热，区间结束时的持仓按最后收盘价计算盈亏。
+
+
+def split_folds(start, end, train, test, step=None):
+    """
+    切分滚动的样本内/样本外区间
+
+    start, end: 历史起止时间
+    train, test: 样本内、样本外区间长度（timedelta或pandas.DateOffset，如DateOffset(months=6)）
+    step: 每折前移的长度，默认与test相同（样本外区间首尾相接、不重叠）
+
+    返回[(样本内开始, 样本内结束, 样本外开始, 样本外结束)]，区间均为左闭右开
+    """
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    step = step or test
+    folds = []
+    train_start = start
+    while True:
+        train_end = train_start + train
+        if train_end >= end:
+            break
+        test_end = min(train_end + test, end)
+        folds.append((train_start.to_pydatetime(), train_end.to_pydatetime(),
+                      train_end.to_pydatetime(), test_end.to_pydatetime()))
+        if test_end >= end:
+            break
+        train_start = train_start + step
+    return folds
+
+
+def stitch(folds, setting_list, score_list, result_list, capital):
+    """
+    拼接各折的样本外结果
+
+    result_list: 每折的(统计指标, 每日盈亏DataFrame)，DataFrame以日期为索引，至少有net_pnl列
+
+    返回(每折汇总DataFrame, 拼接后的每日资金曲线DataFrame, 整体统计指标)
+    """
+    rows = []
+    daily_list = []
+    for n, (fold, setting, score, (statistics, daily)) in enumerate(zip(folds, setting_list, score_list,
+                                                                        result_list)):
+        train_start, train_end, test_start, test_end = fold
+        row = {"fold": n, "train_start": train_start, "train_end": train_end,
+               "test_start": test_start, "test_end": test_end, "in_sample_score": score}
+        row.update(setting)
+        row.update(statistics)
+        rows.append(row)
+        if len(daily):
+            daily = daily.copy()
+            daily["fold"] = n
+            daily_list.append(daily)
+
+    if not daily_list:
+        return pd.DataFrame(rows), pd.DataFrame(), {}
+
+    daily = pd.concat(daily_list)
+    daily["balance"] = capital + daily["net_pnl"].cumsum()
+    daily["high_level"] = daily["balance"].cummax().clip(lower=capital)
+    daily["drawdown"] = daily["balance"] - daily["high_level"]
+
+    dates = [pd.Timestamp(date).date() for date in daily.index]
+    optional = {name: daily[name].values if name in daily else None
+                for name in ("commission", "slippage", "trade_count")}
+    statistics = calculate_statistics(daily["net_pnl"].values, capital, dates, **optional)
+    return pd.DataFrame(rows), daily, statistics
+
+
+def walk_forward(folds, select, run_fold, capital, max_workers=None, initializer=None, initargs=()):
+    """
+    通用的滚动前推检验
+
+    select(train_start, train_end) -> (参数, 样本内得分)：在主进程中依次调用，内部可以自行并行
+    run_fold(参数, test_start, test_end) -> (统计指标, 每日盈亏DataFrame)：在进程池中并行执行，须可序列化
+    initializer/initargs: 进程池的初始化函数，用于在每个工作进程中加载一次数据
+
+    返回值同stitch
+    """
+    selections = [select(train_start, train_end) for train_start, train_end, _, _ in folds]
+    setting_list = [setting for setting, _ in selections]
+    score_list = [score for _, score in selections]
+
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=initializer,
+                             initargs=initargs) as executor:
+        futures = [executor.submit(run_fold, setting, test_start, test_end)
+                   for setting, (_, _, test_start, test_end) in zip(setting_list, folds)]
+        result_list = [future.result() for future in futures]
+    return stitch(folds, setting_list, score_list, result_list, capital)
+
+
+def walk_forward_turtle(settings, contract_list, data_path, folds, portfolio_value=1000000,
+                        target="sharpe_ratio", max_workers=None, cache_path=None):
+    """
+    海龟组合的滚动前推检验：每折在样本内回测settings中的全部参数，取target最大的用于样本外
+
+    settings: 参数设置列表（ta.turtle.optimize.grid_settings或random_settings的结果）
+    contract_list: add_contract的参数元组列表
+    data_path: 二进制K线文件所在目录
+    folds: split_folds的结果
+    """
+    from ta.turtle.optimize import _init_worker, evaluate, evaluate_daily
+
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(contract_list, data_path, None, None, portfolio_value,
+                                       cache_path)) as executor:
+        # 全部折的样本内回测一起提交
+        in_sample = [[executor.submit(evaluate, setting, train_start, train_end) for setting in settings]
+                     for train_start, train_end, _, _ in folds]
+
+        setting_list = []
+        score_list = []
+        for futures in in_sample:
+            rows = [future.result() for future in futures]
+            best = max(rows, key=lambda row: row.get(target, float("-inf")))
+            setting_list.append({name: best[name] for name in settings[0]})
+            score_list.append(best.get(target))
+
+        futures = [executor.submit(evaluate_daily, setting, test_start, test_end)
+                   for setting, (_, _, test_start, test_end) in zip(setting_list, folds)]
+        result_list = [future.result() for future in futures]
+
+    return stitch(folds, setting_list, score_list, result_list, portfolio_value)
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from advsfinml.bars import (TimeBarBuilder, ThresholdBarBuilder, ImbalanceBarBuilder, RunBarBuilder,
+                            imbalance_bars, run_bars)
+
+SIZE = 200000
+
+
+def make_trades(size=SIZE, seed=0):
+    rng = np.random.default_rng(seed)
+    time = np.datetime64('2018-11-27', 'ns') + (np.cumsum(rng.exponential(0.2, size)) * 1e9).astype('timedelta64[ns]')
+    price = np.round(4000 * np.exp(np.cumsum(rng.normal(0, 0.0001, size))) * 2) / 2
+    volume = rng.integers(1, 5000, size).astype(np.float64)
+    return time, price, volume
+
+
+def build(builder, trades, chunk_size):
+    time, price, volume = trades
+    frames = [builder.update(time[i:i + chunk_size], price[i:i + chunk_size], volume[i:i + chunk_size])
+              for i in range(0, len(time), chunk_size)]
+    frames.append(builder.flush())
+    return pd.concat(frames, ignore_index=True)
+
+
+BUILDERS = {
+    'time': lambda: TimeBarBuilder('15Min'),
+    'tick': lambda: ThresholdBarBuilder(1000, 'tick'),
+    'volume': lambda: ThresholdBarBuilder(2000000, 'volume'),
+    'dollar': lambda: ThresholdBarBuilder(8e9, 'dollar'),
+    'tick_imbalance': lambda: ImbalanceBarBuilder(expected_ticks=1000, measure='tick', min_ticks=100,
+                                                  max_ticks=10000),
+    'volume_imbalance': lambda: ImbalanceBarBuilder(expected_ticks=1000, measure='volume', min_ticks=100,
+                                                    max_ticks=10000),
+    'tick_run': lambda: RunBarBuilder(expected_ticks=1000, measure='tick'),
+    'volume_run': lambda: RunBarBuilder(expected_ticks=1000, measure='volume'),
+}
+
+
+@pytest.mark.parametrize('name', list(BUILDERS))
+@pytest.mark.parametrize('chunk_size', [200, 997, 50000])
+def test_chunked_bars_equal_whole_day(name, chunk_size):
+    trades = make_trades()
+    whole = build(BUILDERS[name](), trades, SIZE)
+    chunked = build(BUILDERS[name](), trades, chunk_size)
+    assert len(whole) > 10
+    pd.testing.assert_frame_equal(chunked, whole, check_exact=False, rtol=1e-9)
+
+
+@pytest.mark.parametrize('name', ['tick_imbalance', 'volume_run'])
+def test_fewer_trades_than_expected_ticks(name):
+    trades = make_trades(600)
+    whole = build(BUILDERS[name](), trades, 600)
+    chunked = build(BUILDERS[name](), trades, 50)
+    assert len(whole)
+    pd.testing.assert_frame_equal(chunked, whole, check_exact=False, rtol=1e-9)
+
+
+def test_batch_functions_match_builders():
+    time, price, volume = make_trades()
+    data = pd.DataFrame({'timestamp': time, 'price': price, 'foreignNotional': volume})
+    pd.testing.assert_frame_equal(imbalance_bars(data, expected_ticks=1000),
+                                  ImbalanceBarBuilder(expected_ticks=1000).update(time, price, volume))
+    pd.testing.assert_frame_equal(run_bars(data, expected_ticks=1000),
+                                  RunBarBuilder(expected_ticks=1000).update(time, price, volume))
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from benchmarks import synthetic
+from ta.cache import CursorError, DonchianCursor, IndicatorCache, SeriesCursor, bar_indicator
+from ta.indicator import Atr, Donchian
+from ta.turtle.engine import BackTestingEngine
+
+
+def test_cursor_follows_bar_time():
+    bar_file = synthetic.bar_file('S0.LOCAL', 500)
+    bars = list(bar_file)
+    cursor = SeriesCursor(bar_file.time, bar_indicator(None, bar_file, 'atr', 20))
+    channel = DonchianCursor(bar_file.time, bar_indicator(None, bar_file, 'max', 20),
+                             bar_indicator(None, bar_file, 'min', 20))
+    atr = Atr(20)
+    donchian = Donchian(20)
+    expected = []
+    for bar in bars:
+        expected.append((atr.update(bar.high, bar.low, bar.close), donchian.update(bar.high, bar.low)))
+
+    # start mid-file and skip bars: every value is still the one of its bar
+    for n in list(range(100, 200)) + list(range(250, 500, 7)):
+        value, (up, down) = expected[n]
+        assert cursor.seek(bars[n].datetime) == pytest.approx(value, nan_ok=True)
+        assert channel.seek(bars[n].datetime) == (up, down)
+    assert cursor.seek(np.datetime64(bars[50].datetime)) == pytest.approx(expected[50][0], nan_ok=True)
+
+
+def test_cursor_rejects_unknown_bars():
+    bar_file = synthetic.bar_file('S0.LOCAL', 100)
+    bars = list(bar_file)
+    cursor = SeriesCursor(bar_file.time, bar_indicator(None, bar_file, 'mean', 10))
+    cursor.seek(bars[10].datetime)
+    with pytest.raises(CursorError):
+        cursor.seek(bars[10].datetime.replace(second=30))
+    with pytest.raises(CursorError):
+        cursor.seek(bars[-1].datetime + (bars[-1].datetime - bars[-2].datetime))
+    assert cursor.cursor.index == 10
+
+
+def test_engine_with_indicator_cache():
+    def run(cache):
+        engine = BackTestingEngine()
+        engine.portfolio_value = 1000000
+        engine.add_contract('S0.LOCAL', 10, 0.01)
+        engine.data_dict['S0.LOCAL'] = synthetic.bar_file('S0.LOCAL', 5000)
+        engine.indicator_cache = cache
+        engine.run_backtesting()
+        return engine.fill_ledger.to_dataframe()
+
+    expected = run(None)
+    assert len(expected) > 0
+    # the engine only uses the cursors when a cache is set
+    assert run(IndicatorCache()).equals(expected)
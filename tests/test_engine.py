@@ -0,0 +1,30 @@
+from benchmarks import synthetic
+from ta.turtle.engine import BackTestingEngine
+
+
+def make_engine(portfolio_value, size=3000):
+    engine = BackTestingEngine()
+    engine.portfolio_value = portfolio_value
+    engine.add_contract('S0.LOCAL', 10, 0.01)
+    engine.data_dict['S0.LOCAL'] = synthetic.bar_file('S0.LOCAL', size)
+    return engine
+
+
+def test_default_capital():
+    # without capital no unit can be sized: nothing is traded and the statistics are all zero
+    engine = make_engine(BackTestingEngine().portfolio_value)
+    engine.run_backtesting()
+    assert len(engine.fill_ledger.to_dataframe()) == 0
+    running = engine.running_statistics.result()
+    statistics = engine.calculate_statistics()
+    for result in (running, statistics):
+        assert result['total_trade_count'] == 0
+        assert result['total_return'] == 0
+        assert result['sharpe_ratio'] == 0
+
+
+def test_capital():
+    engine = make_engine(10_000_000)
+    engine.run_backtesting()
+    assert len(engine.fill_ledger.to_dataframe()) > 0
+    assert engine.calculate_statistics()['total_trade_count'] > 0
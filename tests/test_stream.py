@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import pytest
+
+import data.oanda.stream as stream_module
+from data.oanda.standin import StandinServer
+from data.oanda.stream import COALESCE_LATEST, DROP_OLDEST, PricingStream
+
+INSTRUMENTS = ['EUR_USD', 'USD_JPY', 'GBP_USD']
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """
+    The backoff delays the stream asked for, each shortened to a few milliseconds
+    """
+    delays = []
+
+    def backoff_delay(attempt):
+        delays.append(attempt)
+        return 0.01
+
+    monkeypatch.setattr(stream_module, 'backoff_delay', backoff_delay)
+    return delays
+
+
+def run_until(stream, done, timeout=10):
+    """
+    Run the stream until done() is true, then stop it
+    """
+    async def main():
+        task = asyncio.ensure_future(stream.run())
+        deadline = time.monotonic() + timeout
+        while not done() and not task.done():
+            assert time.monotonic() < deadline, 'the stream did not get there in {}s'.format(timeout)
+            await asyncio.sleep(0.01)
+        stream.stop()
+        await task
+
+    asyncio.run(main())
+
+
+def test_reconnect_after_clean_end(delays):
+    with StandinServer(stream_rate=None, stream_limit=20) as server:
+        stream = PricingStream(INSTRUMENTS, config=server.make_config())
+        run_until(stream, lambda: stream.price_count >= 60)
+        assert server.stats['requests'] >= 3
+    # every clean end is backed off, and the attempt count restarts once prices arrive
+    assert len(delays) >= 2
+    assert set(delays) == {1}
+
+
+def test_clean_end_without_messages_gives_up(delays):
+    with StandinServer(stream_rate=None, stream_limit=0) as server:
+        stream = PricingStream(INSTRUMENTS, config=server.make_config())
+        with pytest.raises(ConnectionError):
+            asyncio.run(stream.run(max_retries=3))
+        assert server.stats['requests'] == 4
+    assert delays == [1, 2, 3]
+    assert not stream.running
+
+
+def test_heartbeats(delays):
+    with StandinServer(stream_rate=100, heartbeat_interval=0.05) as server:
+        stream = PricingStream(INSTRUMENTS, config=server.make_config())
+        run_until(stream, lambda: stream.heartbeat_count >= 3)
+        assert stream.price_count > 0
+        assert server.stats['heartbeats'] >= stream.heartbeat_count
+    assert delays == []
+
+
+def test_drop_oldest(delays):
+    with StandinServer(stream_rate=None) as server:
+        stream = PricingStream(INSTRUMENTS, config=server.make_config())
+        queue = stream.subscribe(maxsize=5, policy=DROP_OLDEST)
+        eur_queue = stream.subscribe(['EUR_USD'], maxsize=5, policy=DROP_OLDEST)
+        run_until(stream, lambda: stream.price_count >= 50)
+
+    assert len(queue) == 5
+    assert queue.dropped == stream.price_count - 5
+    prices = [queue.get_nowait() for _ in range(5)]
+    assert queue.get_nowait() is None
+    # the newest prices are kept, oldest first
+    assert [p.time for p in prices] == sorted(p.time for p in prices)
+    assert len(eur_queue) == 5
+    assert all(eur_queue.get_nowait().instrument == 'EUR_USD' for _ in range(5))
+
+
+def test_coalesce_latest(delays):
+    with StandinServer(stream_rate=None) as server:
+        stream = PricingStream(INSTRUMENTS, config=server.make_config())
+        queue = stream.subscribe(policy=COALESCE_LATEST)
+        run_until(stream, lambda: stream.price_count >= 50)
+
+    assert len(queue) == len(INSTRUMENTS)
+    assert queue.dropped == stream.price_count - len(INSTRUMENTS)
+    prices = [queue.get_nowait() for _ in INSTRUMENTS]
+    assert sorted(p.instrument for p in prices) == sorted(INSTRUMENTS)
+    assert queue.get_nowait() is None
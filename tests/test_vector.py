@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+
+from benchmarks import synthetic
+from ta.cache import IndicatorCache
+from ta.turtle.engine import BackTestingEngine
+from ta.turtle.vector import VectorBackTestingEngine
+
+
+def run(engine_class, symbol_count, interval, size=3000, cache=None):
+    engine = engine_class()
+    engine.portfolio_value = 10_000_000
+    engine.indicator_cache = cache
+    for n in range(symbol_count):
+        symbol = 'S{}.LOCAL'.format(n)
+        engine.add_contract(symbol, 10 * (n + 1), 0.01)
+        engine.data_dict[symbol] = synthetic.bar_file(symbol, size, interval=interval, price=100.0 * (n + 1),
+                                                      seed=n)
+    engine.run_backtesting()
+    return engine
+
+
+@pytest.mark.parametrize('interval', [timedelta(minutes=1), timedelta(hours=1), timedelta(days=1)])
+@pytest.mark.parametrize('symbol_count', [1, 4, 6])
+def test_vector_matches_event_driven(symbol_count, interval):
+    expected = run(BackTestingEngine, symbol_count, interval)
+    vector = run(VectorBackTestingEngine, symbol_count, interval)
+
+    fills = expected.fill_ledger.to_dataframe()
+    assert len(fills) > 0
+    pd.testing.assert_frame_equal(vector.fill_ledger.to_dataframe(), fills)
+    assert vector.calculate_statistics() == expected.calculate_statistics()
+
+
+def test_vector_with_indicator_cache():
+    expected = run(BackTestingEngine, 4, timedelta(minutes=1))
+    vector = run(VectorBackTestingEngine, 4, timedelta(minutes=1), cache=IndicatorCache())
+    pd.testing.assert_frame_equal(vector.fill_ledger.to_dataframe(), expected.fill_ledger.to_dataframe())